@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# bench_trend.py
+#
+#  Author: Wolf, E.T.
+#
+#  Repeatable benchmark of the trend.py pipeline on a directory of
+#  history files (normally written by make_synthetic.py). Times the
+#  file scan, read_monthly_files per component, compute_running_means,
+#  running_stats, print2text, print2binary and plotting separately, and writes the
+#  results to a JSON file that can be compared between commits.
+#
+#  Usage:
+#    python make_synthetic.py /tmp/bench --months 240 --res 1.9x2.5
+#    python bench_trend.py /tmp/bench [--case bench] [--jobs 4] \
+#        [--prefetch 4] [--backend auto] [--repeat 3] [--out bench.json] \
+#        [--compare old.json]
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import netCDF4 as nc
+import matplotlib
+matplotlib.use('Agg')
+import trend_core  as core
+import trend_io
+import trend_utils as trend
+
+# component -> (file prefix, native-grid weights name or None, series name)
+COMPONENTS = {
+    'cam':  ('.cam.h0.',  None,   'atm'),
+    'cice': ('.cice.h.',  'cice', 'ice'),
+    'clm':  ('.clm2.h0.', 'clm',  'lnd'),
+}
+
+
+def data_variables(filepath):
+    """Names of the (time, y, x) variables in a history file."""
+    with nc.Dataset(filepath, 'r') as ncid:
+        return [name for name, var in ncid.variables.items()
+                if var.ndim == 3 and var.dimensions[0] == 'time']
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def timed(results, label, repeat, func):
+    """Run func `repeat` times; record min and mean wall time under label."""
+    times = []
+    value = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            value = func()
+        times.append(time.perf_counter() - t0)
+    results[label] = {'min': min(times), 'mean': float(np.mean(times)), 'n': repeat}
+    print('  {:<36} {:8.3f}s  (mean {:.3f}s)'.format(label, min(times), np.mean(times)))
+    return value
+
+
+def run(args):
+    results = {}
+    present = {}
+
+    # file scan
+    def _scan():
+        out = {}
+        for name in args.components:
+            index = core.index_monthly_files(args.datadir, args.case, COMPONENTS[name][0])
+            out[name] = (index, core.consecutive_months(index, args.start_year, args.months))
+        return out
+    scans = timed(results, 'file scan', args.repeat, _scan)
+    for name in args.components:
+        if scans[name][1]:
+            present[name] = scans[name]
+    if not present:
+        sys.exit('Error: no {} history files found in {}'.format(args.case, args.datadir))
+    N = min(len(files) for _, files in present.values())
+
+    # grid and weights from the first CAM-style file of each component
+    weights = {}
+    varnames = {}
+    for name, (index, files) in present.items():
+        varnames[name] = data_variables(files[0])
+        native = COMPONENTS[name][1]
+        w = core.load_native_weights(files[0], native) if native else None
+        if w is None:
+            with nc.Dataset(files[0], 'r') as ncid:
+                lat = ncid.variables['lat'][:] if 'lat' in ncid.variables else ncid.variables['TLAT'][:, 0]
+                lon = ncid.variables['lon'][:] if 'lon' in ncid.variables else ncid.variables['TLON'][0, :]
+            w = core.build_area_weights(np.asarray(lon), np.asarray(lat))
+        weights[name] = w
+
+    # reads, with the I/O backend chosen (or probed) outside the timings
+    trend_io.set_backend(args.backend)
+    for name, (index, files) in present.items():
+        trend_io.prepare(files[0], varnames[name])
+    gm = {}
+    for name, (index, files) in present.items():
+        gm[name] = timed(results, 'read_monthly_files ({})'.format(name), args.repeat,
+                         lambda: core.read_monthly_files(args.datadir, args.case, COMPONENTS[name][0],
+                                                         varnames[name], args.start_year, N,
+                                                         weights[name], jobs=args.jobs,
+                                                         index=index, prefetch=args.prefetch)[0])
+
+    # one ComponentSeries per component, as in trend.py
+    int1 = min(12, N)
+    int2 = min(120, N)
+
+    def _running():
+        out = {}
+        for name in present:
+            series = core.ComponentSeries.from_array(COMPONENTS[name][2], varnames[name],
+                                                     gm[name], int1, int2)
+            series.intavg1      # statistics are computed on first use
+            out[name] = series
+        return out
+    series = timed(results, 'compute_running_means', args.repeat, _running)
+    timed(results, 'running_stats (int2)', args.repeat,
+          lambda: [s.window_stats(int2) for s in series.values()])
+
+    A, I, L = series.get('cam'), series.get('cice'), series.get('clm')
+    vA = varnames.get('cam', [])
+    firstDate = '{:04d}-01'.format(args.start_year)
+    lastDate  = '{:04d}-{:02d}'.format(args.start_year + N // 12, N % 12 + 1)
+
+    workdir = tempfile.mkdtemp(prefix='bench_trend_')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.makedirs(os.path.join(workdir, 'plots', 'snapshots'))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        timed(results, 'print2text', args.repeat,
+              lambda: trend.print2text(vA, varnames.get('clm', []), varnames.get('cice', []),
+                                       A, L, I, firstDate, lastDate, args.case))
+        timed(results, 'print2binary', args.repeat,
+              lambda: trend.print2binary(A, L, I, firstDate, lastDate, args.case))
+        plotvars = vA[:args.plot_vars]
+        timed(results, 'timeSeriesPlots ({} vars)'.format(len(plotvars)), args.repeat,
+              lambda: trend.timeSeriesPlots(plotvars, [], [], A, None, None,
+                                            firstDate, lastDate, args.case, jobs=args.jobs))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {
+        'datadir': os.path.abspath(args.datadir), 'case': args.case, 'months': N,
+        'components': sorted(present), 'jobs': args.jobs, 'prefetch': args.prefetch,
+        'backend': args.backend, 'backends': trend_io.get_state()[1],
+        'repeat': args.repeat,
+        'nvars': {name: len(v) for name, v in varnames.items()},
+        'grid': {name: list(np.shape(w)) for name, w in weights.items()},
+    }
+    return {
+        'label': args.label, 'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'host': platform.node(), 'config': config, 'results': results,
+    }
+
+
+def compare(current, baseline):
+    """Print min times of two result sets side by side."""
+    print('\n  {:<36} {:>10} {:>10} {:>8}'.format(
+        'phase', baseline.get('commit') or 'baseline', current.get('commit') or 'current', 'ratio'))
+    for label, r in current['results'].items():
+        old = baseline['results'].get(label)
+        if old is None:
+            print('  {:<36} {:>10} {:10.3f}'.format(label, '-', r['min']))
+            continue
+        ratio = r['min'] / old['min'] if old['min'] > 0 else float('nan')
+        print('  {:<36} {:10.3f} {:10.3f} {:7.2f}x'.format(label, old['min'], r['min'], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trend.py pipeline.')
+    parser.add_argument('datadir', help='Directory of history files (e.g. from make_synthetic.py)')
+    parser.add_argument('--case', default='bench', help='Case name (default: bench)')
+    parser.add_argument('--components', nargs='+', choices=sorted(COMPONENTS),
+                        default=['cam', 'cice', 'clm'], help='Components to time (default: all found)')
+    parser.add_argument('--start-year', type=int, default=1, dest='start_year',
+                        help='First model year (default: 1)')
+    parser.add_argument('--months', type=int, default=6000, help='Maximum months to read (default: 6000)')
+    parser.add_argument('--jobs', type=int, default=1, help='Worker processes for reads (default: 1)')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Files read ahead in a background thread when --jobs is 1 (default: 0)')
+    parser.add_argument('--backend', default='auto', choices=['auto'] + list(trend_io.BACKENDS),
+                        help='I/O backend for reads (default: auto, fastest installed per file format)')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per phase (default: 3)')
+    parser.add_argument('--plot-vars', type=int, default=4, dest='plot_vars',
+                        help='Number of atm variables to plot (default: 4)')
+    parser.add_argument('--label', default='', help='Free-form label stored with the results')
+    parser.add_argument('--out', default='bench.json', help='JSON results file (default: bench.json)')
+    parser.add_argument('--compare', default=None, help='Earlier JSON results file to compare against')
+    args = parser.parse_args()
+
+    print('Benchmarking {} in {}'.format(args.case, args.datadir))
+    current = run(args)
+    with open(args.out, 'w') as f:
+        json.dump(current, f, indent=2)
+    print('  results written to {}'.format(args.out))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(current, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# make_synthetic.py
+#
+#  Author: Wolf, E.T.
+#
+#  Writes synthetic CAM/CICE/CLM monthly history files for testing
+#  and benchmarking trend.py. Files follow the CESM naming used by
+#  trend.py (case.cam.h0.YYYY-MM.nc, case.cice.h.YYYY-MM.nc,
+#  case.clm2.h0.YYYY-MM.nc) and carry the coordinate, area and mask
+#  variables the readers look for.
+#
+#  Usage:
+#    python make_synthetic.py /path/to/outdir \
+#        [--case bench] [--res 4x5|1.9x2.5|0.9x1.25|0.47x0.63|0.25x0.25] \
+#        [--months 120] [--nvars 8] [--components cam cice clm] \
+#        [--compress 0-9] [--mask-frac 0.7] [--format NETCDF4] \
+#        [--nvars3d 2]
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import argparse
+import os
+import numpy as np
+import netCDF4 as nc
+
+# (dlat, dlon) in degrees for the standard finite-volume grids
+RESOLUTIONS = {
+    '4x5':       (4.0,  5.0),
+    '1.9x2.5':   (180.0 / 95, 2.5),
+    '0.9x1.25':  (180.0 / 191, 1.25),
+    '0.47x0.63': (180.0 / 383, 0.625),
+    '0.25x0.25': (0.25, 0.25),
+}
+
+# component -> (file prefix, variable names used in vars.in)
+COMPONENTS = {
+    'cam':  ('.cam.h0.',  ['TS', 'FLNT', 'FSNT', 'FLNS', 'FSNS', 'LHFLX', 'SHFLX', 'ICEFRAC']),
+    'cice': ('.cice.h.',  ['Tsfc', 'qi', 'qs', 'hi', 'hs', 'vicen005']),
+    'clm':  ('.clm2.h0.', ['TG']),
+}
+
+# CAM (time, lev, lat, lon) variables written with --nvars3d
+LEVEL_VARS = ['T', 'Q', 'U', 'V', 'OMEGA', 'Z3']
+NLEV = 26
+
+FILL = np.float32(1.0e30)
+
+
+def grid(res):
+    """Cell-centre lat/lon arrays for a resolution key."""
+    dlat, dlon = RESOLUTIONS[res]
+    nlat = int(round(180.0 / dlat)) + 1
+    lat  = np.linspace(-90.0, 90.0, nlat)
+    lon  = np.arange(0.0, 360.0, dlon)
+    return lat, lon
+
+
+def variable_names(component, nvars):
+    """The component's standard names, padded with V001, V002, ... to nvars."""
+    names = list(COMPONENTS[component][1])[:nvars]
+    names += ['V{:03d}'.format(k + 1) for k in range(nvars - len(names))]
+    return names
+
+
+def hybrid_coefficients():
+    """
+    hyai, hybi of NLEV+1 interfaces from 2 hPa to the surface: pure
+    pressure above 200 hPa, terrain-following below.
+    """
+    eta  = np.linspace(0.002, 1.0, NLEV + 1)
+    hybi = ((eta - 0.2) / 0.8).clip(0.0, 1.0)
+    return eta - hybi, hybi
+
+
+def write_month(path, component, names, lat, lon, it, mask, rng, args):
+    """Write one monthly history file for one component."""
+    nlat, nlon = len(lat), len(lon)
+    zlib = args.compress > 0 and args.format.startswith('NETCDF4')
+    comp = dict(zlib=zlib, complevel=args.compress) if zlib else {}
+
+    f = nc.Dataset(path, 'w', format=args.format)
+    f.createDimension('time', None)
+    f.createVariable('time', 'f8', ('time',))[:] = [it * 30.0]
+
+    if component == 'cice':
+        ydim, xdim = 'nj', 'ni'
+    else:
+        ydim, xdim = 'lat', 'lon'
+    f.createDimension(ydim, nlat)
+    f.createDimension(xdim, nlon)
+
+    if component == 'cice':
+        lat2d = np.repeat(lat[:, None], nlon, axis=1)
+        lon2d = np.repeat(lon[None, :], nlat, axis=0)
+        f.createVariable('TLAT', 'f4', (ydim, xdim))[:] = lat2d
+        f.createVariable('TLON', 'f4', (ydim, xdim))[:] = lon2d
+        area = np.cos(np.deg2rad(lat2d)).clip(1.0e-6) * 1.0e10
+        f.createVariable('tarea', 'f4', (ydim, xdim))[:] = area
+        f.createVariable('tmask', 'f4', (ydim, xdim))[:] = (~mask).astype(np.float32)
+    else:
+        f.createVariable('lat', 'f8', ('lat',))[:] = lat
+        f.createVariable('lon', 'f8', ('lon',))[:] = lon
+    if component == 'cam':
+        f.createDimension('lev', NLEV)
+        f.createVariable('lev', 'f8', ('lev',))[:] = np.linspace(3.0, 992.0, NLEV)
+    if component == 'cam' and args.nvars3d > 0:
+        hyai, hybi = hybrid_coefficients()
+        f.createDimension('ilev', NLEV + 1)
+        f.createVariable('hyai', 'f8', ('ilev',))[:] = hyai
+        f.createVariable('hybi', 'f8', ('ilev',))[:] = hybi
+        f.createVariable('P0', 'f8', ())[...] = 1.0e5
+        ps = 1.0e5 + 500.0 * rng.standard_normal((nlat, nlon))
+        f.createVariable('PS', 'f4', ('time', 'lat', 'lon'), **comp)[0, :, :] = ps.astype(np.float32)
+        for k in range(args.nvars3d):
+            name = LEVEL_VARS[k] if k < len(LEVEL_VARS) else 'L{:03d}'.format(k + 1)
+            var  = f.createVariable(name, 'f4', ('time', 'lev', 'lat', 'lon'), **comp)
+            data = (200.0 + 10.0 * k + np.linspace(0.0, 80.0, NLEV)[:, None, None]
+                    + 5.0 * np.sin(2.0 * np.pi * (it % 12) / 12.0)
+                    + rng.standard_normal((NLEV, nlat, nlon)))
+            var[0, :, :, :] = data.astype(np.float32)
+    if component == 'clm':
+        area = np.outer(np.cos(np.deg2rad(lat)).clip(1.0e-6), np.ones(nlon)) * 1.0e4
+        f.createVariable('area', 'f4', ('lat', 'lon'))[:] = area
+        f.createVariable('landfrac', 'f4', ('lat', 'lon'))[:] = (~mask).astype(np.float32)
+
+    season = np.sin(2.0 * np.pi * (it % 12) / 12.0)
+    for k, name in enumerate(names):
+        fill = None if component == 'cam' else FILL
+        var  = f.createVariable(name, 'f4', ('time', ydim, xdim), fill_value=fill, **comp)
+        data = (250.0 + k + 5.0 * season + 0.01 * it
+                + rng.standard_normal((nlat, nlon)).astype(np.float32))
+        if component != 'cam':
+            data = np.where(mask, FILL, data)
+        var[0, :, :] = data.astype(np.float32)
+    f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write synthetic CAM/CICE/CLM monthly history files.')
+    parser.add_argument('outdir', help='Directory to write files into')
+    parser.add_argument('--case', default='bench', help='Case name (default: bench)')
+    parser.add_argument('--res', choices=sorted(RESOLUTIONS), default='4x5',
+                        help='Horizontal resolution (default: 4x5)')
+    parser.add_argument('--months', type=int, default=120, help='Number of months (default: 120)')
+    parser.add_argument('--start-year', type=int, default=1, dest='start_year',
+                        help='First model year (default: 1)')
+    parser.add_argument('--nvars', type=int, default=8,
+                        help='Variables per component file (default: 8)')
+    parser.add_argument('--components', nargs='+', choices=sorted(COMPONENTS),
+                        default=['cam', 'cice', 'clm'], help='Components to write (default: all)')
+    parser.add_argument('--compress', type=int, default=0,
+                        help='zlib compression level 0-9 for NETCDF4 formats (default: 0)')
+    parser.add_argument('--mask-frac', type=float, default=0.7, dest='mask_frac',
+                        help='Fraction of cells masked in ice and land fields (default: 0.7)')
+    parser.add_argument('--format', default='NETCDF4',
+                        choices=['NETCDF4', 'NETCDF4_CLASSIC', 'NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET'],
+                        help='netCDF file format (default: NETCDF4)')
+    parser.add_argument('--nvars3d', type=int, default=0,
+                        help='(time, lev, lat, lon) variables in the CAM files, with hyai/hybi/P0/PS (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    lat, lon = grid(args.res)
+    rng  = np.random.default_rng(args.seed)
+    mask = rng.random((len(lat), len(lon))) < args.mask_frac
+
+    for component in args.components:
+        prefix = COMPONENTS[component][0]
+        names  = variable_names(component, args.nvars)
+        for it in range(args.months):
+            year  = args.start_year + it // 12
+            month = it % 12 + 1
+            path  = os.path.join(args.outdir, '{}{}{:04d}-{:02d}.nc'.format(args.case, prefix, year, month))
+            write_month(path, component, names, lat, lon, it, mask, rng, args)
+        print('  wrote {} {} files ({}x{}, {} vars)'.format(
+            args.months, component, len(lat), len(lon), len(names)))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,25 +5,26 @@
 #  Author: Wolf, E.T.
 #
 #  Offline multi-case time-series plotter.
-#  Reads 1-N data files written by trend.py --data and overlays
-#  them on shared axes for presentation-quality figures.
+#  Reads 1-N data files written by trend.py --save-data and overlays
+#  them on shared axes for presentation-quality figures. Binary
+#  (.npy + .json) files are opened memory-mapped and only the
+#  plotted columns are read; text files are parsed in full.
 #
 #  Usage:
-#    python plot_trends.py data/file1.txt [data/file2.txt ...] \
+#    python plot_trends.py data/file1.npy [data/file2.txt ...] \
 #        --vars TS ICEFRAC energy_top \
-#        [--freq native|int1|int2] \
-#        [--xlabel LABEL] [--outdir plots/]
+#        [--freq native|int1|int2|slope1|slope2] \
+#        [--xlabel LABEL] [--outdir plots/] [--jobs N]
 #
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 import argparse
+import json
 import os
 import re
 import sys
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import trend_render
 
 # ---------------------------------------------------------------
 # colour / line-style cycle so N cases are visually distinct
@@ -44,18 +45,63 @@ def _style(idx):
 # helpers
 # ---------------------------------------------------------------
 def parse_case_id(filepath):
-    """Extract case_id from filename: <case_id>_<firstDate>-<lastDate>_<model>.txt"""
+    """Extract case_id from filename: <case_id>_<firstDate>-<lastDate>_<model>.txt|.npy"""
     base = os.path.basename(filepath)
     # strip _<YYYY-MM>-<YYYY-MM>_cam/cice/clm.txt suffix
-    m = re.match(r'^(.+)_\d{4}-\d{2}-\d{4}-\d{2}_\w+\.txt$', base)
+    m = re.match(r'^(.+)_\d{4}-\d{2}-\d{4}-\d{2}_\w+\.(txt|npy)$', base)
     if m:
         return m.group(1)
     # fallback: strip extension
     return os.path.splitext(base)[0]
 
 
+class BinaryColumns:
+    """
+    Read-only {colname: array} view of a binary data file.
+
+    Column names follow the text files (TS_native, TS_int1, TS_int2)
+    plus the slopes (TS_slope1, TS_slope2). The array is opened with
+    np.load(mmap_mode='r'), so a column is only read from disk when it
+    is looked up, and each column is one contiguous block.
+    """
+
+    def __init__(self, filepath, meta):
+        self._array  = np.load(filepath, mmap_mode='r')
+        self._fields = {f: k for k, f in enumerate(meta['fields'])}
+        self._cols   = {c: j for j, c in enumerate(meta['columns'])}
+        self.header  = ['month'] + ['{}_{}'.format(c, f) for c in meta['columns']
+                                    for f in meta['fields']]
+
+    def _split(self, name):
+        var, _, field = name.rpartition('_')
+        return self._cols.get(var), self._fields.get(field)
+
+    def __contains__(self, name):
+        return None not in self._split(name)
+
+    def __getitem__(self, name):
+        j, k = self._split(name)
+        if j is None or k is None:
+            raise KeyError(name)
+        return self._array[k, j]
+
+
+def read_metadata(filepath):
+    """Metadata of a binary data file, from the .json next to the .npy."""
+    with open(os.path.splitext(filepath)[0] + '.json') as f:
+        return json.load(f)
+
+
 def load_file(filepath):
-    """Return (header list, month array, data dict {colname: array})."""
+    """Return (header list, month array, data dict {colname: array}).
+
+    For binary (.npy) files the dict is a memory-mapped BinaryColumns.
+    """
+    if filepath.endswith('.npy'):
+        meta   = read_metadata(filepath)
+        cols   = BinaryColumns(filepath, meta)
+        months = np.arange(1, meta['months'] + 1)
+        return cols.header, months, cols
     with open(filepath) as f:
         header = f.readline().split()
     data = np.loadtxt(filepath, skiprows=1)
@@ -67,10 +113,10 @@ def load_file(filepath):
 
 
 def available_vars(header):
-    """Return base variable names present in header (strip _native/_int1/_int2 suffix)."""
+    """Return base variable names present in header (strip _native/_int1/_int2/_slope suffix)."""
     seen = []
     for col in header[1:]:  # skip 'month'
-        base = re.sub(r'_(native|int1|int2)$', '', col)
+        base = re.sub(r'_(native|int1|int2|slope1|slope2)$', '', col)
         if base not in seen:
             seen.append(base)
     return seen
@@ -83,7 +129,8 @@ def list_data_files(datadir='data'):
     """Print available data files and their variables, then exit."""
     if not os.path.isdir(datadir):
         sys.exit("Error: data directory '{}' not found.".format(datadir))
-    txt_files = sorted(f for f in os.listdir(datadir) if f.endswith('.txt') and f != 'README')
+    txt_files = sorted(f for f in os.listdir(datadir)
+                       if (f.endswith('.txt') or f.endswith('.npy')) and f != 'README')
     if not txt_files:
         print("No data files found in {}/".format(datadir))
         return
@@ -92,8 +139,14 @@ def list_data_files(datadir='data'):
     for fname in txt_files:
         fp = os.path.join(datadir, fname)
         try:
-            header, months, _ = load_file(fp)
-            vars_list = available_vars(header)
+            if fname.endswith('.npy'):
+                # metadata only; no data is read
+                meta      = read_metadata(fp)
+                months    = np.arange(1, meta['months'] + 1)
+                vars_list = meta['columns']
+            else:
+                header, months, _ = load_file(fp)
+                vars_list = available_vars(header)
             print("  {}".format(fname))
             print("    months : {} – {}  ({} timesteps)".format(
                 int(months[0]), int(months[-1]), len(months)))
@@ -107,15 +160,17 @@ def main():
     parser = argparse.ArgumentParser(
         description='Plot time-series from one or more trend.py data files.')
     parser.add_argument('files', nargs='*',
-                        help='Data file(s) in data/ written by trend.py --data')
+                        help='Data file(s) in data/ written by trend.py --save-data (.npy or .txt)')
     parser.add_argument('--vars', nargs='+',
                         help='Variable(s) to plot (e.g. TS ICEFRAC energy_top)')
-    parser.add_argument('--freq', choices=['native', 'int1', 'int2'], default='native',
-                        help='Time frequency to plot (default: native)')
+    parser.add_argument('--freq', choices=['native', 'int1', 'int2', 'slope1', 'slope2'], default='native',
+                        help='Time frequency to plot; slope1/slope2 need binary files (default: native)')
     parser.add_argument('--xlabel', default='Month',
                         help='X-axis label (default: Month)')
     parser.add_argument('--outdir', default='plots/post',
                         help='Output directory for saved figures (default: plots/post/)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for rendering figures (default: 1)')
     parser.add_argument('--list', action='store_true',
                         help='List available data files in data/ and exit')
     parser.add_argument('--datadir', default='data',
@@ -158,31 +213,27 @@ def main():
                     "Available variables: {}".format(
                         var, col_name, c['case_id'], ', '.join(avail)))
 
-    freq_label = {'native': 'monthly mean', 'int1': 'short-window avg', 'int2': 'long-window avg'}
+    freq_label = {'native': 'monthly mean', 'int1': 'short-window avg', 'int2': 'long-window avg',
+                  'slope1': 'short-window trend per year', 'slope2': 'long-window trend per year'}
 
-    # one figure per variable
+    # one figure per variable, all with the same line layout
+    specs = []
     for var in args.vars:
         col_name = '{}_{}'.format(var, args.freq)
-        fig, ax = plt.subplots(figsize=(10, 5))
-
+        lines = []
         for idx, c in enumerate(cases):
             color, ls = _style(idx)
-            ax.plot(c['months'], c['cols'][col_name],
-                    color=color, linestyle=ls, linewidth=1.5,
-                    label=c['case_id'])
-
-        ax.set_xlabel(args.xlabel, fontsize=12)
-        ax.set_ylabel(var, fontsize=12)
-        ax.set_title('{} — {}'.format(var, freq_label[args.freq]), fontsize=13)
-        ax.legend(fontsize=9, framealpha=0.7)
-        ax.grid(True, linestyle=':', linewidth=0.5, alpha=0.7)
-        fig.tight_layout()
-
+            lines.append((c['months'], c['cols'][col_name],
+                          dict(color=color, linestyle=ls, linewidth=1.5, label=c['case_id'])))
         outfile = os.path.join(args.outdir, '{}_{}.png'.format(var, args.freq))
-        fig.savefig(outfile, dpi=150)
-        plt.close(fig)
-        print("Saved  {}".format(outfile))
+        specs.append(trend_render.figure_spec(
+            outfile, lines, title='{} — {}'.format(var, freq_label[args.freq]),
+            xlabel=args.xlabel, ylabel=var, figsize=(10, 5), dpi=150,
+            fontsize=12, title_size=13, legend=dict(fontsize=9, framealpha=0.7),
+            grid=dict(linestyle=':', linewidth=0.5, alpha=0.7), tight=True))
 
+    for outfile in trend_render.render_figures(specs, jobs=args.jobs):
+        print("Saved  {}".format(outfile))
 
 if __name__ == '__main__':
     main()
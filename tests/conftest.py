@@ -0,0 +1,43 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/conftest.py
+#
+#  Shared fixtures for the test suite (python -m pytest tests).
+#  The modules live at the top of the repository, so it is put on
+#  sys.path here. History files are written by make_synthetic.py
+#  and trend.py is run as a script in a scratch directory holding
+#  its own vars.in, data/ and plots/.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+
+def make_history(outdir, *options):
+    """Write synthetic history files into outdir with make_synthetic.py options."""
+    subprocess.run([sys.executable, os.path.join(REPO, 'make_synthetic.py'), str(outdir)] + list(options),
+                   check=True, capture_output=True, text=True)
+    return str(outdir)
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """Scratch directory with the repository's vars.in and empty data/ and plots/."""
+    work = tmp_path / 'work'
+    (work / 'data').mkdir(parents=True)
+    (work / 'plots' / 'snapshots').mkdir(parents=True)
+    shutil.copy(os.path.join(REPO, 'vars.in'), work / 'vars.in')
+    return work
+
+
+def run_trend(workdir, *args, timeout=600):
+    """Run trend.py in workdir; returns the CompletedProcess."""
+    return subprocess.run([sys.executable, os.path.join(REPO, 'trend.py')] + [str(a) for a in args],
+                          cwd=str(workdir), capture_output=True, text=True, timeout=timeout)
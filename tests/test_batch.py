@@ -0,0 +1,50 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_batch.py
+#
+#  trend_batch.py must scan, window and write each case exactly as
+#  trend.py does for that case alone.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+import subprocess
+import sys
+import pytest
+from conftest import REPO, make_history, run_trend
+from trend_api import _scan_months
+
+
+def test_scan_months():
+    index = {(1, m): None for m in range(1, 13)}
+    index.update({(2, 1): None, (2, 2): None})
+    assert _scan_months([index], 1, 6000) == (14, '0001-01', '0002-03')
+    # at the -n limit the end date is the last month read
+    assert _scan_months([index], 1, 12) == (12, '0001-01', '0001-12')
+    assert _scan_months([index, {(1, 1): None}], 1, 6000) == (1, '0001-01', '0001-02')
+    assert _scan_months([index], 3, 6000) == (0, None, '0003-01')
+
+
+@pytest.mark.parametrize('months', ['6000', '24'])
+def test_batch_matches_single_cases(tmp_path, workdir, months):
+    history = str(tmp_path / 'hist')
+    make_history(history, '--case', 'ra', '--months', '30')
+    make_history(history, '--case', 'rb', '--months', '20', '--seed', '3')
+    options = ['--cam', '--cice', '--clm', '--testdir', history, '-n', months,
+               '--save-data', '--data-format', 'both']
+    data = workdir / 'data'
+
+    result = subprocess.run([sys.executable, os.path.join(REPO, 'trend_batch.py'), 'r*'] + options,
+                            cwd=str(workdir), capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stderr
+    batch = {name: (data / name).read_bytes() for name in os.listdir(data)}
+    for name in batch:
+        os.remove(data / name)
+
+    for case in ('ra', 'rb'):
+        result = run_trend(workdir, case, *options)
+        assert result.returncode == 0, result.stderr
+    single = {name: (data / name).read_bytes() for name in os.listdir(data)}
+    assert len(single) == 18
+    assert sorted(batch) == sorted(single)
+    for name, content in single.items():
+        assert batch[name] == content, name
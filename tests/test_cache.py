@@ -0,0 +1,172 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_cache.py
+#
+#  The persistent global-mean cache (trend_core load_cache,
+#  save_cache, iter_monthly_means with cache=): values are reused
+#  only for the same file, size, mtime and grid, and --cache-max
+#  keeps the most recently used files.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import json
+import os
+import re
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+from conftest import make_history, run_trend
+import trend_core as core
+
+VARS = ['TS', 'FLNT']
+
+
+@pytest.fixture
+def history(tmp_path):
+    outdir = make_history(tmp_path / 'hist', '--case', 'cc', '--months', '4', '--components', 'cam',
+                          '--format', 'NETCDF3_CLASSIC')
+    return sorted(os.path.join(outdir, name) for name in os.listdir(outdir))
+
+
+def _weights(filepath):
+    with Dataset(filepath) as nc:
+        return core.build_area_weights(nc.variables['lon'][:], nc.variables['lat'][:])
+
+
+def _read(files, weights, cache, capsys, varnames=VARS):
+    """Global means of files through the cache; returns (rows, values reused, files read)."""
+    rows = np.array([row for _, row in core.iter_monthly_means(files, '.cam.h0.', varnames, weights,
+                                                               cache=cache)])
+    line = re.search(r'cache: (\d+) of \d+ values reused, (\d+) files to read', capsys.readouterr().out)
+    return rows, int(line.group(1)), int(line.group(2))
+
+
+def _set_mtime(filepath, mtime_ns):
+    os.utime(filepath, ns=(os.stat(filepath).st_atime_ns, mtime_ns))
+
+
+def test_reuse_and_new_variables(history, capsys):
+    weights = _weights(history[0])
+    cache = core.load_cache(None)
+    first, reused, nread = _read(history, weights, cache, capsys)
+    assert (reused, nread) == (0, 4)
+    assert len(cache['entries']) == 4
+
+    again, reused, nread = _read(history, weights, cache, capsys)
+    assert (reused, nread) == (8, 0)
+    np.testing.assert_array_equal(again, first)
+
+    # a variable not cached yet is read, the others are reused
+    more, reused, nread = _read(history, weights, cache, capsys, VARS + ['FSNT'])
+    assert (reused, nread) == (8, 4)
+    np.testing.assert_array_equal(more[:, :2], first)
+    assert np.all(np.isfinite(more[:, 2]))
+
+
+def test_invalidated_by_mtime(history, capsys):
+    weights = _weights(history[0])
+    cache = core.load_cache(None)
+    first, _, _ = _read(history, weights, cache, capsys)
+
+    # same size, new content and mtime
+    st = os.stat(history[1])
+    with Dataset(history[1], 'a') as nc:
+        nc.variables['TS'][:] = nc.variables['TS'][:] + 10.0
+    _set_mtime(history[1], st.st_mtime_ns + 10**9)
+    assert os.stat(history[1]).st_size == st.st_size
+
+    rows, reused, nread = _read(history, weights, cache, capsys)
+    assert (reused, nread) == (6, 1)
+    np.testing.assert_allclose(rows[1, 0], first[1, 0] + 10.0, rtol=1e-6)
+    np.testing.assert_array_equal(np.delete(rows, 1, axis=0), np.delete(first, 1, axis=0))
+
+    # touching a file is enough
+    _set_mtime(history[2], os.stat(history[2]).st_mtime_ns + 10**9)
+    _, reused, nread = _read(history, weights, cache, capsys)
+    assert (reused, nread) == (6, 1)
+
+
+def test_invalidated_by_size(history, capsys):
+    weights = _weights(history[0])
+    cache = core.load_cache(None)
+    _read(history, weights, cache, capsys)
+
+    # grown file, mtime put back
+    st = os.stat(history[3])
+    with open(history[3], 'ab') as f:
+        f.write(bytes(64))
+    _set_mtime(history[3], st.st_mtime_ns)
+    _, reused, nread = _read(history, weights, cache, capsys)
+    assert (reused, nread) == (6, 1)
+    key = f"{core.weights_fingerprint(weights)}|{os.path.abspath(history[3])}"
+    assert cache['entries'][key]['size'] == st.st_size + 64
+
+
+def test_grid_change(history, capsys):
+    weights = _weights(history[0])
+    cache = core.load_cache(None)
+    first, _, _ = _read(history, weights, cache, capsys)
+
+    # other weights on the same files: a separate set of entries
+    flat = np.full(weights.shape, 1.0 / weights.size)
+    assert core.weights_fingerprint(flat) != core.weights_fingerprint(weights)
+    rows, reused, nread = _read(history, flat, cache, capsys)
+    assert (reused, nread) == (0, 4)
+    assert len(cache['entries']) == 8
+    assert not np.array_equal(rows, first)
+
+    # a different grid shape with the same values is a different grid too
+    assert core.weights_fingerprint(weights.reshape(-1)) != core.weights_fingerprint(weights)
+
+    again, reused, nread = _read(history, weights, cache, capsys)
+    assert (reused, nread) == (8, 0)
+    np.testing.assert_array_equal(again, first)
+
+
+def test_save_load_and_eviction(tmp_path, history, capsys):
+    weights = _weights(history[0])
+    cache = core.load_cache(None)
+    _read(history, weights, cache, capsys)
+    for n, entry in enumerate(cache['entries'].values()):
+        entry['used'] = 100.0 + n
+
+    path = str(tmp_path / 'cache' / 'trend_cache.json')
+    core.save_cache(cache, path)
+    assert core.load_cache(path) == json.loads(json.dumps(cache))
+    assert not [name for name in os.listdir(tmp_path / 'cache') if '.tmp' in name]
+
+    # the least recently used files go first
+    keep = list(cache['entries'])[2:]
+    core.save_cache(cache, path, max_entries=2)
+    assert list(core.load_cache(path)['entries']) == keep[::-1]
+    _, reused, nread = _read(history, weights, core.load_cache(path), capsys)
+    assert (reused, nread) == (4, 2)
+
+    # unreadable or outdated cache files are ignored
+    with open(path, 'w') as f:
+        f.write('{')
+    assert core.load_cache(path)['entries'] == {}
+    with open(path, 'w') as f:
+        json.dump({'version': core.CACHE_VERSION + 1, 'entries': {'x': {}}}, f)
+    assert core.load_cache(path)['entries'] == {}
+
+
+def test_cache_max_in_trend(tmp_path, workdir):
+    history = make_history(tmp_path / 'hist', '--case', 'cm', '--months', '6', '--components', 'cam')
+    options = ['cm', '--cam', '--testdir', history, '--cache', 'c.json', '--cache-max', '4',
+               '--save-data', '--data-format', 'binary']
+
+    result = run_trend(workdir, *options)
+    assert result.returncode == 0, result.stderr
+    assert 'cache: 0 of 48 values reused, 6 files to read' in result.stdout
+    with open(workdir / 'c.json') as f:
+        assert len(json.load(f)['entries']) == 4
+    data = workdir / 'data'
+    first = {name: (data / name).read_bytes() for name in os.listdir(data)}
+
+    result = run_trend(workdir, *options)
+    assert result.returncode == 0, result.stderr
+    assert 'cache: 32 of 48 values reused, 2 files to read' in result.stdout
+    assert {name: (data / name).read_bytes() for name in os.listdir(data)} == first
+
+    result = run_trend(workdir, *options, '--clear-cache')
+    assert 'cache: 0 of 48 values reused, 6 files to read' in result.stdout
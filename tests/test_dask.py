@@ -0,0 +1,73 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_dask.py
+#
+#  The dask engine (trend_dask) run through trend.py on both
+#  schedulers must write the same global means as the streaming
+#  reader, 3D level and column means included. Skipped when dask
+#  is not installed.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import glob
+import os
+import numpy as np
+import pytest
+from conftest import make_history, run_trend
+
+pytest.importorskip('dask')
+
+
+@pytest.fixture(scope='module', params=['NETCDF4', 'NETCDF3_CLASSIC'])
+def history(request, tmp_path_factory):
+    return make_history(tmp_path_factory.mktemp('hist'), '--case', 'dk', '--months', '18',
+                        '--components', 'cam', '--format', request.param)
+
+
+def _means(workdir, history, *engine):
+    result = run_trend(workdir, 'dk', '--cam', '--testdir', history, '--save-data',
+                       '--data-format', 'binary', *engine)
+    assert result.returncode == 0, result.stderr
+    assert 'Traceback' not in result.stdout + result.stderr
+    files = glob.glob(os.path.join(str(workdir), 'data', 'dk_*_cam.npy'))
+    assert len(files) == 1
+    means = np.load(files[0])
+    os.remove(files[0])
+    return means, result.stdout
+
+
+def test_threads_match_stream(workdir, history):
+    stream, _ = _means(workdir, history)
+    dask, out = _means(workdir, history, '--engine', 'dask', '--jobs', '2', '--memory-limit', '1GB')
+    assert 'dask: 18 files, 2 threads' in out
+    assert ' 0 MiB' not in out
+    np.testing.assert_array_equal(dask, stream)
+
+
+def test_distributed_matches_stream(workdir, history):
+    pytest.importorskip('dask.distributed')
+    stream, _ = _means(workdir, history)
+    dask, out = _means(workdir, history, '--engine', 'dask', '--dask-scheduler', 'distributed',
+                       '--jobs', '2')
+    assert 'dask: 18 files on 2 workers' in out
+    # the workers import trend.py's modules, not run the script again
+    assert out.count('ExoCAM trend analysis') == 1
+    np.testing.assert_array_equal(dask, stream)
+
+
+@pytest.mark.parametrize('scheduler, fmt', [('threads', 'NETCDF4'), ('threads', 'NETCDF3_CLASSIC'),
+                                            ('distributed', 'NETCDF4')])
+def test_levels_match_stream(tmp_path, workdir, scheduler, fmt):
+    if scheduler == 'distributed':
+        pytest.importorskip('dask.distributed')
+    history = make_history(tmp_path / 'hist3d', '--case', 'dk', '--months', '6',
+                           '--components', 'cam', '--nvars3d', '2', '--format', fmt)
+    lines = (workdir / 'vars.in').read_text().splitlines(True)
+    # a column mean before the 2D variables, as _load_file batches them after
+    lines[1] = 'Q:col TS T:500hPa FLNT T:0-25\n'
+    lines[5] = 'TS FLNT T_500hPa Q_col\n'
+    lines[9] = 'TS\n'
+    (workdir / 'vars.in').write_text(''.join(lines))
+    stream, _ = _means(workdir, history)
+    dask, _ = _means(workdir, history, '--engine', 'dask', '--dask-scheduler', scheduler, '--jobs', '2')
+    assert stream.shape[1] == 2 + 1 + 26 + 1
+    np.testing.assert_array_equal(dask, stream)
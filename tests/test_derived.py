@@ -0,0 +1,102 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_derived.py
+#
+#  Derived-variable definitions from vars.in (trend_core
+#  DerivedColumns): what expressions are accepted, and how the
+#  compiled columns evaluate, NaN and division by zero included.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import warnings
+import numpy as np
+import pytest
+import conftest  # noqa: F401  (puts the repository on sys.path)
+import trend_core as core
+
+BASE = ['FSNT', 'FLNT', 'TS']
+
+
+@pytest.mark.parametrize('expr', [
+    'FSNT.real',                    # attribute access
+    '__import__("os")',             # unknown function, string constant
+    'open(FSNT)',
+    'FSNT.sum()',
+    'np.sqrt(FSNT)',
+    'sqrt(FSNT, out=FLNT)',         # keyword argument
+    'FSNT[0]',                      # subscript
+    'lambda: FSNT',
+    'FSNT if TS else FLNT',
+    'FSNT > FLNT',
+    '[FSNT, FLNT]',
+    "'FSNT'",
+    'FSNT // FLNT',
+    'FSNT +',                       # syntax error
+])
+def test_rejected_expressions(expr):
+    with pytest.raises(ValueError):
+        core.DerivedColumns(BASE, [('d', expr)])
+
+
+@pytest.mark.parametrize('definitions', [
+    [('d', 'FSNT - FLNS')],                             # not read
+    [('d', 'e + 1'), ('e', 'TS')],                      # defined later
+    [('d', 'd + 1')],                                   # itself
+    [('d', '_v')],
+    [('2d', 'TS')],                                     # invalid name
+    [('TS', 'FSNT')],                                   # already a column
+    [('d', 'TS'), ('d', 'FSNT')],
+])
+def test_rejected_names(definitions):
+    with pytest.raises(ValueError):
+        core.DerivedColumns(BASE, definitions)
+
+
+def test_apply_rows_and_matrix():
+    derived = core.DerivedColumns(BASE + ['T:500hPa'], [
+        ('etop', 'FSNT - FLNT'),
+        ('ratio', 'etop / TS * 100'),
+        ('mixed', 'sqrt(abs(-etop)) + maximum(TS, T_500hPa) ** 2 - log10(1e3)'),
+    ])
+    assert derived.columns == BASE + ['T_500hPa', 'etop', 'ratio', 'mixed']
+    assert len(derived) == 3
+
+    values = np.zeros((6, len(derived.columns)))
+    values[:, :4] = np.random.default_rng(2).uniform(1, 300, (6, 4))
+    derived.apply(values)
+    fsnt, flnt, ts, t500 = values[:, :4].T
+    etop = fsnt - flnt
+    np.testing.assert_array_equal(values[:, 4], etop)
+    np.testing.assert_array_equal(values[:, 5], etop / ts * 100)
+    np.testing.assert_array_equal(values[:, 6], np.sqrt(np.abs(-etop)) + np.maximum(ts, t500) ** 2 - 3.0)
+
+    # one month at a time gives the same columns
+    for row in values:
+        single = row.copy()
+        single[4:] = 0.0
+        np.testing.assert_array_equal(derived.apply(single), row)
+
+
+def test_nan_and_division_by_zero():
+    derived = core.DerivedColumns(BASE, [('ratio', 'FSNT / FLNT'), ('lg', 'log(TS)'),
+                                         ('diff', 'FSNT - TS')])
+    values = np.array([[1.0, 0.0, 1.0, 0, 0, 0],
+                       [0.0, 0.0, 0.0, 0, 0, 0],
+                       [-1.0, 0.0, -1.0, 0, 0, 0],
+                       [np.nan, 2.0, 4.0, 0, 0, 0],
+                       [3.0, np.nan, np.nan, 0, 0, 0]])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        derived.apply(values)
+    ratio, lg, diff = values[:, 3:].T
+    np.testing.assert_array_equal(ratio, [np.inf, np.nan, -np.inf, np.nan, np.nan])
+    np.testing.assert_array_equal(lg, [0.0, -np.inf, np.nan, np.log(4.0), np.nan])
+    np.testing.assert_array_equal(diff, [0.0, 0.0, 0.0, np.nan, np.nan])
+
+
+def test_energy_definitions():
+    base = ['FSNT', 'FLNT', 'FSNS', 'FLNS', 'LHFLX', 'SHFLX']
+    derived = core.DerivedColumns(base, core.ENERGY_DEFINITIONS)
+    row = np.array([240.0, 235.0, 160.0, 60.0, 80.0, 18.0, 0.0, 0.0])
+    derived.apply(row)
+    assert derived.columns[-2:] == ['energy_top', 'energy_bot']
+    np.testing.assert_array_equal(row[-2:], [5.0, 2.0])
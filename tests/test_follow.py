@@ -0,0 +1,94 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_follow.py
+#
+#  trend.py --follow widens its running-mean windows as months
+#  arrive; what it writes must match a one-shot run over the same
+#  files, also when they are written in place while it polls.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+import pytest
+from conftest import REPO, make_history, run_trend
+import trend_core as core
+
+
+def test_set_windows_matches_fresh_series():
+    rows = np.random.default_rng(1).standard_normal((40, 3))
+    grown = core.ComponentSeries('atm', ['a', 'b', 'c'], 12, 20)
+    for n, row in enumerate(rows, start=1):
+        grown.set_windows(min(12, n), min(36, n))
+        grown.append(row)
+    fresh = core.ComponentSeries('atm', ['a', 'b', 'c'], 12, 36)
+    for row in rows:
+        fresh.append(row)
+    for field in core.ComponentSeries.FIELDS:
+        np.testing.assert_array_equal(getattr(grown, field), getattr(fresh, field))
+
+
+def _outputs(workdir):
+    data = workdir / 'data'
+    out = {name: (data / name).read_bytes() for name in os.listdir(data)}
+    for name in out:
+        os.remove(data / name)
+    return out
+
+
+def _copy_atomic(source, target):
+    shutil.copy(source, target.parent / '.partial')
+    os.replace(target.parent / '.partial', target)
+
+
+def _copy_slowly(source, target):
+    """Write target in place in pieces, as a model writing its history file would."""
+    with open(source, 'rb') as f:
+        data = f.read()
+    with open(target, 'wb') as f:
+        for start in range(0, len(data), len(data) // 4 + 1):
+            f.write(data[start:start + len(data) // 4 + 1])
+            f.flush()
+            # several polls see the same partial file
+            time.sleep(0.3)
+
+
+@pytest.mark.parametrize('copy, fmt', [(_copy_atomic, 'NETCDF4'),
+                                       (_copy_slowly, 'NETCDF4'),
+                                       (_copy_slowly, 'NETCDF3_CLASSIC')],
+                         ids=['atomic', 'in-place', 'in-place-nc3'])
+def test_follow_matches_one_shot(tmp_path, workdir, copy, fmt):
+    history = make_history(tmp_path / 'hist', '--case', 'fw', '--months', '30', '--components', 'cam',
+                           '--format', fmt)
+    names = sorted(os.listdir(history))
+    options = ['fw', '--cam', '-n', '30', '--save-data', '--data-format', 'both']
+
+    result = run_trend(workdir, *options, '--testdir', history)
+    assert result.returncode == 0, result.stderr
+    one_shot = _outputs(workdir)
+
+    # start on 8 months and add the rest one by one once trend.py is following
+    live = tmp_path / 'live'
+    live.mkdir()
+    start = 8 if copy is _copy_atomic else 26
+    for name in names[:start]:
+        shutil.copy(os.path.join(history, name), live / name)
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO, 'trend.py')] + options
+                            + ['--testdir', str(live), '--follow', '--follow-interval', '0.05'],
+                            cwd=str(workdir), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    for line in proc.stdout:
+        if line.startswith('Polling every'):
+            break
+    for name in names[start:]:
+        copy(os.path.join(history, name), live / name)
+    out = proc.stdout.read()
+    assert proc.wait(timeout=300) == 0
+    assert 'storing NaN' not in out
+
+    followed = _outputs(workdir)
+    assert sorted(followed) == sorted(one_shot)
+    for name, data in one_shot.items():
+        assert followed[name] == data, name
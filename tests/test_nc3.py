@@ -0,0 +1,129 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_nc3.py
+#
+#  trend_nc3 parses netCDF3 headers itself and reads fields as
+#  views of the mapped file; every read is checked against the
+#  netCDF library reading the same file.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+import conftest  # noqa: F401  (puts the repository on sys.path)
+import trend_nc3
+
+FORMATS = {'NETCDF3_CLASSIC': 1, 'NETCDF3_64BIT_OFFSET': 2, 'NETCDF3_64BIT_DATA': 5}
+NT, NLEV, NLAT, NLON = 3, 4, 5, 7
+
+
+def _write(path, fmt, record_vars):
+    """
+    netCDF3 file with coordinates, one 4D and several 3D fields;
+    record_vars maps name -> dtype of the (time, lat, lon) fields.
+    """
+    rng = np.random.default_rng(7)
+    with Dataset(path, 'w', format=fmt) as nc:
+        nc.title = 'trend_nc3 test'
+        nc.createDimension('time', None)
+        nc.createDimension('lev', NLEV)
+        nc.createDimension('lat', NLAT)
+        nc.createDimension('lon', NLON)
+        lat = nc.createVariable('lat', 'f8', ('lat',))
+        lat.units = 'degrees_north'
+        lat[:] = np.linspace(-80, 80, NLAT)
+        nc.createVariable('hyai', 'f8', ('lev',))[:] = np.arange(NLEV) / NLEV
+        for name, dtype in record_vars.items():
+            var = nc.createVariable(name, dtype, ('time', 'lat', 'lon'))
+            if np.dtype(dtype).kind == 'f':
+                var[:] = rng.standard_normal((NT, NLAT, NLON))
+            else:
+                var[:] = rng.integers(-100, 100, (NT, NLAT, NLON))
+        if 'T' not in record_vars:
+            return path
+        var = nc.createVariable('T3', 'f4', ('time', 'lev', 'lat', 'lon'))
+        var.units = 'K'
+        var[:] = rng.standard_normal((NT, NLEV, NLAT, NLON))
+    return path
+
+
+def _check_against_netcdf(path):
+    f = trend_nc3.NC3File(path)
+    with Dataset(path) as nc:
+        assert f.layout.numrecs == len(nc.dimensions['time'])
+        assert set(f.variables) == set(nc.variables)
+        for name, ref in nc.variables.items():
+            var = f.variables[name]
+            assert var.dimensions == ref.dimensions
+            assert var.shape == ref.shape
+            assert var.ncattrs() == ref.ncattrs()
+            ref.set_auto_mask(False)
+            if not var.is_record:
+                np.testing.assert_array_equal(f.array(name), ref[:])
+                continue
+            for rec in range(NT):
+                np.testing.assert_array_equal(f.record(name, rec), ref[rec])
+            np.testing.assert_array_equal(f.records(name, 0, NT), ref[:])
+            np.testing.assert_array_equal(f.records(name, 1, 3), ref[1:3])
+    return f
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_header_versions(tmp_path, fmt):
+    path = _write(str(tmp_path / 'h.nc'), fmt, {'T': 'f4', 'PS': 'f8'})
+    f = _check_against_netcdf(path)
+    assert f.layout.version == FORMATS[fmt]
+    assert dict(f.layout.dims) == {'time': 0, 'lev': NLEV, 'lat': NLAT, 'lon': NLON}
+    assert f.layout.attrs == {'title': 'trend_nc3 test'}
+    assert f.variables['lat'].getncattr('units') == 'degrees_north'
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('record_vars', [
+    {'A': 'i2'},                            # one record variable: 70 bytes, not padded
+    {'A': 'i1'},
+    {'A': 'i2', 'B': 'i1', 'C': 'f8'},      # several: each padded to 4 bytes
+    {'A': 'i1', 'B': 'i2'},
+], ids=['one-i2', 'one-i1', 'several', 'two-odd'])
+def test_record_size(tmp_path, fmt, record_vars):
+    path = _write(str(tmp_path / 'r.nc'), fmt, record_vars)
+    f = _check_against_netcdf(path)
+    sizes = [NLAT * NLON * np.dtype(d).itemsize for d in record_vars.values()]
+    if len(sizes) == 1:
+        assert f.layout.recsize == sizes[0]
+    else:
+        assert f.layout.recsize == sum(-(-s // 4) * 4 for s in sizes)
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_record_levels(tmp_path, fmt):
+    path = _write(str(tmp_path / 'l.nc'), fmt, {'T': 'f4', 'PS': 'f8'})
+    f = trend_nc3.NC3File(path)
+    with Dataset(path) as nc:
+        ref = nc.variables['T3'][:]
+    for rec in range(NT):
+        np.testing.assert_array_equal(f.record('T3', rec), ref[rec])
+        for k0, k1 in [(0, 1), (1, 3), (3, NLEV), (None, 2), (2, None), (0, NLEV)]:
+            np.testing.assert_array_equal(f.record('T3', rec, k0, k1), ref[rec, k0:k1])
+
+
+def test_layout_shared_by_identical_headers(tmp_path):
+    a = _write(str(tmp_path / 'a.nc'), 'NETCDF3_CLASSIC', {'T': 'f4', 'PS': 'f8'})
+    b = _write(str(tmp_path / 'b.nc'), 'NETCDF3_CLASSIC', {'T': 'f4', 'PS': 'f8'})
+    c = _write(str(tmp_path / 'c.nc'), 'NETCDF3_CLASSIC', {'T': 'f4', 'Q': 'f8'})
+    assert trend_nc3.NC3File(a).layout is trend_nc3.NC3File(b).layout
+    assert trend_nc3.NC3File(c).layout is not trend_nc3.NC3File(a).layout
+    assert 'Q' in trend_nc3.NC3File(c).variables
+
+
+def test_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'n4.nc')
+    with Dataset(path, 'w', format='NETCDF4') as nc:
+        nc.createDimension('x', 2)
+    with pytest.raises(ValueError):
+        trend_nc3.NC3File(path)
+    with pytest.raises(ValueError):
+        trend_nc3.parse_header(b'CDF\x03' + bytes(28))
+    f = trend_nc3.NC3File(_write(str(tmp_path / 'h.nc'), 'NETCDF3_CLASSIC', {'T': 'f4'}))
+    with pytest.raises(ValueError):
+        f.array('T')
@@ -0,0 +1,141 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_running.py
+#
+#  The running statistics of trend_core (compensated_cumsum,
+#  running_stats, compute_running_means, RunningMeans) against a
+#  direct loop over each row's window.
+#
+#  Row i averages vavg[0:i+1] while i < window and the `window`
+#  months before i, vavg[i-window:i], after that; its slope is
+#  measured from the first mean, then from the mean `window` rows
+#  back. A NaN month turns the sums, and so every mean, slope, std
+#  and trend of that column from the first window holding it on,
+#  into NaN (as the baseline cumsum did); min and max only see it
+#  while it is in the window.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import math
+from fractions import Fraction
+import numpy as np
+import pytest
+import conftest  # noqa: F401  (puts the repository on sys.path)
+import trend_core as core
+
+N = 40
+
+
+def _naive(x, window):
+    """running_stats of a 1D series, one window at a time."""
+    out = {k: np.zeros(len(x)) for k in ('mean', 'slope', 'std', 'trend', 'min', 'max')}
+    for i in range(len(x)):
+        lo = 0 if i < window else i - window
+        hi = i + 1 if i < window else i
+        part = x[lo:hi]
+        out['mean'][i] = math.fsum(part) / len(part)
+        out['std'][i]  = np.std(part)
+        out['min'][i]  = np.min(part)
+        out['max'][i]  = np.max(part)
+        out['trend'][i] = np.polyfit(np.arange(lo, hi), part, 1)[0] * 12 if len(part) > 1 else 0.0
+    for i in range(len(x)):
+        ref = 0 if i < window else i - window
+        out['slope'][i] = (out['mean'][i] - out['mean'][ref]) / (window / 12.0)
+    return out
+
+
+def _series(ncols=3, n=N, seed=4):
+    rng = np.random.default_rng(seed)
+    return 250.0 + np.cumsum(rng.standard_normal((n, ncols)), axis=0) + rng.standard_normal(ncols) * 50
+
+
+def test_compensated_cumsum():
+    x = _series(ncols=2, n=6000)
+    cs = core.compensated_cumsum(x)
+    assert cs.shape == (6001, 2)
+    assert np.all(cs[0] == 0.0)
+    for j in range(2):
+        exact = np.array([float(s) for s in np.cumsum([Fraction(v) for v in x[:, j]])])
+        np.testing.assert_array_equal(cs[1:, j], exact)
+    assert core.compensated_cumsum(np.zeros((0, 2))).shape == (1, 2)
+
+
+@pytest.mark.parametrize('window', [1, 2, 12, N - 1, N, N + 5])
+def test_running_stats_matches_loop(window):
+    x = _series()
+    stats = core.running_stats(x, window)
+    for j in range(x.shape[1]):
+        ref = _naive(x[:, j], window)
+        for key in ('mean', 'slope', 'min', 'max'):
+            np.testing.assert_allclose(stats[key][:, j], ref[key], rtol=1e-13, atol=1e-12, err_msg=key)
+        # one-pass variance: exact up to rounding at the scale of the data
+        scale = np.max((x[:, j] - x[0, j]) ** 2)
+        np.testing.assert_allclose(stats['std'][:, j] ** 2, ref['std'] ** 2, rtol=1e-9, atol=1e-13 * scale)
+        np.testing.assert_allclose(stats['trend'][:, j], ref['trend'], rtol=1e-8, atol=1e-8)
+    # a 1D series gives the same column
+    one = core.running_stats(x[:, 1], window)
+    for key, value in stats.items():
+        np.testing.assert_array_equal(one[key], value[:, 1])
+
+
+@pytest.mark.parametrize('window', [1, 12, N])
+@pytest.mark.parametrize('k', [0, 7, N - 2])
+def test_running_stats_nan(window, k):
+    x = _series()
+    x[k, 1] = np.nan
+    stats = core.running_stats(x, window)
+    clean = core.running_stats(np.delete(x, 1, axis=1), window)
+    for key, value in stats.items():
+        # the other columns are untouched
+        np.testing.assert_array_equal(np.delete(value, 1, axis=1), clean[key], err_msg=key)
+    # row k sees month k only while its window is still growing
+    first = k if k < window else k + 1
+    ref = _naive(x[:first, 1], window)
+    for key in ('mean', 'slope', 'trend'):
+        np.testing.assert_allclose(stats[key][:first, 1], ref[key], rtol=1e-8, atol=1e-8, err_msg=key)
+    for key in ('mean', 'slope', 'std'):
+        assert np.all(np.isnan(stats[key][first:, 1])), key
+    # the trend of a one-month window is 0 whatever the month holds
+    size = np.minimum(np.arange(N) + 1, window)[first:]
+    trend = stats['trend'][first:, 1]
+    assert np.all(np.isnan(trend[size > 1])) and np.all(trend[size == 1] == 0.0)
+    for i in range(N):
+        part = x[:i + 1, 1] if i < window else x[i - window:i, 1]
+        assert np.array_equal(stats['min'][i, 1], np.min(part), equal_nan=True)
+        assert np.array_equal(stats['max'][i, 1], np.max(part), equal_nan=True)
+
+
+@pytest.mark.parametrize('int1, int2', [(12, 120), (1, N), (3, N + 5), (N, N)])
+def test_compute_running_means(int1, int2):
+    x = _series()
+    r1, r2, s1, s2 = core.compute_running_means(x, int1, int2)
+    for j in range(x.shape[1]):
+        ref1, ref2 = _naive(x[:, j], int1), _naive(x[:, j], int2)
+        np.testing.assert_allclose(r1[:, j], ref1['mean'], rtol=1e-13)
+        np.testing.assert_allclose(r2[:, j], ref2['mean'], rtol=1e-13)
+        np.testing.assert_allclose(s1[:, j], ref1['slope'], rtol=1e-9, atol=1e-11)
+        np.testing.assert_allclose(s2[:, j], ref2['slope'], rtol=1e-9, atol=1e-11)
+
+
+@pytest.mark.parametrize('int1, int2', [(12, 120), (1, N), (3, N + 5), (N, N)])
+@pytest.mark.parametrize('nan_at', [None, 0, 9])
+def test_running_means_push(int1, int2, nan_at):
+    x = _series()
+    if nan_at is not None:
+        x[nan_at, 0] = np.nan
+    whole = core.compute_running_means(x, int1, int2)
+    rm = core.RunningMeans(x.shape[1], int1, int2)
+    pushed = [np.array(v) for v in zip(*(rm.push(row) for row in x))]
+    assert rm.n == N
+    for got, ref in zip(pushed, whole):
+        np.testing.assert_allclose(got, ref, rtol=1e-11, atol=1e-11)
+        np.testing.assert_array_equal(np.isnan(got), np.isnan(ref))
+    if nan_at is not None:
+        first = nan_at if nan_at < int1 else nan_at + 1
+        assert not np.any(np.isnan(pushed[0][:first, 0]))
+        assert np.all(np.isnan(pushed[0][first:, 0]))
+
+    # from_series picks up where the pushes left off
+    rm = core.RunningMeans.from_series(x[:N // 2], int1, int2)
+    for i in range(N // 2, N):
+        for got, ref in zip(rm.push(x[i]), whole):
+            np.testing.assert_allclose(got, ref[i], rtol=1e-11, atol=1e-11)
@@ -0,0 +1,43 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_shard.py
+#
+#  trend.py --shard i/N followed by --merge must write the same
+#  files, under the same names, as one unsharded run, also when
+#  -n cuts the run short.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+import pytest
+from conftest import make_history, run_trend
+
+
+def _outputs(workdir):
+    data = workdir / 'data'
+    return {name: (data / name).read_bytes() for name in os.listdir(data)
+            if '_shard' not in name}
+
+
+@pytest.mark.parametrize('months', ['6000', '12', '17'])
+def test_merge_matches_unsharded(tmp_path, workdir, months):
+    history = make_history(tmp_path / 'hist', '--case', 'sh', '--months', '18')
+    options = ['sh', '--cam', '--cice', '--clm', '--testdir', history, '-n', months,
+               '--save-data', '--data-format', 'both']
+
+    result = run_trend(workdir, *options)
+    assert result.returncode == 0, result.stderr
+    single = _outputs(workdir)
+    for name in single:
+        os.remove(workdir / 'data' / name)
+
+    for shard in ('1/3', '2/3', '3/3'):
+        result = run_trend(workdir, *options, '--shard', shard)
+        assert result.returncode == 0, result.stderr
+    result = run_trend(workdir, *options, '--merge')
+    assert result.returncode == 0, result.stderr
+    merged = _outputs(workdir)
+
+    assert len(single) == 9
+    assert sorted(merged) == sorted(single)
+    for name, data in single.items():
+        assert merged[name] == data, name
@@ -0,0 +1,69 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# tests/test_weights.py
+#
+#  Native-grid weights of the ice and land models, cached in
+#  --weights-dir by grid fingerprint: cases on the same grid with
+#  different masks must not share a weights file.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+import netCDF4 as nc
+import numpy as np
+from conftest import make_history, run_trend
+import trend_core as core
+
+
+def _first(history, case, prefix):
+    return os.path.join(history, f"{case}.{prefix}.0001-01.nc")
+
+
+def test_fingerprint_follows_mask(tmp_path):
+    history = make_history(tmp_path / 'hist', '--case', 'ma', '--months', '1',
+                           '--components', 'cam', 'cice', 'clm')
+    make_history(history, '--case', 'mb', '--months', '1', '--components', 'cam', 'cice', 'clm',
+                 '--seed', '3')
+    make_history(history, '--case', 'mc', '--months', '1', '--components', 'cam', 'cice', 'clm')
+    for component, prefix in (('cice', 'cice.h'), ('clm', 'clm2.h0')):
+        prints = {}
+        for case in ('ma', 'mb', 'mc'):
+            with nc.Dataset(_first(history, case, prefix)) as ncid:
+                prints[case] = core.grid_fingerprint(ncid, component)
+        assert prints['ma'] == prints['mc']
+        assert prints['ma'] != prints['mb']
+
+    weights_dir = str(tmp_path / 'weights')
+    for case in ('ma', 'mb'):
+        path = _first(history, case, 'clm2.h0')
+        np.testing.assert_array_equal(core.load_native_weights(path, 'clm', weights_dir),
+                                      core.load_native_weights(path, 'clm'))
+    assert len(os.listdir(weights_dir)) == 2
+
+
+def _outputs(workdir):
+    data = workdir / 'data'
+    out = {name: (data / name).read_bytes() for name in os.listdir(data)}
+    for name in out:
+        os.remove(data / name)
+    return out
+
+
+def test_cases_with_different_masks(tmp_path, workdir):
+    history = make_history(tmp_path / 'hist', '--case', 'ca', '--months', '3',
+                           '--components', 'cam', 'cice', 'clm')
+    make_history(history, '--case', 'cb', '--months', '3', '--components', 'cam', 'cice', 'clm',
+                 '--seed', '3')
+    options = ['--cice', '--clm', '--testdir', history, '--save-data', '--data-format', 'binary']
+
+    result = run_trend(workdir, 'cb', *options, '--weights-dir', tmp_path / 'fresh')
+    assert result.returncode == 0, result.stderr
+    fresh = _outputs(workdir)
+
+    # case ca fills the shared weights directory first
+    for case in ('ca', 'cb'):
+        result = run_trend(workdir, case, *options, '--weights-dir', tmp_path / 'shared', '--cache', 'c.json')
+        assert result.returncode == 0, result.stderr
+    shared = {name: data for name, data in _outputs(workdir).items() if name.startswith('cb_')}
+    assert sorted(shared) == sorted(fresh)
+    for name, data in fresh.items():
+        assert shared[name] == data, name
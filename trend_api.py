@@ -0,0 +1,1073 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# trend_api.py
+#
+#  Author: Wolf, E.T.
+#
+#  Importable form of the trend.py analysis. A Trend object is a
+#  session: it reads vars.in once and keeps the directory indexes,
+#  area weights, global-mean cache and worker pool alive between
+#  calls, so repeated run_case() calls in a notebook or service do
+#  not re-list directories, rebuild weights or re-read files that
+#  have not changed. run_case() returns a TrendResult holding the
+#  component series. trend.py is the command-line wrapper.
+#
+#  Usage:
+#    from trend_api import Trend
+#    t = Trend(testdir='/path/to/data', jobs=4)
+#    res = t.run_case('my_case', cam=True, cice=True)
+#    res.atm.intavg2[-1, res.atm.index('TS')]
+#    t.close()
+#
+#    from trend_api import run_case                  # one-off
+#    res = run_case('my_case', cam=True, testdir='/path/to/data')
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import hashlib
+import inspect
+import json
+import os
+import time
+import netCDF4 as nc
+import numpy   as np
+from tqdm import tqdm
+import trend_utils as trend
+import trend_core  as core
+import trend_io
+import trend_dask
+
+# the root path to your working directory
+SCRATCH_DIR = '/gpfsm/dnb33/etwolf/cesm_scratch/'
+# SCRATCH_DIR = '/discover/nobackup/tfauchez/cesm_scratch/'
+
+# model prefixs
+prefixA = '.cam.h0.'
+prefixL = '.clm2.h0.'
+prefixI = '.cice.h.'
+
+# data file suffix of each component
+SUFFIXES = {'atm': 'cam', 'ice': 'cice', 'lnd': 'clm'}
+
+
+def print_timing(label, elapsed):
+    print(f"  {label:<40} {elapsed:6.1f}s")
+
+
+def case_roots(case_id, scratch_dir=SCRATCH_DIR, testdir=None, rundir=False, timeseries=False):
+    """
+    Directories holding the atm, ice and lnd files of a case, based on
+    the CESM standard for $RUNDIR and $ARCHIVEDIR, or a flat testdir path.
+    """
+    if testdir is not None:
+        # testdir mode: all components read from the same flat directory.
+        # Files must still follow CAM naming conventions: case_id.cam.h0.YYYY-MM.nc
+        # No case_id subdirectory structure is assumed.
+        roots = {'atm': testdir, 'ice': testdir, 'lnd': testdir}
+    elif rundir:
+        roots = {name: scratch_dir + "rundir/" + case_id + "/run" for name in SUFFIXES}
+    elif timeseries:
+        # CESM post-processing writes timeseries under proc/tseries/month_1
+        roots = {name: scratch_dir + "archive/" + case_id + "/" + name + "/proc/tseries/month_1"
+                 for name in SUFFIXES}
+    else:
+        roots = {name: scratch_dir + "archive/" + case_id + "/" + name + "/hist" for name in SUFFIXES}
+    return {name: ' '.join(root.split()) for name, root in roots.items()}
+
+
+def _date(start_year, month):
+    """YYYY-MM of month number `month` (0-based) of a run starting at start_year-01."""
+    return f"{start_year + month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def _scan_months(indexes, start_year, n_months):
+    """
+    Number of consecutive months from start_year-01 found in every
+    (year, month) index of indexes, at most n_months. Returns (N,
+    firstDate, lastDate): lastDate is the first month missing, or the
+    last month found when the n_months limit is reached; firstDate is
+    None when N is 0.
+    """
+    N = 0
+    while N < n_months and all((start_year + N // 12, N % 12 + 1) in index for index in indexes):
+        N += 1
+    firstDate = _date(start_year, 0) if N > 0 else None
+    lastDate  = _date(start_year, N - 1 if N == n_months else N)
+    return N, firstDate, lastDate
+
+
+def _windows(int1_yr, int2_yr, n_months=None, warn=True):
+    """
+    int1 and int2 in months, with int1 reset to one year if it is not the
+    shorter window and both capped at n_months (None: not capped). Each
+    adjustment is reported unless warn is False.
+    """
+    int1 = int1_yr * 12
+    int2 = int2_yr * 12
+    if int1 >= int2:
+        if warn:
+            print(f"  WARNING: --int1 ({int1_yr} yr) must be less than --int2 ({int2_yr} yr). Setting int1 = 1 year.")
+        int1 = 12
+    if n_months is not None and int1 > n_months:
+        if warn:
+            print(f"  WARNING: --int1 ({int1_yr} years, {int1} months) exceeds available timesteps ({n_months}). "
+                  f"Capping int1 at {n_months} months.")
+        int1 = n_months
+    if n_months is not None and int2 > n_months:
+        if warn:
+            print(f"  WARNING: --int2 ({int2_yr} years, {int2} months) exceeds available timesteps ({n_months}). "
+                  f"Capping int2 at {n_months} months "
+                  f"({n_months//12} years, {n_months%12} months remainder).")
+        int2 = n_months
+    return int1, int2
+
+
+class TrendResult:
+    """
+    Outcome of Trend.run_case: the ComponentSeries of each component
+    (None when it was not requested) and the run's metadata.
+
+    Attributes:
+        case_id, firstDate, lastDate, n_months
+        atm, ice, lnd   -- core.ComponentSeries or None
+        failed          -- {component: [(filepath, error), ...]}
+        timing          -- {phase: seconds}
+        profile         -- per-file read records (timing=True), else None
+    """
+
+    def __init__(self, case_id, firstDate, lastDate, series, failed, timing, profile):
+        self.case_id   = case_id
+        self.firstDate = firstDate
+        self.lastDate  = lastDate
+        self.series    = series
+        self.failed    = failed
+        self.timing    = timing
+        self.profile   = profile
+
+    atm = property(lambda self: self.series.get('atm'))
+    ice = property(lambda self: self.series.get('ice'))
+    lnd = property(lambda self: self.series.get('lnd'))
+
+    @property
+    def n_months(self):
+        return max([len(s) for s in self.series.values() if s is not None] + [0])
+
+    def __getitem__(self, name):
+        return self.series[name]
+
+    def __repr__(self):
+        comps = ', '.join(name for name, s in self.series.items() if s is not None)
+        return (f"TrendResult({self.case_id!r}, {self.firstDate} to {self.lastDate}, "
+                f"{self.n_months} months, {comps})")
+
+
+class Trend:
+    """
+    Analysis session shared by any number of run_case() calls.
+
+    Session settings are where files are found (scratch_dir, testdir,
+    rundir, timeseries), the number of worker processes, the prefetch
+    depth of serial reads, the I/O backend (see trend_io; 'auto' probes
+    the installed ones), the read engine ('stream', or 'dask' with its
+    dask_scheduler and memory_limit, see trend_dask), the global-mean
+    cache and how ice and land are weighted. vars.in is read once, when
+    the session is created.
+
+    Kept between calls:
+      - directory indexes, re-listed only when the directory's mtime changes
+      - the lon/lat of each first file and the weights built from them,
+        one array per grid
+      - the global-mean cache: cache=True keeps it in memory only, a path
+        also loads it from and saves it to that file, None disables it
+      - the worker pool (jobs > 1), re-created only when a new grid appears
+      - the dask.distributed client of engine='dask' (not for 'threads')
+
+    close() (or leaving a `with Trend(...)` block) shuts the pool and client down.
+    """
+
+    def __init__(self, scratch_dir=SCRATCH_DIR, testdir=None, rundir=False, timeseries=False,
+                 jobs=1, cache=True, cache_max=100000, clear_cache=False,
+                 cam_weights=False, weights_dir='cache/weights', prefetch=0, backend='auto',
+                 engine='stream', dask_scheduler='threads', memory_limit=None):
+        self.scratch_dir = scratch_dir
+        self.testdir     = testdir
+        self.rundir      = rundir
+        self.timeseries  = timeseries
+        self.jobs        = jobs
+        self.cache_max   = cache_max
+        self.cam_weights = cam_weights
+        self.weights_dir = weights_dir
+        self.prefetch    = prefetch
+        self.backend     = backend
+        trend_io.set_backend(backend)
+        if engine not in ('stream', 'dask'):
+            raise ValueError(f"unknown engine '{engine}'; choose stream or dask")
+        if engine == 'dask' and not trend_dask.available():
+            raise ValueError("engine 'dask' needs the dask package")
+        if engine == 'dask' and timeseries:
+            raise ValueError("--engine dask reads monthly history files and is not supported with --timeseries")
+        self.engine         = engine
+        self.dask_scheduler = dask_scheduler
+        self.memory_limit   = trend_dask.parse_memory(memory_limit) if engine == 'dask' else None
+
+        #
+        # read vars.in
+        #
+        (self.atmvars_in, self.icevars_in, self.lndvars_in,
+         self.atmprint_in, self.iceprint_in, self.lndprint_in,
+         self.atmplot_in, self.iceplot_in, self.lndplot_in, derived_in) = trend.read_request_var()
+
+        # series columns for each component: the variables read, then the
+        # derived fields compiled from vars.in (energy_top/energy_bot first for
+        # the atmosphere if "energy" is requested)
+        energy_requested = 'energy' in self.atmprint_in
+        self.derived = {
+            'atm': core.DerivedColumns(self.atmvars_in, (core.ENERGY_DEFINITIONS if energy_requested else [])
+                                                        + derived_in['atm']),
+            'ice': core.DerivedColumns(self.icevars_in, derived_in['ice']),
+            'lnd': core.DerivedColumns(self.lndvars_in, derived_in['lnd']),
+        }
+
+        # persistent global-mean cache (optional)
+        self.cache_path = cache if isinstance(cache, str) else None
+        if clear_cache:
+            core.clear_cache(self.cache_path if self.cache_path is not None else 'cache/trend_cache.json')
+        self.cache = core.load_cache(self.cache_path) if cache else None
+
+        self._indexes  = {}     # (kind, root, case_id, prefix) -> (dir mtime, index)
+        self._peeks    = {}     # first CAM file -> (lon, lat, lev)
+        self._lonlat   = {}     # lon/lat hash -> grid key
+        self._native   = {}     # (component, path, size, mtime) -> grid key or None
+        self._grids    = {}     # grid key -> weights
+        self._pool     = None
+        self._pool_keys = frozenset()
+        self._client   = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shut down the worker pool and dask client (the cache file is saved by every run_case)."""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._client is not None:
+            cluster = self._client.cluster
+            self._client.close()
+            if cluster is not None:
+                cluster.close()
+            self._client = None
+
+    def save_cache(self):
+        """Write the global-mean cache to its file, if the session has one."""
+        if self.cache is not None and self.cache_path is not None:
+            core.save_cache(self.cache, self.cache_path, max_entries=self.cache_max)
+
+    #------------------------------------------
+    # session caches
+    #------------------------------------------
+    def _index(self, kind, root, case_id, prefix):
+        """Monthly or timeseries index of a directory, re-listed only if it changed."""
+        try:
+            mtime = os.stat(root).st_mtime_ns
+        except OSError:
+            mtime = None
+        key = (kind, root, case_id, prefix)
+        hit = self._indexes.get(key)
+        if hit is not None and mtime is not None and hit[0] == mtime:
+            return hit[1]
+        if kind == 'monthly':
+            index = core.index_monthly_files(root, case_id, prefix)
+        else:
+            index = core.index_timeseries_files(root, case_id, prefix)
+        self._indexes[key] = (mtime, index)
+        return index
+
+    def _peek(self, filepath):
+        """lon, lat, lev of a CAM file, read once per session."""
+        if filepath not in self._peeks:
+            ncid = nc.Dataset(filepath, 'r')
+            lon = ncid.variables['lon'][:]
+            lat = ncid.variables['lat'][:]
+            lev = ncid.variables['lev'][:] if 'lev' in ncid.variables else np.zeros(0)
+            ncid.close()
+            self._peeks[filepath] = (lon, lat, lev)
+        return self._peeks[filepath]
+
+    def _cam_grid(self, lon, lat):
+        """Grid key of the CAM weights for lon/lat, built once per grid."""
+        h = hashlib.sha1(np.asarray(lon, dtype=float).tobytes() + b'|'
+                         + np.asarray(lat, dtype=float).tobytes()).hexdigest()
+        if h not in self._lonlat:
+            weights = core.build_area_weights(lon, lat)
+            key = core.weights_fingerprint(weights)
+            self._grids.setdefault(key, weights)
+            self._lonlat[h] = key
+        return self._lonlat[h]
+
+    def _native_grid(self, filepath, component):
+        """Grid key of the native weights in a file, or None if it has none."""
+        st  = os.stat(filepath)
+        memo = (component, filepath, st.st_size, st.st_mtime_ns)
+        if memo not in self._native:
+            native = core.load_native_weights(filepath, component, self.weights_dir)
+            key = None
+            if native is not None:
+                key = core.weights_fingerprint(native)
+                self._grids.setdefault(key, native)
+            self._native[memo] = key
+        return self._native[memo]
+
+    def _component_grids(self, lon, lat, first_files, label=''):
+        """
+        Grid key of each component: the CAM lon/lat weights, except that ice
+        and land fields are averaged with weights from their own grid (CICE
+        tarea*tmask, CLM area*landfrac) taken from their first file in
+        first_files ({'ice': path, 'lnd': path}, None if there is none) and
+        cached by grid fingerprint in weights_dir, unless cam_weights is set.
+        Files without those variables fall back to the CAM weights. Messages
+        are prefixed with label.
+        """
+        grid = self._cam_grid(lon, lat)
+        grid_by_comp = {name: grid for name in SUFFIXES}
+        if self.cam_weights:
+            return grid_by_comp
+        for name, filepath in first_files.items():
+            component = SUFFIXES[name]
+            native    = self._native_grid(filepath, component) if filepath else None
+            if native is None:
+                print(f"  {label}{name}: no native grid area in first file, using CAM weights")
+            else:
+                print(f"  {label}{name}: using native {component} grid weights {self._grids[native].shape}")
+                grid_by_comp[name] = native
+        return grid_by_comp
+
+    def scan_case(self, case_id, names, start_year=1, n_months=6000):
+        """
+        Monthly history files of one case, found as run_case finds them:
+        the consecutive months from start_year-01 that every component in
+        names ('atm', 'ice', 'lnd') has, at most n_months. Returns (files,
+        firstDate, lastDate) with files {name: [paths]}; firstDate is None
+        when the first month is missing.
+        """
+        roots   = case_roots(case_id, self.scratch_dir, self.testdir, self.rundir)
+        prefix  = {'atm': prefixA, 'ice': prefixI, 'lnd': prefixL}
+        indexes = {name: self._index('monthly', roots[name], case_id, prefix[name]) for name in names}
+        N, firstDate, lastDate = _scan_months(list(indexes.values()), start_year, n_months)
+        files = {name: core.consecutive_months(index, start_year, N) for name, index in indexes.items()}
+        return files, firstDate, lastDate
+
+    def case_grids(self, case_id, files, start_year=1):
+        """
+        Grid keys and weights of the components of a case, from the lon/lat
+        of its first CAM file and the first ice and land files in files
+        (see scan_case); cases on the same grid share one weights array.
+        Returns ({name: grid key}, {name: weights}).
+        """
+        root = case_roots(case_id, self.scratch_dir, self.testdir, self.rundir)['atm']
+        lon, lat, _ = self._peek(f"{root}/{case_id}{prefixA}{start_year:04d}-01.nc")
+        grid_by_comp = self._component_grids(lon, lat, {name: paths[0] for name, paths in files.items()
+                                                        if name != 'atm'}, label=f"{case_id} ")
+        return grid_by_comp, {name: self._grids[grid_by_comp[name]] for name in files}
+
+    def _read_pool(self, keys):
+        """Shared worker pool holding the weights of every grid in keys."""
+        keys = frozenset(keys)
+        if self._pool is not None and not keys <= self._pool_keys:
+            self._pool.shutdown()
+            self._pool = None
+        if self._pool is None:
+            self._pool_keys = frozenset(self._grids)
+            self._pool = core.make_read_pool(dict(self._grids), self.jobs)
+        return self._pool
+
+    def _dask_client(self):
+        """dask.distributed client of the session, started on first use (None: threads)."""
+        if self._client is None:
+            self._client = trend_dask.make_client(self.dask_scheduler, self._dask_workers(), self.memory_limit)
+        return self._client
+
+    def _dask_workers(self):
+        """dask workers: jobs if set, else one per core (None)."""
+        return self.jobs if self.jobs > 1 else None
+
+    def _series_rows(self, name, means, ncols):
+        """Series rows from global means (one month or (N, nvars)), derived columns filled."""
+        means = np.asarray(means, dtype=float)
+        rows  = np.zeros(means.shape[:-1] + (ncols,), dtype=float)
+        rows[..., :means.shape[-1]] = means
+        return self.derived[name].apply(rows)
+
+    #------------------------------------------
+    # one case
+    #------------------------------------------
+    def run_case(self, case_id, cam=False, cice=False, clm=False, start_year=1, n_months=6000,
+                 int1=1, int2=10, print_int=None, avgfreq=2,
+                 save_data=False, data_format='text', plots=False, show=False,
+                 drift=False, timing=False, timing_json=None, timing_slowest=10,
+                 follow=False, follow_interval=60.0, shard=None):
+        """
+        Scan, read and average one case and write the requested outputs;
+        returns a TrendResult. Arguments match the trend.py options: int1
+        and int2 are in years, print_int is -p (None for no running
+        output), avgfreq is -a. Raises ValueError for invalid settings or
+        a case without files.
+
+        shard=(i, N) reads only the i-th of N contiguous month ranges of
+        the run and writes its global means with trend_utils.print2shard
+        instead of the usual outputs; merge_case() joins the shards. The
+        TrendResult of a shard holds no series.
+        """
+        if timing_json is not None:
+            timing = True
+        START_YEAR = int(start_year)
+        NT         = int(n_months)
+        do_atm, do_ice, do_lnd = cam, cice, clm
+        if do_atm == False and do_ice == False and do_lnd == False:
+            raise ValueError("must choose a source model; cam, cice, clm")
+        if self.timeseries and follow:
+            raise ValueError("--follow is not supported with --timeseries")
+        requested = ((list(self.atmvars_in) if cam else []) + (list(self.icevars_in) if cice else [])
+                     + (list(self.lndvars_in) if clm else []))
+        if self.timeseries and any(':' in v for v in requested):
+            raise ValueError("3D variables (NAME:SPEC in vars.in) are read from monthly history files, "
+                             "not with --timeseries")
+        if shard is not None:
+            shard, nshards = shard
+            if not 1 <= shard <= nshards:
+                raise ValueError(f"--shard {shard}/{nshards}: i must be between 1 and {nshards}")
+            if self.timeseries or follow:
+                raise ValueError("--shard is not supported with --timeseries or --follow")
+            if self.engine == 'dask':
+                raise ValueError("--shard is not supported with --engine dask")
+
+        atmvars_in, icevars_in, lndvars_in = self.atmvars_in, self.icevars_in, self.lndvars_in
+        atmprint_in, iceprint_in, lndprint_in = self.atmprint_in, self.iceprint_in, self.lndprint_in
+        roots = case_roots(case_id, self.scratch_dir, self.testdir, self.rundir, self.timeseries)
+        root_atm, root_ice, root_lnd = roots['atm'], roots['ice'], roots['lnd']
+
+        # define time averaging intervals
+        int1_yr, int2_yr = int1, int2
+        int1 = int1_yr * 12
+        int2 = int2_yr * 12
+
+        #------------------------------------------
+        # Peak in first file to get lon, lat, lev
+        #------------------------------------------
+        times = {}
+
+        t0 = time.time()
+
+        if self.timeseries:
+            # index the timeseries files once; the scan and reads reuse these
+            ts_index_atm = self._index('timeseries', root_atm, case_id, prefixA)
+            ts_index_ice = self._index('timeseries', root_ice, case_id, prefixI) if do_ice else {}
+            ts_index_lnd = self._index('timeseries', root_lnd, case_id, prefixL) if do_lnd else {}
+            segments = [seg for v in atmvars_in for seg in ts_index_atm.get(v, [])]
+            if not segments:
+                raise ValueError(f"no timeseries files for {list(atmvars_in)} found in {root_atm}")
+            file_atm = segments[0][2]
+        else:
+            ts_index_atm = ts_index_ice = ts_index_lnd = None
+            file_atm = f"{root_atm}/{case_id}.cam.h0.{START_YEAR:04d}-01.nc"
+
+        lon, lat, lev = self._peek(file_atm)
+        nlon, nlat, nlev = lon.size, lat.size, lev.size
+
+        times['file peek'] = time.time() - t0
+        if timing: print_timing('file peek', times['file peek'])
+
+
+        #------------------------------------------------------
+        # Print setup information to screen
+        #-------------------------------------------------------
+        print("\n")
+        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        print("~~~~~~~~~~~~~~~~~ ExoCAM trend analysis ~~~~~~~~~~~~~~~~")
+        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        print("=== File series descriptors ===")
+        print(case_id, " ", START_YEAR, " ", root_atm)
+        if do_atm == True:
+            print(prefixA)
+        if do_ice == True:
+            print(prefixI)
+        if do_lnd == True:
+            print(prefixL)
+
+        if do_atm == True:
+            print("atmosphere model variables")
+            print(atmvars_in)
+            print("atmosphere print variables")
+            print(atmprint_in)
+            print("atmosphere plot variables")
+            print(self.atmplot_in)
+
+        if do_ice == True:
+            print("ice model variables")
+            print(icevars_in)
+            print("ice print variables")
+            print(iceprint_in)
+            print("ice plot variables")
+            print(self.iceplot_in)
+
+        if do_lnd == True:
+            print("land model variables")
+            print(lndvars_in)
+            print("land print variables")
+            print(lndprint_in)
+            print("land plot variables")
+            print(self.lndplot_in)
+
+        print("=== Resolution ===");
+        print("nlon  ", nlon)
+        print("nlat  ", nlat)
+        print("nlev  ", nlev)
+
+        #-----------------------------------------------------------------------------------------------------------------
+        # File scan: determine N_actual, populate time vectors and date strings
+        # No data is read here; each component directory is listed once with
+        # os.scandir into a (year, month) -> path index, and the months are then
+        # checked against the index instead of probing the filesystem. The
+        # indexes are kept by the session and re-listed only when the
+        # directory has changed.
+        #-----------------------------------------------------------------------------------------------------------------
+        print("========================================")
+        print("=========  scanning file series ========")
+        print("========================================")
+        t0 = time.time()
+        if self.timeseries:
+            # months covered by a timeseries file for every requested variable
+            index_atm = core.timeseries_coverage(ts_index_atm, atmvars_in) if do_atm else {}
+            index_ice = core.timeseries_coverage(ts_index_ice, icevars_in) if do_ice else {}
+            index_lnd = core.timeseries_coverage(ts_index_lnd, lndvars_in) if do_lnd else {}
+        else:
+            index_atm = self._index('monthly', root_atm, case_id, prefixA) if do_atm else {}
+            index_ice = self._index('monthly', root_ice, case_id, prefixI) if do_ice else {}
+            index_lnd = self._index('monthly', root_lnd, case_id, prefixL) if do_lnd else {}
+        N_actual, firstDate, lastDate = _scan_months(
+            [index for index, on in ((index_atm, do_atm), (index_ice, do_ice), (index_lnd, do_lnd)) if on],
+            START_YEAR, NT)
+        if firstDate is not None:
+            print("Date of first data read =", firstDate)
+        times['file scan'] = time.time() - t0
+        print("Scan complete. Timesteps found:", N_actual)
+        if timing: print_timing('file scan', times['file scan'])
+
+        # The windows are capped at the months found; in --follow mode they are
+        # widened as new months arrive, so the output always matches a one-shot
+        # run over the same files. A shard computes no running means.
+        if shard is None:
+            int1, int2 = _windows(int1_yr, int2_yr, N_actual)
+
+        #-----------------------------------------------------------------------------------------------------------------
+        # Read all monthly files and compute area-weighted global means.
+        #
+        # Files are taken from the date indexes built during the file scan, starting
+        # at START_YEAR-01, so the reads align with N_actual without re-listing the
+        # directories.
+        #
+        # Assumptions to verify against actual model output:
+        #   - Variables are stored as (time, lat, lon); var[0,:,:] is correct for
+        #     single-snapshot monthly files.
+        #   - weights shape matches the spatial dims of each variable: (nlat, nlon)
+        #     for CAM, the component's own grid for CICE/CLM native-grid weights.
+        #   - series columns follow the order of the variables in vars.in, with
+        #     the derived fields (energy_top/energy_bot first for the atmosphere)
+        #     appended.
+        #-----------------------------------------------------------------------------------------------------------------
+        print("========================================")
+        print("=========  reading and averaging  ======")
+        print("========================================")
+
+        def first_file(index, ts_index, varnames):
+            if self.timeseries:
+                segments = [seg for v in varnames for seg in ts_index.get(v, [])]
+                return segments[0][2] if segments else None
+            files = core.consecutive_months(index, START_YEAR, 1)
+            return files[0] if files else None
+
+        t0 = time.time()
+        grid_by_comp = self._component_grids(lon, lat, {
+            name: first_file(index, ts_index, varnames)
+            for name, on, index, ts_index, varnames in (
+                ('ice', do_ice, index_ice, ts_index_ice, icevars_in),
+                ('lnd', do_lnd, index_lnd, ts_index_lnd, lndvars_in)) if on})
+        if not self.cam_weights:
+            times['native weights'] = time.time() - t0
+        weights_by_comp = {name: self._grids[key] for name, key in grid_by_comp.items()}
+
+        # I/O backend for each file format, chosen on the first file of each
+        # component before the worker pool starts so every worker uses it
+        t0 = time.time()
+        for name, index, ts_index, varnames in (('atm', index_atm, ts_index_atm, atmvars_in),
+                                                ('ice', index_ice, ts_index_ice, icevars_in),
+                                                ('lnd', index_lnd, ts_index_lnd, lndvars_in)):
+            if {'atm': do_atm, 'ice': do_ice, 'lnd': do_lnd}[name]:
+                filepath = first_file(index, ts_index, varnames)
+                if filepath:
+                    trend_io.prepare(filepath, list(varnames))
+        times['I/O backend'] = time.time() - t0
+        if timing: print_timing('I/O backend', times['I/O backend'])
+
+        if shard is not None:
+            return self._run_shard(case_id, shard, nshards, START_YEAR, N_actual, lastDate,
+                                   [(name, root, prefix, index) for name, root, prefix, index in (
+                                       ('atm', root_atm, prefixA, index_atm),
+                                       ('ice', root_ice, prefixI, index_ice),
+                                       ('lnd', root_lnd, prefixL, index_lnd))
+                                    if {'atm': do_atm, 'ice': do_ice, 'lnd': do_lnd}[name]],
+                                   grid_by_comp, weights_by_comp, times, timing)
+
+        cache = self.cache
+
+        # per-file profiling records, collected only with timing
+        profile = [] if timing else None
+
+        # one right-sized series per active component (None when turned off)
+        series_by_comp = {
+            'atm': core.ComponentSeries('atm', self.derived['atm'].columns, int1, int2, N_actual) if do_atm else None,
+            'ice': core.ComponentSeries('ice', self.derived['ice'].columns, int1, int2, N_actual) if do_ice else None,
+            'lnd': core.ComponentSeries('lnd', self.derived['lnd'].columns, int1, int2, N_actual) if do_lnd else None,
+        }
+        seriesA, seriesI, seriesL = series_by_comp['atm'], series_by_comp['ice'], series_by_comp['lnd']
+
+        components = []
+        if do_atm == True:
+            components.append(('atm', root_atm, prefixA, list(atmvars_in), seriesA, atmprint_in,
+                               index_atm, ts_index_atm))
+        if do_ice == True:
+            components.append(('ice', root_ice, prefixI, list(icevars_in), seriesI, iceprint_in,
+                               index_ice, ts_index_ice))
+        if do_lnd == True:
+            components.append(('lnd', root_lnd, prefixL, list(lndvars_in), seriesL, lndprint_in,
+                               index_lnd, ts_index_lnd))
+
+        # --prefetch stall records, one per component (serial monthly reads only)
+        prefetch = self.prefetch if self.jobs <= 1 and not self.timeseries and self.engine == 'stream' else 0
+        stalls   = {c[0]: core.new_prefetch_stats(prefetch) for c in components}
+
+        def component_rows(name, root, prefix, readvars, ncols, index, ts_index, pool, failed):
+            """
+            Ingestion stage for one component: yields (i, row) for each month.
+            Monthly history files are reduced one at a time as they are needed;
+            timeseries files hold many months per file and are read up front.
+            """
+            if name in dask_means:
+                gm, dask_failed = dask_means[name]
+                failed.extend(dask_failed)
+                yield from enumerate(self._series_rows(name, gm, ncols))
+                return
+            if self.timeseries:
+                gm, files = core.read_timeseries_files(root, case_id, prefix, readvars,
+                                                       START_YEAR, N_actual, weights_by_comp[name],
+                                                       index=ts_index, profile=profile)
+                # the whole run is in hand: derived fields in one step over the matrix
+                yield from enumerate(self._series_rows(name, gm, ncols))
+                return
+            files = core.consecutive_months(index, START_YEAR, N_actual)
+            rows  = core.iter_monthly_means(files, prefix, readvars, weights_by_comp[name],
+                                            jobs=self.jobs, cache=cache, pool=pool,
+                                            profile=profile, failed=failed,
+                                            pool_key=grid_by_comp[name],
+                                            prefetch=prefetch, stalls=stalls[name])
+            for i, means in rows:
+                yield i, self._series_rows(name, means, ncols)
+
+        #-----------------------------------------------------------------------------------------------------------------
+        # Streaming pipeline: file -> global means -> running means and slopes -> screen/text sinks.
+        #
+        # Each month is reduced, appended to its component series (whose running
+        # means only need the last int2 months to extend) and written out before
+        # the next month is needed, so -p and text --save-data output appears while
+        # the run is still being read. Components advance together month by month; with
+        # jobs > 1 they share the session's process pool, which keeps a few files per
+        # component in flight ahead of the output.
+        #-----------------------------------------------------------------------------------------------------------------
+        datafiles = {}
+        if save_data == True and data_format in ('text', 'both'):
+            for name, root, prefix, readvars, series, print_in, index, ts_index in components:
+                datafiles[name] = f"data/{case_id}_{firstDate}-{lastDate}_{SUFFIXES[name]}.txt"
+                trend.header2text(datafiles[name], series, print_in)
+
+        failed = {c[0]: [] for c in components}
+
+        # --engine dask: all components are reduced up front by one dask
+        # graph over the scanned files (see trend_dask), and the loop
+        # below only appends the rows
+        dask_means = {}
+        if self.engine == 'dask':
+            t1 = time.time()
+            streams = [(core.consecutive_months(index, START_YEAR, N_actual), prefix, readvars,
+                        weights_by_comp[name])
+                       for name, root, prefix, readvars, series, print_in, index, ts_index in components]
+            results = trend_dask.monthly_means(streams, workers=self._dask_workers(),
+                                               memory_limit=self.memory_limit, client=self._dask_client())
+            dask_means = {c[0]: result for c, result in zip(components, results)}
+            if timing: print_timing('dask reduction', time.time() - t1)
+
+        use_pool = self.jobs > 1 and not self.timeseries and self.engine == 'stream'
+        if use_pool:
+            pool = self._read_pool(grid_by_comp[c[0]] for c in components)
+            desc = f"reading files ({self.jobs} jobs)"
+        else:
+            pool = None
+            desc = "reading files"
+
+        t0 = time.time()
+        t_out = 0.0
+        firstPrintCall = True
+        streams = [component_rows(name, root, prefix, readvars, len(series.columns),
+                                  index, ts_index, pool, failed[name])
+                   for name, root, prefix, readvars, series, print_in, index, ts_index in components]
+        try:
+            # running screen output takes the place of the progress bar
+            for i in tqdm(range(N_actual), desc=desc, unit="month", disable=print_int is not None):
+                for (name, root, prefix, readvars, series, print_in, index, ts_index), stream in zip(components, streams):
+                    _, row = next(stream)
+                    series.append(row)
+                    # print2text rows start at the second month
+                    if name in datafiles and i >= 1:
+                        trend.append2text(datafiles[name], series, print_in, i)
+
+                if print_int is not None and (i + 1) % print_int == 0:
+                    t1 = time.time()
+                    trend.print2screen(atmprint_in, iceprint_in, lndprint_in,
+                                       firstPrintCall, avgfreq,
+                                       seriesA, seriesI, seriesL, i)
+                    firstPrintCall = False
+                    t_out += time.time() - t1
+        finally:
+            # stop any reads still queued ahead (only after an interruption)
+            for stream in streams:
+                stream.close()
+
+        elapsed = time.time() - t0
+        times['read, average and running means'] = elapsed - t_out
+        times['print output'] = t_out
+        if timing: print_timing('read, average and running means', elapsed - t_out)
+
+        # components are read concurrently, so each is charged the whole read time
+        read_wall = {c[2].strip('.'): elapsed - t_out for c in components}
+        for c in components:
+            name = c[0]
+            if failed[name]:
+                print(f"  {name}: {len(failed[name])} of {N_actual} files could not be read")
+            print(f"  {name}: read {N_actual} months")
+        for name, outfile in datafiles.items():
+            print(f"  Data written to {outfile}")
+        if prefetch:
+            trend.print_prefetch(stalls)
+
+        self.save_cache()
+
+        #-----------------------------------------------------------------------------------------------------------------
+        # end output loop
+        #-----------------------------------------------------------------------------------------------------------------
+        print("Concluding             ", case_id)
+        print("Number of files read:  ", N_actual)
+        print("End date (year-month): ", lastDate)
+
+
+        #------------------------------------------------------
+        # Follow mode: poll the run/archive directories for new
+        # monthly files. Each new month is read on its own and
+        # appended to the component series, whose running means
+        # extend incrementally, so every step costs the same
+        # regardless of how long the run already is. The model
+        # may still be writing a file when its name appears, so a
+        # month is read only once its files have kept their size
+        # and mtime since the previous poll, and is polled again
+        # (not stored as NaN) if one of them cannot be read yet.
+        #-------------------------------------------------------
+        if follow == True:
+            print("========================================")
+            print("=========  following run          ======")
+            print("========================================")
+            print(f"Polling every {follow_interval:g}s for month {N_actual + 1} ({lastDate}); Ctrl-C to stop")
+
+            last_stat = {}      # path -> (size, mtime) at the previous poll
+            retrying  = set()   # files reported as not readable yet
+            try:
+                while N_actual < NT:
+                    year  = START_YEAR + N_actual // 12
+                    month = N_actual % 12 + 1
+                    found = {}
+                    for c in components:
+                        path = self._index('monthly', c[1], case_id, c[2]).get((year, month))
+                        if path is None:
+                            break
+                        found[c[0]] = path
+                    if len(found) < len(components):
+                        time.sleep(follow_interval)
+                        continue
+
+                    # wait until no file of the month changes between two polls
+                    try:
+                        stat = {path: (st.st_size, st.st_mtime_ns)
+                                for path, st in ((p, os.stat(p)) for p in found.values())}
+                    except FileNotFoundError:
+                        stat = {}
+                    if not stat or any(last_stat.get(path) != value for path, value in stat.items()):
+                        last_stat = stat
+                        time.sleep(follow_interval)
+                        continue
+
+                    # read every component before storing anything
+                    failed = []
+                    rows   = {name: core.read_file_means(found[name], prefix, readvars,
+                                                         weights_by_comp[name], failed=failed)
+                              for name, root, prefix, readvars, series, print_in, index, ts_index in components}
+                    if failed:
+                        for path, error in failed:
+                            if path not in retrying:
+                                print(f"  {os.path.basename(path)} cannot be read yet ({error}), retrying")
+                                retrying.add(path)
+                        last_stat = {}
+                        time.sleep(follow_interval)
+                        continue
+
+                    i = N_actual
+                    int1, int2 = _windows(int1_yr, int2_yr, N_actual + 1, warn=False)
+                    for name, root, prefix, readvars, series, print_in, index, ts_index in components:
+                        series.set_windows(int1, int2)
+                        series.append(self._series_rows(name, rows[name], len(series.columns)))
+                        if name in datafiles:
+                            trend.append2text(datafiles[name], series, print_in, i)
+
+                    N_actual += 1
+                    if firstDate is None:
+                        firstDate = f"{year:04d}-{month:02d}"
+                    # as the file scan: the last month read at the -n limit, else the next one
+                    lastDate = _date(START_YEAR, N_actual - 1 if N_actual == NT else N_actual)
+
+                    if print_int is None or (i + 1) % print_int == 0:
+                        trend.print2screen(atmprint_in, iceprint_in, lndprint_in,
+                                           firstPrintCall, avgfreq,
+                                           seriesA, seriesI, seriesL, i)
+                        firstPrintCall = False
+                print(f"Reached -n limit of {NT} months, stopping follow mode")
+            except KeyboardInterrupt:
+                print("\nFollow mode stopped")
+
+            # data file names carry the date range; rename to the final range
+            for name, outfile in datafiles.items():
+                suffix  = outfile[outfile.rindex('_'):]
+                renamed = f"data/{case_id}_{firstDate}-{lastDate}{suffix}"
+                if renamed != outfile:
+                    os.replace(outfile, renamed)
+                    print(f"  Data file renamed to {renamed}")
+
+            print("Number of files read:  ", N_actual)
+            print("End date (year-month): ", lastDate)
+
+        self._finish(case_id, series_by_comp, firstDate, lastDate, int1_yr, int2_yr,
+                     save_data, data_format, plots, show, drift, times)
+
+        if timing:
+            print("========================================")
+            print("=========  timing summary         ======")
+            print("========================================")
+            total = sum(times.values())
+            for label, elapsed in times.items():
+                print_timing(label, elapsed)
+            print_timing('total', total)
+
+            summary = core.summarize_profile(profile, wall=read_wall, slowest=timing_slowest)
+            trend.print_profile(summary)
+
+            if timing_json is not None:
+                with open(timing_json, 'w') as f:
+                    json.dump({'case_id': case_id, 'phases': times, 'total': total,
+                               'summary': summary, 'prefetch': stalls if prefetch else None,
+                               'files': profile}, f, indent=1)
+                print(f"  timing written to {timing_json}")
+
+        return TrendResult(case_id, firstDate, lastDate, series_by_comp, failed, times, profile)
+
+
+    def _finish(self, case_id, series_by_comp, firstDate, lastDate, int1_yr, int2_yr,
+                save_data, data_format, plots, show, drift, times):
+        """Binary data files, plots and the final and drift summaries of a complete run."""
+        seriesA, seriesI, seriesL = series_by_comp['atm'], series_by_comp['ice'], series_by_comp['lnd']
+
+        #------------------------------------------------------
+        # Binary data files, written once the series is complete
+        # (after follow mode, so they carry the final date range)
+        #-------------------------------------------------------
+        if save_data == True and data_format in ('binary', 'both'):
+            t0 = time.time()
+            trend.print2binary(seriesA, seriesL, seriesI, firstDate, lastDate, case_id)
+            times['save data'] = time.time() - t0
+
+        #------------------------------------------------------
+        # Call line plotting script
+        #-------------------------------------------------------
+        if plots == True:
+            t0 = time.time()
+            print('Plotting...')
+            trend.timeSeriesPlots(self.atmplot_in, self.lndplot_in, self.iceplot_in, \
+                                  seriesA, seriesL, seriesI, \
+                                  firstDate, lastDate, case_id, show=show, jobs=self.jobs)
+            times['plots'] = time.time() - t0
+
+        trend.print_final_summary(seriesA, seriesI, seriesL,
+                                  case_id, firstDate, lastDate,
+                                  int1_yr, int2_yr)
+
+        if drift:
+            trend.print_drift_summary(seriesA, seriesI, seriesL)
+
+    #------------------------------------------
+    # shards of one case
+    #------------------------------------------
+    def _run_shard(self, case_id, shard, nshards, start_year, N_actual, run_lastDate, components,
+                   grid_by_comp, weights_by_comp, times, timing):
+        """
+        Read the global means of shard i of N (months (i-1)*N_actual//N up to
+        i*N_actual//N) of every component in components, a list of
+        (name, root, prefix, index), and write them with print2shard,
+        together with run_lastDate, the end date of the scan.
+        """
+        lo = (shard - 1) * N_actual // nshards
+        hi = shard * N_actual // nshards
+        firstDate = _date(start_year, lo)
+        lastDate  = run_lastDate if hi == N_actual else _date(start_year, hi)
+        readvars = {'atm': list(self.atmvars_in), 'ice': list(self.icevars_in), 'lnd': list(self.lndvars_in)}
+
+        print("========================================")
+        print("=========  reading shard          ======")
+        print("========================================")
+        if hi > lo:
+            print(f"Shard {shard} of {nshards}: months {lo + 1} to {hi} of {N_actual} ({firstDate} to {lastDate})")
+        else:
+            print(f"Shard {shard} of {nshards}: no months ({N_actual} months split {nshards} ways)")
+
+        profile = [] if timing else None
+        failed  = {name: [] for name, _, _, _ in components}
+        means   = {name: np.full((hi - lo, len(readvars[name])), np.nan) for name, _, _, _ in components}
+
+        use_pool = self.jobs > 1
+        pool = self._read_pool(grid_by_comp[name] for name, _, _, _ in components) if use_pool else None
+        prefetch = 0 if use_pool else self.prefetch
+        stalls   = {name: core.new_prefetch_stats(prefetch) for name, _, _, _ in components}
+        desc = f"reading files ({self.jobs} jobs)" if use_pool else "reading files"
+
+        t0 = time.time()
+        streams = [core.iter_monthly_means(core.consecutive_months(index, start_year, N_actual)[lo:hi],
+                                           prefix, readvars[name], weights_by_comp[name],
+                                           jobs=self.jobs, cache=self.cache, pool=pool,
+                                           profile=profile, failed=failed[name],
+                                           pool_key=grid_by_comp[name],
+                                           prefetch=prefetch, stalls=stalls[name])
+                   for name, root, prefix, index in components]
+        try:
+            for _ in tqdm(range(hi - lo), desc=desc, unit="month"):
+                for (name, _, _, _), stream in zip(components, streams):
+                    i, row = next(stream)
+                    means[name][i] = row
+        finally:
+            for stream in streams:
+                stream.close()
+        times['read shard'] = time.time() - t0
+        if timing: print_timing('read shard', times['read shard'])
+        if prefetch:
+            trend.print_prefetch(stalls)
+
+        for name, _, _, _ in components:
+            if failed[name]:
+                print(f"  {name}: {len(failed[name])} of {hi - lo} files could not be read")
+            trend.print2shard(case_id, name, SUFFIXES[name], means[name], readvars[name],
+                              shard, nshards, start_year, lo, N_actual, run_lastDate, failed[name])
+        self.save_cache()
+
+        series_by_comp = {'atm': None, 'ice': None, 'lnd': None}
+        return TrendResult(case_id, firstDate, lastDate, series_by_comp, failed, times, profile)
+
+    def merge_case(self, case_id, cam=False, cice=False, clm=False, int1=1, int2=10,
+                   print_int=None, avgfreq=2, save_data=False, data_format='text',
+                   plots=False, show=False, drift=False):
+        """
+        Join the shards of a case written by run_case(shard=(i, N)) in date
+        order and produce the outputs of an unsharded run: running screen
+        output, data files, plots and summaries, under the same names.
+        The joined monthly means are appended to the series one month at
+        a time, so the running means carry over the shard boundaries
+        exactly as in a single pass. Raises ValueError if the shards are
+        incomplete or inconsistent.
+        """
+        if not (cam or cice or clm):
+            raise ValueError("must choose a source model; cam, cice, clm")
+        readvars = {'atm': self.atmvars_in, 'ice': self.icevars_in, 'lnd': self.lndvars_in}
+        print_in = {'atm': self.atmprint_in, 'ice': self.iceprint_in, 'lnd': self.lndprint_in}
+        names    = [name for name, on in (('atm', cam), ('ice', cice), ('lnd', clm)) if on]
+
+        print("========================================")
+        print("=========  merging shards         ======")
+        print("========================================")
+        times  = {}
+        t0     = time.time()
+        means  = {}
+        failed = {}
+        start  = set()
+        for name in names:
+            means[name], start_year, lastDate, nshards, failed[name] = trend.load_shards(
+                case_id, SUFFIXES[name], readvars[name])
+            start.add((start_year, len(means[name]), lastDate))
+            print(f"  {name}: {nshards} shards, {len(means[name])} months")
+        if len(start) > 1:
+            raise ValueError(f"the shards of {case_id} cover different months for each component; "
+                             f"rerun them with the same -y and -n")
+        # the end date is the scan's (see _scan_months), stored with the shards
+        start_year, N, lastDate = start.pop()
+        firstDate = _date(start_year, 0)
+
+        int1_yr, int2_yr = int1, int2
+        int1, int2 = _windows(int1_yr, int2_yr, N)
+
+        series_by_comp = {'atm': None, 'ice': None, 'lnd': None}
+        for name in names:
+            series_by_comp[name] = core.ComponentSeries(name, self.derived[name].columns, int1, int2, N)
+        rows = {name: self._series_rows(name, means[name], len(self.derived[name].columns)) for name in names}
+        seriesA, seriesI, seriesL = series_by_comp['atm'], series_by_comp['ice'], series_by_comp['lnd']
+
+        firstPrintCall = True
+        for i in range(N):
+            for name in names:
+                series_by_comp[name].append(rows[name][i])
+            if print_int is not None and (i + 1) % print_int == 0:
+                trend.print2screen(self.atmprint_in, self.iceprint_in, self.lndprint_in,
+                                   firstPrintCall, avgfreq, seriesA, seriesI, seriesL, i)
+                firstPrintCall = False
+        times['merge and running means'] = time.time() - t0
+
+        for name in names:
+            if failed[name]:
+                print(f"  {name}: {len(failed[name])} of {N} files could not be read")
+        if save_data == True and data_format in ('text', 'both'):
+            trend.print2text(print_in['atm'], print_in['lnd'], print_in['ice'],
+                             seriesA, seriesL, seriesI, firstDate, lastDate, case_id)
+
+        print("Concluding             ", case_id)
+        print("Number of files read:  ", N)
+        print("End date (year-month): ", lastDate)
+
+        self._finish(case_id, series_by_comp, firstDate, lastDate, int1_yr, int2_yr,
+                     save_data, data_format, plots, show, drift, times)
+        return TrendResult(case_id, firstDate, lastDate, series_by_comp, failed, times, None)
+
+
+# run_case keyword arguments that configure the session rather than the case
+_SESSION_ARGS = [p for p in inspect.signature(Trend.__init__).parameters if p != 'self']
+
+
+def run_case(case_id, **kwargs):
+    """
+    One-off analysis of a case: Trend(**session settings).run_case(case_id,
+    **other arguments), closing the session afterwards. Takes the
+    keyword arguments of both Trend() and Trend.run_case().
+    """
+    session = {k: kwargs.pop(k) for k in list(kwargs) if k in _SESSION_ARGS}
+    with Trend(**session) as t:
+        return t.run_case(case_id, **kwargs)
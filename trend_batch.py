@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# trend_batch.py
+#
+#  Author: Wolf, E.T.
+#
+#  Runs the trend.py analysis for many cases in one process, on one
+#  trend_api.Trend session. All cases are scanned first, exactly as
+#  trend.py scans one case; area weights are built once per grid
+#  and shared by every case on that grid; then the monthly files of
+#  all cases and components are reduced through the session's
+#  worker pool (--jobs) and global-mean cache. Each case gets the
+#  usual data files and plots, and one combined table compares the
+#  cases at the end.
+#
+#  Usage:
+#    python trend_batch.py case1 case2 'sweep_*' --cam --cice \
+#        [--testdir PATH | --rundir] [--jobs 8] [--save-data] \
+#        [--plots] [--cache] [--summary data/sweep_summary.txt]
+#
+#  Case names may be shell-style patterns; they are matched against
+#  the case names found in the archive (or run, or test) directory.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import argparse
+import fnmatch
+import os
+import sys
+import time
+from tqdm import tqdm
+import trend_utils as trend
+import trend_core  as core
+import trend_io
+from trend_api import SCRATCH_DIR, Trend, _windows
+
+# component -> (model, file prefix)
+COMPONENTS = {
+    'atm': ('cam',  '.cam.h0.'),
+    'ice': ('cice', '.cice.h.'),
+    'lnd': ('clm',  '.clm2.h0.'),
+}
+
+_GLOB_CHARS = set('*?[')
+
+
+def expand_cases(patterns, args, names):
+    """
+    Case ids from the command line, with shell-style patterns matched
+    against the cases present: the case part of the history file names
+    in --testdir, otherwise the case directories under rundir/ or archive/.
+    """
+    found = None
+    cases = []
+    for pattern in patterns:
+        if not _GLOB_CHARS & set(pattern):
+            matches = [pattern]
+        else:
+            if found is None:
+                found = set()
+                if args.testdir is not None:
+                    prefixes = [COMPONENTS[name][1] for name in names]
+                    for entry in os.scandir(args.testdir):
+                        for prefix in prefixes:
+                            if prefix in entry.name and entry.name.endswith('.nc'):
+                                found.add(entry.name[:entry.name.index(prefix)])
+                else:
+                    top = SCRATCH_DIR + ("rundir" if args.rundir else "archive")
+                    if os.path.isdir(top):
+                        found = {entry.name for entry in os.scandir(top) if entry.is_dir()}
+            matches = sorted(fnmatch.filter(found, pattern))
+            if not matches:
+                print(f"  WARNING: no cases match '{pattern}'")
+        for case_id in matches:
+            if case_id not in cases:
+                cases.append(case_id)
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the trend analysis for many cases at once.')
+    parser.add_argument('cases',        nargs='+', help='Case names or shell-style patterns (quote them)')
+    parser.add_argument('-y',           type=int, default=1,    help='Start year over which to begin timeseries')
+    parser.add_argument('-n',           type=int, default=6000, help='Number of months to integrate over')
+    parser.add_argument('--cam',        action='store_true', help='read atmosphere model data')
+    parser.add_argument('--cice',       action='store_true', help='read sea ice model data')
+    parser.add_argument('--clm',        action='store_true', help='read land model data')
+    parser.add_argument('--rundir',     action='store_true', help='read files from run directory instead of archive')
+    parser.add_argument('--testdir',    type=str, default=None, help='read files of every case from this flat directory')
+    parser.add_argument('--plots',      action='store_true', help='do lineplots for every case')
+    parser.add_argument('--save-data',  action='store_true', dest='save_data', help='write each case\'s global mean time series to data/')
+    parser.add_argument('--data-format', type=str, default='text', choices=['binary', 'text', 'both'], dest='data_format', help='--save-data format: text (default), binary .npy/.json, or both')
+    parser.add_argument('--summary',    type=str, default=None, help='also write the combined summary table to this file')
+    parser.add_argument('--int1',       type=int, default=1,  help='Short averaging window in years (default: 1)')
+    parser.add_argument('--int2',       type=int, default=10, help='Long averaging window in years (default: 10)')
+    parser.add_argument('--jobs',       type=int, default=1,  help='Number of worker processes shared by all cases (default: 1, serial)')
+    parser.add_argument('--backend',    type=str, default='auto', choices=['auto'] + list(trend_io.BACKENDS), help='I/O backend for reading files; auto (default) probes the installed ones on the first file of each format')
+    parser.add_argument('--cache',      type=str, nargs='?', const='cache/trend_cache.json', default=None, help='reuse per-file global means from this cache file (default path: cache/trend_cache.json)')
+    parser.add_argument('--cache-max',  type=int, default=100000, dest='cache_max', help='Maximum number of files kept in the cache (default: 100000)')
+    parser.add_argument('--cam-weights', action='store_true', dest='cam_weights', help='average ice and land fields with the CAM lat/lon weights instead of their native-grid area weights')
+    parser.add_argument('--weights-dir', type=str, default='cache/weights', dest='weights_dir', help='Directory for cached native-grid weights (default: cache/weights)')
+    args = parser.parse_args()
+
+    names = [name for name, flag in (('atm', args.cam), ('ice', args.cice), ('lnd', args.clm)) if flag]
+    if not names:
+        print("must choose a source model; cam, cice, clm")
+        sys.exit()
+
+    # one session for every case: vars.in, directory indexes, weights per
+    # grid, the global-mean cache and the worker pool
+    try:
+        session = Trend(testdir=args.testdir, rundir=args.rundir, jobs=args.jobs,
+                        cache=args.cache, cache_max=args.cache_max, cam_weights=args.cam_weights,
+                        weights_dir=args.weights_dir, backend=args.backend)
+    except ValueError as e:
+        print("ERROR: ", e)
+        sys.exit()
+    with session:
+        run(session, names, args)
+
+
+def run(session, names, args):
+    """Scan, read and report every case of args.cases on one Trend session."""
+    readvars = {'atm': session.atmvars_in, 'ice': session.icevars_in, 'lnd': session.lndvars_in}
+    print_in = {'atm': session.atmprint_in, 'ice': session.iceprint_in, 'lnd': session.lndprint_in}
+    plot_in  = {'atm': session.atmplot_in, 'ice': session.iceplot_in, 'lnd': session.lndplot_in}
+    derived  = session.derived
+
+    #------------------------------------------
+    # Scan every case and build its weights
+    #------------------------------------------
+    t0 = time.time()
+    print("========================================")
+    print("=========  scanning cases        =======")
+    print("========================================")
+    cases = []
+    for case_id in expand_cases(args.cases, args, names):
+        files, firstDate, lastDate = session.scan_case(case_id, names, args.y, args.n)
+        if firstDate is None:
+            print(f"  {case_id}: no {args.y:04d}-01 files for every component, skipping")
+            continue
+        case = {'case': case_id, 'files': files, 'N': len(files[names[0]]),
+                'firstDate': firstDate, 'lastDate': lastDate}
+        try:
+            case['keys'], case['weights'] = session.case_grids(case_id, files, args.y)
+        except (OSError, KeyError) as e:
+            print(f"  {case_id}: could not read grid ({type(e).__name__}: {e}), skipping")
+            continue
+        print(f"  {case_id}: {case['N']} months, {case['firstDate']} to {case['lastDate']}")
+        case['int1'], case['int2'] = _windows(args.int1, args.int2, case['N'])
+        case['series'] = {name: core.ComponentSeries(name, derived[name].columns,
+                                                     case['int1'], case['int2'], case['N'])
+                          for name in names}
+        case['failed'] = {name: [] for name in names}
+        cases.append(case)
+    if not cases:
+        print("no cases to process")
+        sys.exit()
+    grids = {key for case in cases for key in case['keys'].values()}
+    print(f"  {len(cases)} cases on {len(grids)} grids, scanned in {time.time() - t0:.1f}s")
+
+    #------------------------------------------
+    # Read every case through one shared pool.
+    # Each case/component is a bounded stream;
+    # they are advanced in turn so the pool
+    # keeps files of all of them in flight.
+    #------------------------------------------
+    print("========================================")
+    print("=========  reading and averaging  ======")
+    print("========================================")
+    t0 = time.time()
+    for case in cases:
+        for name in names:
+            trend_io.prepare(case['files'][name][0], readvars[name])
+    pool = session._read_pool(grids) if args.jobs > 1 else None
+
+    streams = []
+    for case in cases:
+        for name in names:
+            rows = core.iter_monthly_means(case['files'][name], COMPONENTS[name][1], readvars[name],
+                                           case['weights'][name], jobs=args.jobs, cache=session.cache,
+                                           pool=pool, failed=case['failed'][name],
+                                           pool_key=case['keys'][name])
+            streams.append((case, name, rows))
+
+    total = sum(case['N'] for case in cases) * len(names)
+    with tqdm(total=total, desc=f"reading files ({max(args.jobs, 1)} jobs)", unit="file") as bar:
+        while streams:
+            for entry in list(streams):
+                case, name, rows = entry
+                step = next(rows, None)
+                if step is None:
+                    streams.remove(entry)
+                    continue
+                series = case['series'][name]
+                series.append(session._series_rows(name, step[1], len(series.columns)))
+                bar.update()
+    session.save_cache()
+    for case in cases:
+        for name in names:
+            if case['failed'][name]:
+                print(f"  {case['case']} {name}: {len(case['failed'][name])} of {case['N']} files could not be read")
+    print(f"  read {total} files in {time.time() - t0:.1f}s")
+
+    #------------------------------------------
+    # Per-case data files and plots
+    #------------------------------------------
+    for case in cases:
+        s = case['series']
+        seriesA, seriesI, seriesL = s.get('atm'), s.get('ice'), s.get('lnd')
+        if args.save_data:
+            if args.data_format in ('text', 'both'):
+                trend.print2text(print_in['atm'], print_in['lnd'], print_in['ice'],
+                                 seriesA, seriesL, seriesI,
+                                 case['firstDate'], case['lastDate'], case['case'])
+            if args.data_format in ('binary', 'both'):
+                trend.print2binary(seriesA, seriesL, seriesI,
+                                   case['firstDate'], case['lastDate'], case['case'])
+        if args.plots:
+            trend.timeSeriesPlots(plot_in['atm'], plot_in['lnd'], plot_in['ice'],
+                                  seriesA, seriesL, seriesI,
+                                  case['firstDate'], case['lastDate'], case['case'], jobs=args.jobs)
+
+    trend.print_batch_summary([(case['case'], case['firstDate'], case['lastDate'], case['series'])
+                               for case in cases],
+                              print_in, args.int2, outfile=args.summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,32 @@
 #
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+import ast
 import numpy as np
 import netCDF4 as nc
-import glob
+import hashlib
+import json
 import re
 import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+import trend_io
 
 # Module-level set to suppress duplicate missing-variable warnings
 _warned_missing = set()
 
+# Per-variable validity masks and their normalized weights, reused while a
+# variable's mask stays the same from file to file (see _masked_mean)
+_mask_cache = {}
+
+# Area weights held by each worker process (set once by _init_worker),
+# keyed by component prefix; the None key holds the default weights
+_worker_weights = {}
+
 
 def build_area_weights(lon, lat):
     """
@@ -43,6 +59,86 @@ def build_area_weights(lon, lat):
     return weights / weights.sum()
 
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Native-grid weights for the ice and land models
+#
+# CICE and CLM write their own cell areas and masks to every history
+# file. Weights built from them are stored in a weights cache as
+# <component>_<grid fingerprint>.npz so later runs load them directly.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# component -> (area variable, mask variable, coordinate variables)
+NATIVE_GRID_VARS = {
+    'cice': ('tarea', 'tmask',    ('TLAT', 'TLON')),
+    'clm':  ('area',  'landfrac', ('lat', 'lon')),
+}
+
+
+def _read_2d(ncid, vname):
+    """Read a grid variable as a float (nj, ni) array, fill values -> 0."""
+    raw = ncid.variables[vname][:]
+    while raw.ndim > 2:
+        raw = raw[0]
+    return np.ma.filled(np.ma.asarray(raw, dtype=float), 0.0)
+
+
+def build_native_weights(ncid, component):
+    """
+    Normalized area weights on a component's own grid: the area variable
+    times the mask variable listed in NATIVE_GRID_VARS (CICE tarea*tmask,
+    CLM area*landfrac). Cells outside the mask get zero weight.
+    """
+    area_name, mask_name, _ = NATIVE_GRID_VARS[component]
+    weights = _read_2d(ncid, area_name)
+    if mask_name in ncid.variables:
+        weights = weights * np.clip(_read_2d(ncid, mask_name), 0.0, 1.0)
+    return weights / weights.sum()
+
+
+def grid_fingerprint(ncid, component):
+    """
+    Short hash of a component grid: coordinate values and the area and
+    mask arrays the weights are built from, so cases on the same grid
+    with different land/ocean masks get different weights files.
+    """
+    area_name, mask_name, coords = NATIVE_GRID_VARS[component]
+    h = hashlib.sha1(component.encode())
+    h.update(str(ncid.variables[area_name].shape).encode())
+    for cname in coords:
+        if cname in ncid.variables:
+            h.update(np.ma.filled(ncid.variables[cname][:], 0.0).astype(float).tobytes())
+    for vname in (area_name, mask_name):
+        h.update(vname.encode())
+        if vname in ncid.variables:
+            h.update(_read_2d(ncid, vname).tobytes())
+    return h.hexdigest()[:16]
+
+
+def load_native_weights(filepath, component, weights_dir=None):
+    """
+    Native-grid weights for `component` ('cice' or 'clm') from one of
+    its history files, or None if the file lacks the area variable.
+
+    With weights_dir, weights are looked up in and saved to
+    <weights_dir>/<component>_<fingerprint>.npz.
+    """
+    area_name = NATIVE_GRID_VARS[component][0]
+    with nc.Dataset(filepath, 'r') as ncid:
+        if area_name not in ncid.variables:
+            return None
+        if weights_dir is None:
+            return build_native_weights(ncid, component)
+        path = os.path.join(weights_dir, f"{component}_{grid_fingerprint(ncid, component)}.npz")
+        if os.path.isfile(path):
+            with np.load(path) as f:
+                return f['weights']
+        weights = build_native_weights(ncid, component)
+    os.makedirs(weights_dir, exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}.npz"
+    np.savez(tmp, weights=weights)
+    os.replace(tmp, path)
+    return weights
+
+
 def global_mean_2d(var2d, weights):
     """
     Compute area-weighted global mean of a single 2D field.
@@ -58,56 +154,1211 @@ def global_mean_2d(var2d, weights):
     return float(np.ma.average(ma, weights=weights))
 
 
+def global_means_batch(fields, weights, mask=None):
+    """
+    Area-weighted global means of a stack of 2D fields in one pass.
+
+    fields is an array of shape (nvar, nlat, nlon) (or a masked array);
+    weights is the normalized (nlat, nlon) array from build_area_weights.
+    mask, if given, is a boolean array of the same shape as fields that
+    is True for cells to exclude. NaN cells are always excluded.
+
+    Unmasked stacks reduce with a single matrix-vector product against
+    the flattened weights. Masked stacks zero the invalid cells and
+    divide by the weight of the valid cells, so the result matches
+    global_mean_2d. Fields with no valid cells return np.nan.
+
+    Returns a 1D array of length nvar.
+    """
+    if np.ma.isMaskedArray(fields):
+        m = np.ma.getmaskarray(fields)
+        mask = m if mask is None else (mask | m)
+        fields = np.ma.getdata(fields)
+
+    nvar = fields.shape[0]
+    data = np.asarray(fields, dtype=float).reshape(nvar, -1)
+    w    = np.asarray(weights, dtype=float).ravel()
+
+    invalid = np.isnan(data)
+    if mask is not None:
+        invalid |= np.asarray(mask, dtype=bool).reshape(nvar, -1)
+
+    if not invalid.any():
+        return (data @ w) / w.sum()
+
+    num = np.where(invalid, 0.0, data) @ w
+    den = (~invalid) @ w
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(den > 0.0, num / den, np.nan)
+
+
+def _init_worker(weights, io_state=None):
+    """
+    Pool initializer: keep one copy of the area weights per worker.
+    weights is an array, or a dict of arrays keyed by component prefix.
+    io_state is the parent's I/O backend selection (trend_io.get_state).
+    """
+    global _worker_weights
+    _worker_weights = dict(weights) if isinstance(weights, dict) else {None: weights}
+    if io_state is not None:
+        trend_io.set_state(io_state)
+
+
+def _masked_mean(vname, data, invalid, weights):
+    """
+    Weighted mean of data over the cells not flagged in invalid.
+
+    The valid-cell indices and their renormalized weights are cached per
+    variable; as long as the mask is unchanged (fixed land/ocean masks)
+    each file costs one gather and one dot product over the valid cells.
+    """
+    entry = _mask_cache.get(vname)
+    if (entry is None or entry['weights'] is not weights
+            or not np.array_equal(entry['invalid'], invalid)):
+        index = np.flatnonzero(~invalid)
+        w     = np.asarray(weights, dtype=float).ravel()[index]
+        total = w.sum()
+        entry = {'weights': weights, 'invalid': invalid, 'index': index,
+                 'w': w / total if total > 0.0 else None}
+        _mask_cache[vname] = entry
+    if entry['w'] is None:
+        return np.nan
+    return float(data.ravel()[entry['index']] @ entry['w'])
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# 3D (lev) variables
+#
+# A read name NAME:SPEC (from a vars.in read token, see
+# expand_level_tokens) takes the (time, lev, lat, lon) variable NAME
+# down to one (lat, lon) field or global mean per column:
+#   NAME:12      level 12 (0 is the first level in the file, the model top for CAM)
+#   NAME:500hPa  the level whose lev coordinate is nearest 500
+#   NAME:col     pressure-weighted column mean, with the layer
+#                thicknesses from hyai, hybi, P0 and PS of each file
+#   NAME:0-25    levels 0 to 25, one column each (expanded to NAME:0 ...)
+# The series column of NAME:SPEC is NAME_SPEC. Levels are read in
+# blocks of at most LEVEL_BLOCK_BYTES, and each block is reduced with
+# one matrix-vector product over its levels, so a file never holds
+# more of a 3D variable than one block.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+LEVEL_BLOCK_BYTES = 64 * 2**20
+
+_LEVEL_SPEC = re.compile(r'^(?:(\d+)|(\d+(?:\.\d+)?)hPa|(col)|(\d+)-(\d+))$')
+
+
+def split_level(readname):
+    """
+    (vname, spec) of a read name: spec is None for a 2D variable, else
+    ('index', k), ('hPa', p) or ('col',). Raises ValueError for a bad spec.
+    """
+    vname, sep, spec = readname.partition(':')
+    if not sep:
+        return vname, None
+    m = _LEVEL_SPEC.match(spec)
+    if not vname or m is None or m.group(4) is not None:
+        raise ValueError(f"bad 3D variable '{readname}'; use NAME:12, NAME:500hPa, NAME:col or NAME:0-25")
+    if m.group(1) is not None:
+        return vname, ('index', int(m.group(1)))
+    if m.group(2) is not None:
+        return vname, ('hPa', float(m.group(2)))
+    return vname, ('col',)
+
+
+def expand_level_tokens(tokens):
+    """
+    Read names of vars.in read tokens: level ranges NAME:k0-k1 become
+    NAME:k0 ... NAME:k1, everything else is checked and kept. Raises
+    ValueError for a malformed NAME:SPEC.
+    """
+    names = []
+    for token in tokens:
+        vname, _, spec = token.partition(':')
+        m = _LEVEL_SPEC.match(spec)
+        if m is not None and m.group(4) is not None:
+            k0, k1 = int(m.group(4)), int(m.group(5))
+            if vname and k0 <= k1:
+                names.extend(f"{vname}:{k}" for k in range(k0, k1 + 1))
+                continue
+            raise ValueError(f"bad level range '{token}'")
+        split_level(token)
+        names.append(token)
+    return names
+
+
+def column_name(readname):
+    """Series column of a read name: NAME:SPEC becomes NAME_SPEC."""
+    return readname.replace(':', '_')
+
+
+def _level_blocks(levels, per_block):
+    """Split sorted level indices into (k0, k1) reads of at most per_block levels."""
+    blocks = []
+    for k in levels:
+        if blocks and k - blocks[-1][0] < per_block:
+            blocks[-1][1] = k + 1
+        else:
+            blocks.append([k, k + 1])
+    return blocks
+
+
+def _column_mean(f, vname, nlev, per_block):
+    """
+    Pressure-weighted column mean of one record of vname: the sum of the
+    levels times their hybrid layer thickness dp = dA*P0 + dB*PS over the
+    sum of dp, accumulated block by block. A cell is invalid if PS or any
+    level is. Returns (data, invalid) as trend_io's field().
+    """
+    hyai = np.asarray(f.array('hyai'), dtype=float)
+    hybi = np.asarray(f.array('hybi'), dtype=float)
+    p0   = float(f.array('P0')) if 'P0' in f.variables else 1.0e5
+    if hyai.shape != (nlev + 1,) or hybi.shape != (nlev + 1,):
+        raise ValueError(f"hyai/hybi do not have {nlev + 1} interfaces for {vname}")
+    ps, ps_invalid = f.field('PS', 0)
+    ps  = np.asarray(ps, dtype=float)
+    num = np.zeros(ps.shape)
+    den = np.zeros(ps.shape)
+    invalid = np.zeros(ps.shape, dtype=bool) if ps_invalid is None else ps_invalid.copy()
+    for k0 in range(0, nlev, per_block):
+        k1 = min(k0 + per_block, nlev)
+        data, bad = f.levels(vname, k0, k1)
+        dp = (np.diff(hyai[k0:k1 + 1])[:, None, None] * p0
+              + np.diff(hybi[k0:k1 + 1])[:, None, None] * ps)
+        data = np.asarray(data, dtype=float)
+        if bad is not None:
+            invalid |= bad.any(axis=0)
+            data = np.where(bad, 0.0, data)
+        num += np.einsum('kij,kij->ij', data, dp)
+        den += dp.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data = num / den
+    invalid |= ~(den > 0.0)
+    return data, (invalid if invalid.any() else None)
+
+
+def _load_levels(f, vname, columns, weights, stats):
+    """
+    The NAME:SPEC columns of one 3D variable of an open file.
+
+    columns is a list of (j, readname, spec). Columns that pick levels
+    are read in blocks of levels; with weights, each block is reduced
+    here (dense levels together by global_means_batch, masked ones by
+    _masked_mean), without weights the levels are returned as (lat, lon)
+    fields. Column means are returned as fields.
+
+    Returns (fields, absent): entries (j, data, invalid) as in _load_file,
+    data a field or an already reduced float, and the read names that
+    cannot be formed from this file (variable not 3D, level out of range,
+    no lev coordinate or hybrid coefficients).
+    """
+    fields = []
+    absent = []
+    if vname not in f.variables or f.variables[vname].ndim != 4:
+        return fields, [name for _, name, _ in columns]
+    var  = f.variables[vname]
+    nlev = var.shape[1]
+    plane_bytes = int(np.prod(var.shape[2:])) * max(var.dtype.itemsize, 8)
+    per_block   = max(1, LEVEL_BLOCK_BYTES // plane_bytes)
+
+    levels = {}
+    for j, name, spec in columns:
+        t0 = time.perf_counter()
+        if spec[0] == 'col':
+            if not all(v in f.variables for v in ('hyai', 'hybi', 'PS')):
+                absent.append(name)
+                continue
+            data, invalid = _column_mean(f, vname, nlev, per_block)
+            stats['vars'][name] = {'read': time.perf_counter() - t0, 'reduce': 0.0,
+                                   'bytes': nlev * plane_bytes}
+            fields.append((j, data, invalid))
+            continue
+        if spec[0] == 'hPa':
+            if 'lev' not in f.variables:
+                absent.append(name)
+                continue
+            k = int(np.argmin(np.abs(np.asarray(f.array('lev'), dtype=float) - spec[1])))
+        else:
+            k = spec[1]
+        if not 0 <= k < nlev:
+            absent.append(name)
+            continue
+        levels.setdefault(k, []).append((j, name))
+
+    for k0, k1 in _level_blocks(sorted(levels), per_block):
+        t0 = time.perf_counter()
+        data, invalid = f.levels(vname, k0, k1)
+        t1 = time.perf_counter()
+        picked = [(k, j, name) for k in range(k0, k1) for j, name in levels.get(k, [])]
+        for k, j, name in picked:
+            stats['vars'][name] = {'read': (t1 - t0) / len(picked), 'reduce': 0.0,
+                                   'bytes': plane_bytes}
+        if weights is None:
+            for k, j, name in picked:
+                bad = None if invalid is None or not invalid[k - k0].any() else invalid[k - k0]
+                fields.append((j, data[k - k0], bad))
+            continue
+        dense  = []
+        masked = []
+        for item in picked:
+            (dense if invalid is None or not invalid[item[0] - k0].any() else masked).append(item)
+        if dense:
+            means = global_means_batch(data[[k - k0 for k, _, _ in dense]], weights)
+            fields.extend((j, float(m), None) for (_, j, _), m in zip(dense, means))
+        for k, j, name in masked:
+            fields.append((j, _masked_mean(name, data[k - k0], invalid[k - k0], weights), None))
+        share = (time.perf_counter() - t1) / len(picked)
+        for k, j, name in picked:
+            stats['vars'][name]['reduce'] = share
+    return fields, absent
+
+
+def _missing_warning(filepath, vname):
+    """Warning for a variable (or 3D read name) that a file does not provide."""
+    if ':' in vname:
+        return (f"  WARNING: '{vname}' cannot be read from {os.path.basename(filepath)} (needs a (time, lev, lat, lon) "
+                f"variable with that level, lev for hPa, hyai/hybi/PS for col), storing NaN")
+    return f"  WARNING: variable '{vname}' not found in {os.path.basename(filepath)}, storing NaN"
+
+
+def _load_file(filepath, varnames, weights=None):
+    """
+    Reading half of _reduce_file: open one monthly file with the selected
+    I/O backend (see trend_io), read the first record of each requested
+    variable into memory and close it. Each backend flags the cells
+    matching a fill value; memory-mapped netCDF3 fields are views of the
+    mapped file. 3D read names (NAME:SPEC) are read level block by level
+    block (see _load_levels); with weights their level means are reduced
+    here. Never raises.
+
+    Returns (fields, missing, error, stats):
+        fields  -- list of (j, data, invalid): column j in varnames, the
+                   field and a boolean mask of invalid cells (None when
+                   every cell is valid), or the global mean as a float
+                   for 3D levels reduced here
+        missing -- list of variable names not present in the file
+        error   -- None, or a message describing why the file failed
+        stats   -- profiling record (see new_file_stats), not yet totalled
+    """
+    fields  = []
+    missing = []
+    stats   = new_file_stats(filepath)
+    plain   = []
+    levels  = {}
+    for j, name in enumerate(varnames):
+        vname, spec = split_level(name)
+        if spec is None:
+            plain.append((j, name))
+        else:
+            levels.setdefault(vname, []).append((j, name, spec))
+    t0 = time.perf_counter()
+    try:
+        f = trend_io.open_file(filepath, [name for _, name in plain] + list(levels))
+    except Exception as e:
+        stats['open'] = time.perf_counter() - t0
+        return fields, missing, f"{type(e).__name__}: {e}", stats
+    stats['open'] = time.perf_counter() - t0
+    error = None
+    try:
+        missing = [vname for _, vname in plain if vname not in f.variables]
+        for j, vname in plain:
+            if vname not in f.variables:
+                continue
+            t0  = time.perf_counter()
+            var = f.variables[vname]
+            data, invalid = f.field(vname, 0)
+            stats['vars'][vname] = {'read': time.perf_counter() - t0, 'reduce': 0.0,
+                                    'bytes': int(np.prod(var.shape[1:])) * var.dtype.itemsize}
+            fields.append((j, data, invalid))
+        for vname, columns in levels.items():
+            level_fields, absent = _load_levels(f, vname, columns, weights, stats)
+            fields.extend(level_fields)
+            missing.extend(absent)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    t0 = time.perf_counter()
+    f.close()
+    stats['open'] += time.perf_counter() - t0
+    return fields, missing, error, stats
+
+
+def _reduce_fields(fields, varnames, weights, stats):
+    """
+    Reduction half of _reduce_file: global means of the fields read by
+    _load_file. Fields with no invalid cells are stacked and reduced
+    together by global_means_batch; the others go through _masked_mean,
+    which reuses the validity mask and weights cached for the variable.
+    Returns the row of len(varnames) means (NaN for fields not read).
+    """
+    row = np.full(len(varnames), np.nan)
+    dense_cols = []
+    dense_data = []
+    for j, data, invalid in fields:
+        if np.ndim(data) == 0:
+            # 3D level mean, reduced by _load_levels
+            row[j] = data
+        elif invalid is None:
+            dense_cols.append(j)
+            dense_data.append(data)
+        else:
+            t1 = time.perf_counter()
+            row[j] = _masked_mean(varnames[j], data, invalid, weights)
+            stats['vars'][varnames[j]]['reduce'] = time.perf_counter() - t1
+    if dense_cols:
+        # batched reduction time is shared equally by the stacked fields;
+        # the stack is filled in float64 directly from the fields (views of
+        # the mapped file for netCDF3), so each field is copied only once
+        t1 = time.perf_counter()
+        stack = np.empty((len(dense_data),) + dense_data[0].shape, dtype=float)
+        for k, data in enumerate(dense_data):
+            stack[k] = data
+        row[dense_cols] = global_means_batch(stack, weights)
+        share = (time.perf_counter() - t1) / len(dense_cols)
+        for j in dense_cols:
+            stats['vars'][varnames[j]]['reduce'] = share
+    return row
+
+
+def _reduce_file(filepath, varnames, weights):
+    """
+    Open one monthly file and compute the global mean of each variable
+    (_load_file followed by _reduce_fields).
+
+    Never raises: a file that cannot be opened or read yields a row of
+    NaN and an error string, so one bad file cannot kill a worker pool.
+
+    Returns (row, missing, error, stats):
+        row     -- numpy array, shape (len(varnames),), global means
+        missing -- list of variable names not present in the file
+        error   -- None, or a message describing why the file failed
+        stats   -- profiling record (see new_file_stats)
+    """
+    fields, missing, error, stats = _load_file(filepath, varnames, weights)
+    return _finish_reduce(fields, missing, error, stats, varnames, weights)
+
+
+def _finish_reduce(fields, missing, error, stats, varnames, weights):
+    """_reduce_file's result from the output of _load_file."""
+    row = np.full(len(varnames), np.nan)
+    if error is None:
+        try:
+            row = _reduce_fields(fields, varnames, weights, stats)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return row, missing, error, _total_stats(stats)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Prefetch
+#
+# netCDF4 releases the GIL while it waits on the file system and
+# decompresses, and numpy releases it in the weighted reductions, so
+# one background thread reading the next files overlaps I/O with the
+# reduction of the current file without any worker processes. The
+# netCDF-C and HDF5 libraries are not thread-safe, so every prefetch
+# reader holds _netcdf_lock while it has a file open; several streams
+# (atm, ice, land) prefetching at once take turns on the file system.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+_netcdf_lock = threading.Lock()
+
+
+def new_prefetch_stats(depth):
+    """Empty stall record for iter_monthly_means(prefetch=depth, stalls=...)."""
+    return {'depth': depth, 'files': 0, 'read': 0.0, 'reduce': 0.0,
+            'reduce_wait': 0.0, 'read_wait': 0.0}
+
+
+def _prefetched(todo_files, todo_vars, weights, depth, stalls):
+    """
+    _reduce_file results for todo_files in order, with a background
+    thread reading up to `depth` files ahead into a bounded queue while
+    this thread reduces. stalls (from new_prefetch_stats) accumulates the
+    time spent reading and reducing, the time the reducer waited for a
+    file to arrive (I/O bound) and the time the reader waited for room
+    in the queue (reduction bound).
+    """
+    q    = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _reader():
+        for filepath, names in zip(todo_files, todo_vars):
+            with _netcdf_lock:
+                t0   = time.perf_counter()
+                item = _load_file(filepath, names, weights)
+                t1   = time.perf_counter()
+            stalls['read'] += t1 - t0
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            stalls['read_wait'] += time.perf_counter() - t1
+            if stop.is_set():
+                return
+
+    thread = threading.Thread(target=_reader, name='trend-prefetch', daemon=True)
+    thread.start()
+    try:
+        for names in todo_vars:
+            t0 = time.perf_counter()
+            fields, missing, error, stats = q.get()
+            t1 = time.perf_counter()
+            result = _finish_reduce(fields, missing, error, stats, names, weights)
+            stalls['reduce_wait'] += t1 - t0
+            stalls['reduce']      += time.perf_counter() - t1
+            stalls['files']       += 1
+            yield result
+    finally:
+        stop.set()
+        thread.join()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Profiling records
+#
+# Every file read produces one record: open (open + close), read
+# (read/decompress) and reduce times in seconds, bytes of field data
+# decoded, and the same split per variable. Records are collected by
+# passing a list as `profile` to the readers and are summarized by
+# summarize_profile.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def new_file_stats(filepath, component=None):
+    """Empty profiling record for one file."""
+    return {'file': filepath, 'component': component,
+            'open': 0.0, 'read': 0.0, 'reduce': 0.0, 'bytes': 0, 'vars': {}}
+
+
+def _close_stats(stats, ncid):
+    """Close ncid, charging the close to open time, and total the per-variable times."""
+    t0 = time.perf_counter()
+    ncid.close()
+    stats['open'] += time.perf_counter() - t0
+    return _total_stats(stats)
+
+
+def _total_stats(stats):
+    """Add the per-variable read and reduce times and bytes to the file totals."""
+    for vstats in stats['vars'].values():
+        stats['read']   += vstats['read']
+        stats['reduce'] += vstats['reduce']
+        stats['bytes']  += vstats['bytes']
+    return stats
+
+
+def summarize_profile(records, wall=None, slowest=10):
+    """
+    Summarize profiling records by component and variable.
+
+    wall optionally maps component -> wall-clock read time, used for the
+    files-per-second and MB/s rates (worker time is used otherwise).
+    Returns a dict with 'components', 'variables' and the `slowest`
+    files by open + read + reduce time.
+    """
+    wall = wall or {}
+    components = {}
+    variables  = {}
+    for r in records:
+        comp = r['component']
+        c = components.setdefault(comp, {'files': 0, 'open': 0.0, 'read': 0.0,
+                                         'reduce': 0.0, 'bytes': 0})
+        c['files'] += 1
+        for k in ('open', 'read', 'reduce', 'bytes'):
+            c[k] += r[k]
+        for vname, v in r['vars'].items():
+            vs = variables.setdefault(comp, {}).setdefault(
+                vname, {'files': 0, 'read': 0.0, 'reduce': 0.0, 'bytes': 0})
+            vs['files'] += 1
+            for k in ('read', 'reduce', 'bytes'):
+                vs[k] += v[k]
+    for comp, c in components.items():
+        elapsed = wall.get(comp) or (c['open'] + c['read'] + c['reduce'])
+        c['wall'] = elapsed
+        c['files_per_s'] = c['files'] / elapsed if elapsed > 0 else float('nan')
+        c['mb_per_s']    = c['bytes'] / 1.0e6 / elapsed if elapsed > 0 else float('nan')
+
+    def _total(r):
+        return r['open'] + r['read'] + r['reduce']
+    worst = sorted(records, key=_total, reverse=True)[:slowest]
+    worst = [{k: r[k] for k in ('file', 'component', 'open', 'read', 'reduce', 'bytes')}
+             for r in worst]
+    return {'components': components, 'variables': variables, 'slowest': worst}
+
+
+def make_read_pool(weights, jobs):
+    """
+    Process pool for read_monthly_files(pool=...). One pool can be shared
+    by several concurrent reads (e.g. atm, ice and land), so `jobs` caps
+    the total number of worker processes and of files open at once.
+    weights may be a dict keyed by component prefix when the components
+    use different grids, or by any key passed as iter_monthly_means(pool_key=...)
+    (trend_batch.py keys them by grid fingerprint).
+    Workers use the I/O backends selected in this process when the pool
+    is created (see trend_io.prepare).
+    """
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                               initargs=(weights, trend_io.get_state()))
+
+
+def _reduce_file_worker(filepath, varnames, key=None):
+    """Worker-side entry point; uses the weights set by _init_worker."""
+    weights = _worker_weights.get(key, _worker_weights.get(None))
+    return _reduce_file(filepath, varnames, weights)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Persistent global-mean cache
+#
+# One JSON file mapping "<grid hash>|<file path>" to the file's size,
+# mtime and the global mean of every variable read from it so far.
+# An entry whose size or mtime no longer matches the file on disk is
+# discarded, so rewritten history files are always re-read.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+CACHE_VERSION = 1
+
+
+def weights_fingerprint(weights):
+    """Short hash of the area-weight array (shape and values)."""
+    h = hashlib.sha1()
+    h.update(str(np.shape(weights)).encode())
+    h.update(np.ascontiguousarray(weights, dtype=float).tobytes())
+    return h.hexdigest()[:16]
+
+
+def load_cache(path):
+    """
+    Load the global-mean cache from path.
+    Returns an empty cache if the file is missing, unreadable, or was
+    written by a different CACHE_VERSION.
+    """
+    empty = {'version': CACHE_VERSION, 'entries': {}}
+    if path is None or not os.path.isfile(path):
+        return empty
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"  WARNING: ignoring unreadable cache {path} ({e})")
+        return empty
+    if cache.get('version') != CACHE_VERSION or 'entries' not in cache:
+        return empty
+    return cache
+
+
+def save_cache(cache, path, max_entries=None):
+    """
+    Write the cache to path, keeping at most max_entries files.
+    The least recently used entries are evicted first. The file is
+    written to a temporary name and renamed so a crash never leaves a
+    truncated cache behind.
+    """
+    entries = cache['entries']
+    if max_entries is not None and len(entries) > max_entries:
+        keep = sorted(entries, key=lambda k: entries[k]['used'], reverse=True)[:max_entries]
+        cache['entries'] = {k: entries[k] for k in keep}
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def clear_cache(path):
+    """Delete the cache file at path, if it exists."""
+    if os.path.isfile(path):
+        os.remove(path)
+        print(f"  cache cleared: {path}")
+
+
+def read_file_means(filepath, prefix, varnames, weights, failed=None):
+    """
+    Read one monthly file and return its global means as a 1D array of
+    length len(varnames). Missing variables and unreadable files are
+    reported the same way as in read_monthly_files and stored as NaN.
+    If failed (a list) is given, an unreadable file is appended to it as
+    (filepath, error) instead of being reported, so the caller can retry.
+    """
+    row, missing, error, stats = _reduce_file(filepath, varnames, weights)
+    if error is not None:
+        if failed is not None:
+            failed.append((filepath, error))
+            return row
+        print(f"  ERROR: could not read {os.path.basename(filepath)} ({error}), storing NaN")
+    for vname in missing:
+        key = (prefix, vname)
+        if key not in _warned_missing:
+            print(_missing_warning(filepath, vname))
+            _warned_missing.add(key)
+    return row
+
+
+def index_monthly_files(root_path, case_id, prefix):
+    """
+    Build a date index of the monthly history files in root_path from a
+    single os.scandir pass (no per-file stat calls).
+
+    Only names of the form <case_id><prefix>YYYY-MM.nc are indexed.
+    Returns a dict mapping (year, month) -> file path.
+    """
+    pattern = re.compile(r'^' + re.escape(case_id + prefix) + r'(\d{4})-(\d{2})\.nc$')
+    index = {}
+    try:
+        with os.scandir(root_path) as it:
+            for entry in it:
+                m = pattern.match(entry.name)
+                if m:
+                    index[(int(m.group(1)), int(m.group(2)))] = os.path.join(root_path, entry.name)
+    except FileNotFoundError:
+        print(f"  WARNING: directory not found: {root_path}")
+    return index
+
+
+def consecutive_months(index, start_year, n_months):
+    """
+    Return the file paths for up to n_months consecutive months starting
+    at start_year-01, stopping at the first month missing from index.
+    """
+    files = []
+    for it in range(n_months):
+        key = (start_year + it // 12, it % 12 + 1)
+        if key not in index:
+            break
+        files.append(index[key])
+    return files
+
+
+def iter_monthly_means(files, prefix, varnames, weights, jobs=1, cache=None,
+                       pool=None, profile=None, failed=None, pool_key=None,
+                       prefetch=0, stalls=None):
+    """
+    Generator over the global means of a list of monthly files, in file
+    order: yields (i, row) with row a 1D array of len(varnames).
+
+    This is the ingestion stage shared by read_monthly_files and the
+    streaming pipeline in trend.py. Rows are produced as soon as each
+    file has been reduced, so a consumer can act on month i before the
+    later files are read. With a pool, at most 4*jobs files are queued
+    ahead of the consumer, so several generators sharing one pool
+    advance together and memory does not grow with the number of files.
+
+    jobs, pool, cache and profile behave as in read_monthly_files. The
+    pool's weights are looked up under pool_key, or under prefix if it is
+    None (see make_read_pool). Unreadable files are reported by name and appended to `failed` (a
+    list) if given.
+
+    Without a pool, prefetch > 0 reads up to that many files ahead in a
+    background thread while this one reduces (see _prefetched); stalls,
+    a dict from new_prefetch_stats, then collects the read, reduce and
+    waiting times. prefetch is ignored when files go to worker processes.
+    """
+    def _warn_missing(filepath, vname):
+        key = (prefix, vname)
+        if key not in _warned_missing:
+            print(_missing_warning(filepath, vname))
+            _warned_missing.add(key)
+
+    # Split each file's variables into cached values and those still to read
+    entries = [None] * len(files)
+    todo    = []
+    if cache is not None:
+        grid = weights_fingerprint(weights)
+        now  = time.time()
+        hits = 0
+        for i, filepath in enumerate(files):
+            st    = os.stat(filepath)
+            key   = f"{grid}|{os.path.abspath(filepath)}"
+            entry = cache['entries'].get(key)
+            if entry is None or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+                entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'values': {}}
+                cache['entries'][key] = entry
+            entry['used'] = now
+            entries[i] = entry
+            cols = [j for j, vname in enumerate(varnames) if vname not in entry['values']]
+            hits += len(varnames) - len(cols)
+            if cols:
+                todo.append((i, cols))
+        print(f"  cache: {hits} of {len(files) * len(varnames)} values reused, "
+              f"{len(todo)} files to read")
+    else:
+        todo = [(i, list(range(len(varnames)))) for i in range(len(files))]
+
+    todo_files = [files[i] for i, _ in todo]
+    todo_vars  = [[varnames[j] for j in cols] for _, cols in todo]
+    if todo:
+        trend_io.prepare(todo_files[0], todo_vars[0])
+
+    def _ordered(executor, ahead, key):
+        """Results in todo order, with at most `ahead` files in flight."""
+        tasks   = iter(zip(todo_files, todo_vars))
+        futures = deque()
+        for filepath, names in tasks:
+            futures.append(executor.submit(_reduce_file_worker, filepath, names, key))
+            if len(futures) >= ahead:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def _results():
+        """Reduction results for the todo files, in todo order."""
+        if pool is not None:
+            yield from _ordered(pool, 4 * max(jobs or 1, 1), prefix if pool_key is None else pool_key)
+        elif jobs is None or jobs <= 1 or len(todo) < 2:
+            if prefetch and prefetch > 0 and todo:
+                yield from _prefetched(todo_files, todo_vars, weights, prefetch,
+                                       new_prefetch_stats(prefetch) if stalls is None else stalls)
+                return
+            for filepath, names in zip(todo_files, todo_vars):
+                yield _reduce_file(filepath, names, weights)
+        else:
+            nworkers = min(jobs, len(todo))
+            with make_read_pool(weights, nworkers) as own_pool:
+                yield from _ordered(own_pool, 4 * nworkers, None)
+
+    results = _results()
+    pending = iter(todo)
+    nxt     = next(pending, None)
+    for i, filepath in enumerate(files):
+        row   = np.full(len(varnames), np.nan)
+        entry = entries[i]
+        if entry is not None:
+            for j, vname in enumerate(varnames):
+                if vname in entry['values']:
+                    value = entry['values'][vname]
+                    if value is None:
+                        _warn_missing(filepath, vname)
+                    else:
+                        row[j] = value
+        if nxt is not None and nxt[0] == i:
+            cols = nxt[1]
+            part, missing, error, stats = next(results)
+            row[cols] = part
+            if profile is not None:
+                stats['component'] = prefix.strip('.')
+                profile.append(stats)
+            if error is not None:
+                if failed is not None:
+                    failed.append((filepath, error))
+                print(f"  ERROR: could not read {os.path.basename(filepath)} ({error}), storing NaN")
+            for vname in missing:
+                _warn_missing(filepath, vname)
+            if entry is not None and error is None:
+                for j, value in zip(cols, part):
+                    vname = varnames[j]
+                    entry['values'][vname] = None if vname in missing else float(value)
+            nxt = next(pending, None)
+        yield i, row
+
+
 def read_monthly_files(root_path, case_id, prefix, varnames,
-                       start_year, n_months, weights):
+                       start_year, n_months, weights, jobs=1, cache=None,
+                       index=None, pool=None, profile=None, prefetch=0, stalls=None):
     """
-    Read monthly netCDF files sequentially and compute area-weighted global
-    means for each variable at each timestep.
+    Read monthly netCDF files and compute area-weighted global means
+    for each variable at each timestep.
+
+    Files are looked up by (year, month) in index, the date index from
+    index_monthly_files (built here if not given), starting at
+    start_year-01 for n_months, so the result aligns with the file scan
+    in trend.py that determined N_actual. The files are reduced by
+    iter_monthly_means and collected into one array.
 
-    Files are matched by glob and filtered to YYYY-MM date stamps, then
-    sliced to start_year and n_months so the result aligns with the file
-    scan in trend.py that determined N_actual.
+    With jobs > 1 the files are spread over a process pool. Each worker
+    returns the row for one file and rows are stored by file index, so
+    the output is identical to the serial path. A file that cannot be
+    read is reported by name and its row is left as NaN. If pool is
+    given (from make_read_pool) it is used instead of a private pool;
+    its weights for `prefix` (or its default weights) must match `weights`.
+
+    If cache is a dict from load_cache, values already stored for the
+    same file (path, size, mtime) and grid are used directly, and only
+    files or variables not yet in the cache are opened. New values are
+    added to the cache in place; the caller is responsible for saving it.
+
+    If profile is a list, one profiling record per file opened is
+    appended to it (see summarize_profile).
+
+    prefetch and stalls overlap the reads with the reductions in a
+    single process, as in iter_monthly_means.
 
     Returns:
         out   -- numpy array, shape (n_months, len(varnames)), global means
         files -- list of file paths that were actually read
 
     Assumptions to verify against actual model output:
-      - All years from 1 to start_year-1 have exactly 12 monthly files each,
-        so start_idx = (start_year - 1) * 12 correctly skips pre-start-year files.
       - Variables are stored as (time, lat, lon); var[0, :, :] is the single
         monthly snapshot in each file.
       - weights shape (nlat, nlon) matches the spatial dims of each variable.
     """
-    date_pattern = re.compile(r'\.\d{4}-\d{2}\.nc$')
-    all_files = sorted(glob.glob(f"{root_path}/{case_id}{prefix}*.nc"))
-    all_files = [f for f in all_files if date_pattern.search(f)]
-
-    start_idx = (start_year - 1) * 12
-    files = all_files[start_idx:start_idx + n_months]
-
-    out = np.zeros((len(files), len(varnames)), dtype=float)
-
-    for i, filepath in tqdm(enumerate(files), total=len(files), 
-                        desc="reading files", unit="file"):
-    #for i, filepath in enumerate(files):
-        ncid = nc.Dataset(filepath, 'r')
-        for j, vname in enumerate(varnames):
-            if vname in ncid.variables:
-                raw = ncid.variables[vname][0, :, :]
-                masked = np.ma.masked_equal(raw, -999.0)
-                out[i, j] = global_mean_2d(masked, weights)
-            else:
-                key = (prefix, vname)
-                if key not in _warned_missing:
-                    print(f"  WARNING: variable '{vname}' not found in {os.path.basename(filepath)}, storing NaN")
-                    _warned_missing.add(key)
-                out[i, j] = np.nan
-        ncid.close()
+    if index is None:
+        index = index_monthly_files(root_path, case_id, prefix)
+    files = consecutive_months(index, start_year, n_months)
+
+    out    = np.zeros((len(files), len(varnames)), dtype=float)
+    failed = []
+
+    if pool is not None:
+        desc = f"reading files ({prefix.strip('.')})"
+    elif jobs is not None and jobs > 1:
+        desc = f"reading files ({min(jobs, max(len(files), 1))} jobs)"
+    else:
+        desc = "reading files"
+
+    rows = iter_monthly_means(files, prefix, varnames, weights, jobs=jobs, cache=cache,
+                              pool=pool, profile=profile, failed=failed,
+                              prefetch=prefetch, stalls=stalls)
+    for i, row in tqdm(rows, total=len(files), desc=desc, unit="file"):
+        out[i, :] = row
+
+    if failed:
+        print(f"  {len(failed)} of {len(files)} files could not be read")
+
+    return out, files
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# CESM single-variable timeseries files
+#
+# Post-processed output holds every month of one variable in a file
+# named <case_id><prefix><VAR>.YYYYMM-YYYYMM.nc, e.g.
+# case.cam.h0.TS.000101-050012.nc. Each file is assumed to hold one
+# record per month from the first to the last stamp, in order.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def index_timeseries_files(root_path, case_id, prefix):
+    """
+    Build an index of timeseries files in root_path from a single
+    os.scandir pass.
+
+    Returns a dict mapping variable name -> list of
+    (first (year, month), last (year, month), path) tuples sorted by date.
+    """
+    pattern = re.compile(r'^' + re.escape(case_id + prefix)
+                         + r'(\w+)\.(\d{4})(\d{2})-(\d{4})(\d{2})\.nc$')
+    index = {}
+    try:
+        with os.scandir(root_path) as it:
+            for entry in it:
+                m = pattern.match(entry.name)
+                if m:
+                    first = (int(m.group(2)), int(m.group(3)))
+                    last  = (int(m.group(4)), int(m.group(5)))
+                    index.setdefault(m.group(1), []).append(
+                        (first, last, os.path.join(root_path, entry.name)))
+    except FileNotFoundError:
+        print(f"  WARNING: directory not found: {root_path}")
+    for segments in index.values():
+        segments.sort()
+    return index
+
+
+def _month_number(ym):
+    """Months since year 0 for a (year, month) tuple."""
+    return ym[0] * 12 + ym[1] - 1
+
+
+def timeseries_coverage(ts_index, varnames):
+    """
+    Set of (year, month) covered by a timeseries file for every one of
+    varnames. Used by the file scan in place of a monthly-file index.
+    """
+    covered = None
+    for vname in varnames:
+        months = set()
+        for first, last, _ in ts_index.get(vname, []):
+            for n in range(_month_number(first), _month_number(last) + 1):
+                months.add((n // 12, n % 12 + 1))
+        covered = months if covered is None else (covered & months)
+    return covered if covered is not None else set()
+
+
+def read_timeseries_files(root_path, case_id, prefix, varnames,
+                          start_year, n_months, weights, index=None,
+                          chunk=240, profile=None):
+    """
+    Read CESM single-variable timeseries files and compute area-weighted
+    global means for each variable at each month.
+
+    For each variable the time axis of every overlapping file is read in
+    blocks of `chunk` months and each (time, lat, lon) block is reduced
+    in one call to global_means_batch, so a variable costs one file open
+    per segment rather than one per month.
+
+    Returns the same (out, files) pair as read_monthly_files, with rows
+    for the n_months months starting at start_year-01. If profile is a
+    list, one profiling record per file segment is appended to it.
+    """
+    if index is None:
+        index = index_timeseries_files(root_path, case_id, prefix)
+    for vname in varnames:
+        if index.get(vname):
+            trend_io.prepare(index[vname][0][2], [vname])
+            break
+
+    first_month = _month_number((start_year, 1))
+    last_month  = first_month + n_months          # exclusive
+
+    out   = np.full((n_months, len(varnames)), np.nan)
+    files = []
+
+    for j, vname in enumerate(tqdm(varnames, desc="reading timeseries", unit="var")):
+        segments = index.get(vname, [])
+        if not segments:
+            key = (prefix, vname)
+            if key not in _warned_missing:
+                print(f"  WARNING: no timeseries file found for variable '{vname}', storing NaN")
+                _warned_missing.add(key)
+            continue
+        for first, last, filepath in segments:
+            f0 = _month_number(first)
+            lo = max(f0, first_month)
+            hi = min(_month_number(last) + 1, last_month)
+            if lo >= hi:
+                continue
+            stats  = new_file_stats(filepath, prefix.strip('.'))
+            vstats = {'read': 0.0, 'reduce': 0.0, 'bytes': 0}
+            stats['vars'][vname] = vstats
+            p0 = time.perf_counter()
+            try:
+                ncid = trend_io.open_file(filepath, [vname])
+            except Exception as e:
+                print(f"  ERROR: could not read {os.path.basename(filepath)} ({type(e).__name__}: {e}), storing NaN")
+                continue
+            stats['open'] = time.perf_counter() - p0
+            try:
+                var = ncid.variables[vname]
+                for t0 in range(lo, hi, chunk):
+                    t1    = min(t0 + chunk, hi)
+                    p0    = time.perf_counter()
+                    block, mask = ncid.block(vname, t0 - f0, t1 - f0)
+                    p1    = time.perf_counter()
+                    out[t0 - first_month:t1 - first_month, j] = global_means_batch(block, weights, mask)
+                    vstats['read']   += p1 - p0
+                    vstats['reduce'] += time.perf_counter() - p1
+                    vstats['bytes']  += block.size * var.dtype.itemsize
+            except Exception as e:
+                print(f"  ERROR: could not read {vname} from {os.path.basename(filepath)} ({type(e).__name__}: {e}), storing NaN")
+            _close_stats(stats, ncid)
+            if profile is not None:
+                profile.append(stats)
+            files.append(filepath)
 
     return out, files
 
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Derived variables
+#
+# Definitions such as "etop = FSNT - FLNT" from vars.in are parsed
+# once, checked against the component's columns and compiled to a
+# code object that indexes the global-mean array by column number,
+# so evaluating them is a single numpy expression over one month's
+# row or the whole (N, ncols) matrix.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# functions allowed in expressions
+DERIVED_FUNCTIONS = {'abs': np.abs, 'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log,
+                     'log10': np.log10, 'minimum': np.minimum, 'maximum': np.maximum}
+
+# the vars.in "energy" token: TOA and surface energy balance of the atmosphere
+ENERGY_DEFINITIONS = [('energy_top', 'FSNT - FLNT'),
+                      ('energy_bot', 'FSNS - FLNS - LHFLX - SHFLX')]
+
+_DERIVED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant,
+                  ast.Load, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+
+
+def expression_names(expr):
+    """Variable names used in a derived-variable expression."""
+    try:
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"invalid expression '{expr}': {e.msg}")
+    called = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    names  = []
+    for node in ast.walk(tree):
+        if not isinstance(node, _DERIVED_NODES):
+            raise ValueError(f"'{type(node).__name__}' not allowed in expression '{expr}'")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name)
+                                               and node.func.id in DERIVED_FUNCTIONS):
+            raise ValueError(f"unknown function in expression '{expr}'")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"only numeric constants are allowed in expression '{expr}'")
+        if isinstance(node, ast.Name) and id(node) not in called and node.id not in names:
+            names.append(node.id)
+    return names
+
+
+class _ColumnRefs(ast.NodeTransformer):
+    """Rewrites variable names as _v[..., column]."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def visit_Call(self, node):
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node):
+        index = ast.Tuple(elts=[ast.Constant(Ellipsis), ast.Constant(self.columns[node.id])],
+                          ctx=ast.Load())
+        return ast.Subscript(value=ast.Name(id='_v', ctx=ast.Load()), slice=index, ctx=ast.Load())
+
+
+class DerivedColumns:
+    """
+    Compiled derived-variable definitions of one component.
+
+    definitions is a list of (name, expression) pairs; an expression may
+    use the base columns and any derived name defined before it. The
+    derived columns follow the base columns, in definition order, so
+    `columns` is the full column list of the component's series. Base
+    columns given as 3D read names (NAME:SPEC) are named NAME_SPEC.
+
+    Usage:
+        derived = DerivedColumns(['FSNT', 'FLNT'], [('etop', 'FSNT - FLNT')])
+        row = np.zeros(len(derived.columns)); row[:2] = means
+        derived.apply(row)              # or an (N, ncols) matrix
+    """
+
+    def __init__(self, base_columns, definitions):
+        self.nbase   = len(base_columns)
+        self.columns = [column_name(c) for c in base_columns]
+        self._code   = []
+        for name, expr in definitions:
+            if not name.isidentifier():
+                raise ValueError(f"invalid derived variable name '{name}'")
+            if name in self.columns:
+                raise ValueError(f"derived variable '{name}' is already a column")
+            index = {c: j for j, c in enumerate(self.columns)}
+            for vname in expression_names(expr):
+                if vname not in index:
+                    raise ValueError(f"'{vname}' in '{name} = {expr}' is not a read or earlier derived variable")
+            tree = _ColumnRefs(index).visit(ast.parse(expr.strip(), mode='eval'))
+            ast.fix_missing_locations(tree)
+            self._code.append((len(self.columns), compile(tree, f'<{name}>', 'eval')))
+            self.columns.append(name)
+
+    def __len__(self):
+        return len(self._code)
+
+    def apply(self, values):
+        """Fill the derived columns of values (..., ncols) in place; returns values."""
+        namespace = dict(DERIVED_FUNCTIONS)
+        namespace['_v'] = values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for j, code in self._code:
+                values[..., j] = eval(code, {'__builtins__': {}}, namespace)
+        return values
+
+
+def compensated_cumsum(x):
+    """
+    Cumulative sum along axis 0 with a leading row of zeros, corrected
+    for rounding (cascaded summation).
+
+    np.cumsum adds sequentially, so the rounding error of each addition
+    can be recovered afterwards with the TwoSum identity and summed
+    separately; adding that correction back keeps prefix sums of long
+    float64 series (e.g. 6000 months of ~250 K temperatures) accurate to
+    a few ulps instead of drifting with N. Returns shape (N+1,) + x.shape[1:].
+    """
+    x  = np.asarray(x, dtype=float)
+    cs = np.cumsum(x, axis=0)
+    prev = np.concatenate((np.zeros_like(cs[:1]), cs[:-1]), axis=0)
+    bv   = cs - prev
+    err  = (prev - (cs - bv)) + (x - bv)
+    out  = np.zeros((len(x) + 1,) + x.shape[1:])
+    out[1:] = cs + np.cumsum(err, axis=0)
+    return out
+
+
+def _rolling_extreme(x, window, func):
+    """
+    func (np.minimum or np.maximum) over x[s:s+window] for every start
+    s = 0..N-window, along axis 0, in O(N) (van Herk/Gil-Werman: block
+    prefix and suffix accumulations, combined at each window).
+    """
+    N, nb = len(x), -(-len(x) // window)
+    fill  = np.inf if func is np.minimum else -np.inf
+    pad   = np.full((nb * window,) + x.shape[1:], fill)
+    pad[:N] = x
+    blocks = pad.reshape((nb, window) + x.shape[1:])
+    prefix = func.accumulate(blocks, axis=1).reshape(pad.shape)
+    suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(pad.shape)
+    start  = np.arange(N - window + 1)
+    return func(suffix[start], prefix[start + window - 1])
+
+
+def running_stats(vavg, window, full=True):
+    """
+    Causal rolling-window statistics of every column of vavg at once.
+
+    vavg is (N,) or (N, ncols). Row i uses the same window as
+    compute_running_means: vavg[0:i+1] while i < window, then the
+    `window` months before i, vavg[i-window:i]. All sums come from one
+    compensated cumulative sum per quantity, taken on the data minus its
+    first row so that the variance does not cancel.
+
+    Returns a dict of arrays shaped like vavg:
+        mean   -- window mean (intavg1/intavg2)
+        slope  -- change of the mean since the start/previous window, per year
+        std    -- population standard deviation over the window
+        trend  -- least-squares slope over the window, per year
+        min    -- window minimum
+        max    -- window maximum
+    With full=False only mean and slope are computed.
+    """
+    x   = np.asarray(vavg, dtype=float)
+    N   = len(x)
+    col = (slice(None),) + (None,) * (x.ndim - 1)
+    idx = np.arange(N)
+
+    early = idx < window
+    end   = np.where(early, idx + 1, idx)
+    start = np.where(early, 0, idx - window)
+    n     = (end - start).astype(float)[col]
+
+    # shifted data and month index keep the sums small
+    x0 = x[:1] if N else np.zeros((1,) + x.shape[1:])
+    d  = x - x0
+    t  = idx.astype(float)[col]
+    cs_d   = compensated_cumsum(d)
+    sum_d  = cs_d[end] - cs_d[start]
+    mean_d = sum_d / n
+    mean   = x0 + mean_d
+
+    ref   = np.where(early, 0, idx - window)
+    slope = (mean - mean[ref]) / (window / 12.0)
+    if not full:
+        return {'mean': mean, 'slope': slope}
+
+    cs_dd  = compensated_cumsum(d * d)
+    cs_td  = compensated_cumsum(t * d)
+    sum_dd = cs_dd[end] - cs_dd[start]
+    sum_td = cs_td[end] - cs_td[start]
+    std    = np.sqrt(np.maximum(sum_dd / n - mean_d * mean_d, 0.0))
+
+    # sums of t and t^2 over [start, end) in closed form
+    s, e   = start.astype(float)[col], end.astype(float)[col]
+    sum_t  = (e * (e - 1) - s * (s - 1)) / 2.0
+    sum_tt = ((e - 1) * e * (2 * e - 1) - (s - 1) * s * (2 * s - 1)) / 6.0
+    sxx    = sum_tt - sum_t * sum_t / n
+    sxy    = sum_td - sum_t * sum_d / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trend = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1.0), 0.0) * 12.0
+
+    lo = np.empty_like(x)
+    hi = np.empty_like(x)
+    k  = min(window, N)
+    lo[:k] = np.minimum.accumulate(x[:k], axis=0)
+    hi[:k] = np.maximum.accumulate(x[:k], axis=0)
+    if N > window:
+        # rows i >= window cover x[i-window:i], i.e. starts 0..N-window-1
+        lo[window:] = _rolling_extreme(x[:-1], window, np.minimum)
+        hi[window:] = _rolling_extreme(x[:-1], window, np.maximum)
+
+    return {'mean': mean, 'slope': slope, 'std': std, 'trend': trend, 'min': lo, 'max': hi}
+
+
 def compute_running_means(vavg_vec, int1, int2):
     """
     Compute two causal rolling-window means and their per-year slopes.
@@ -119,31 +1370,204 @@ def compute_running_means(vavg_vec, int1, int2):
 
     Slope units: [variable units] / year.
 
-    Returns (intavg1, intavg2, slope1, slope2), each a 1D array of
-    length len(vavg_vec).
+    vavg_vec may be 1D or 2D (N, ncols); all columns are processed
+    together by running_stats.
+
+    Returns (intavg1, intavg2, slope1, slope2), each an array of the
+    same shape as vavg_vec.
     """
-    N   = len(vavg_vec)
-    cs  = np.cumsum(np.insert(vavg_vec, 0, 0.0))
-    idx = np.arange(N)
+    s1 = running_stats(vavg_vec, int1, full=False)
+    s2 = running_stats(vavg_vec, int2, full=False)
+    return s1['mean'], s2['mean'], s1['slope'], s2['slope']
+
+
+class RunningMeans:
+    """
+    Incremental form of compute_running_means for a set of columns.
+
+    Holds the last int1/int2 values and window means so that each new
+    timestep is added in O(1) and gives the same intavg1, intavg2,
+    slope1 and slope2 values that compute_running_means would return
+    for the extended series.
+
+    Usage:
+        rm = RunningMeans.from_series(vavg[:N], int1, int2)
+        r1, r2, s1, s2 = rm.push(vavg[N])
+    """
+
+    def __init__(self, ncols, int1, int2):
+        self.n       = 0
+        self.windows = (int1, int2)
+        self._state  = [self._new_window(ncols, w) for w in self.windows]
+
+    @staticmethod
+    def _new_window(ncols, window):
+        return {
+            'window': window,
+            'total':  np.zeros(ncols),          # sum of all values while n <= window
+            'values': deque(maxlen=window),     # last `window` raw values
+            'vsum':   np.zeros(ncols),          # sum of values deque
+            'first':  None,                     # window mean at step 0
+            'means':  deque(maxlen=window),     # last `window` window means
+        }
+
+    @classmethod
+    def from_series(cls, vavg, int1, int2):
+        """Build the state by pushing every row of vavg (shape (N, ncols))."""
+        vavg = np.atleast_2d(np.asarray(vavg, dtype=float).T).T
+        rm = cls(vavg.shape[1], int1, int2)
+        for row in vavg:
+            rm.push(row)
+        return rm
+
+    def _step(self, st, x):
+        i, w = self.n, st['window']
+        if i < w:
+            st['total'] = st['total'] + x
+            mean = st['total'] / (i + 1)
+        else:
+            mean = st['vsum'] / w
+        if len(st['values']) == w:
+            st['vsum'] = st['vsum'] - st['values'][0]
+        st['values'].append(x)
+        st['vsum'] = st['vsum'] + x
+
+        if i == 0:
+            st['first'] = mean
+        ref   = st['first'] if i < w else st['means'][0]
+        slope = (mean - ref) / (w / 12.0)
+        st['means'].append(mean)
+        return mean, slope
+
+    def push(self, row):
+        """
+        Append one timestep (1D array of ncols values).
+        Returns (intavg1, intavg2, slope1, slope2) for that timestep.
+        """
+        x = np.array(row, dtype=float)
+        r1, s1 = self._step(self._state[0], x)
+        r2, s2 = self._step(self._state[1], x)
+        self.n += 1
+        return r1, r2, s1, s2
+
+
+class ComponentSeries:
+    """
+    Global-mean time series of one component model, sized to the months
+    actually present.
+
+    Holds one contiguous array of shape (5, n, ncols): the monthly means
+    (vavg) and their running means and slopes (intavg1, intavg2, slope1,
+    slope2), with one column per entry of `columns` (the variables read,
+    then any derived columns such as energy_top/energy_bot). There are
+    no placeholder columns, so a variable's column is its position in
+    `columns`; series['TS'] is a view of the TS monthly means.
+
+    Rows added with append() get their statistics from a RunningMeans
+    straight away, so a streaming consumer can read row i as soon as it
+    is appended. A series built with from_array() computes the
+    statistics with compute_running_means the first time they are asked
+    for. Storage grows by doubling when more than n_months rows are
+    appended (trend.py --follow).
+
+    Usage:
+        s = ComponentSeries('atm', ['TS', 'FLNT'], int1, int2, n_months)
+        s.append(row)
+        s.intavg2[-1, s.index('TS')]
+    """
+
+    FIELDS = ('vavg', 'intavg1', 'intavg2', 'slope1', 'slope2')
+
+    def __init__(self, name, columns, int1, int2, n_months=0):
+        self.name     = name
+        self.columns  = list(columns)
+        self.int1     = int1
+        self.int2     = int2
+        self.n        = 0
+        self._index   = {c: j for j, c in enumerate(self.columns)}
+        self._data    = np.zeros((len(self.FIELDS), max(n_months, 1), len(self.columns)))
+        self._running = RunningMeans(len(self.columns), int1, int2)
+        self._nstats  = 0       # rows whose statistics are current
+
+    @classmethod
+    def from_array(cls, name, columns, vavg, int1, int2):
+        """Series over an existing (n, ncols) array of monthly means."""
+        vavg = np.asarray(vavg, dtype=float)
+        s = cls(name, columns, int1, int2, len(vavg))
+        s._data[0, :len(vavg)] = vavg
+        s.n        = len(vavg)
+        s._running = None
+        return s
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, column):
+        return column in self._index
+
+    def __getitem__(self, column):
+        return self._data[0, :self.n, self._index[column]]
+
+    def index(self, column):
+        """Column number of `column`."""
+        return self._index[column]
+
+    def append(self, row):
+        """Add one month (1D array of ncols values)."""
+        if self.n == self._data.shape[1]:
+            grown = np.zeros((len(self.FIELDS), 2 * self.n, len(self.columns)))
+            grown[:, :self.n] = self._data[:, :self.n]
+            self._data = grown
+        self._data[0, self.n] = row
+        if self._nstats == self.n:
+            if self._running is None:
+                self._running = RunningMeans.from_series(self._data[0, :self.n], self.int1, self.int2)
+            self._data[1:, self.n] = self._running.push(self._data[0, self.n])
+            self._nstats += 1
+        self.n += 1
+
+    def set_windows(self, int1, int2):
+        """
+        Change the running-mean windows, recomputing the statistics of the
+        rows already held (trend.py --follow widens windows capped at the
+        months read so far as new months arrive). Streamed rows are replayed
+        through a new RunningMeans, so they match a series appended from
+        the start with these windows.
+        """
+        if (int1, int2) == (self.int1, self.int2):
+            return
+        self.int1, self.int2 = int1, int2
+        if self._running is None:
+            self._nstats = 0
+            return
+        self._running = RunningMeans(len(self.columns), int1, int2)
+        for i in range(self._nstats):
+            self._data[1:, i] = self._running.push(self._data[0, i])
 
-    def _running_mean(window):
-        # i < window: mean over vavg_vec[0 : i+1]  (cs[i+1] - cs[0]) / (i+1)
-        # i >= window: mean over vavg_vec[i-window : i]  (cs[i] - cs[i-window]) / window
-        end   = np.where(idx < window, idx + 1, idx)
-        start = np.where(idx < window, 0,        idx - window)
-        denom = np.where(idx < window, idx + 1,  window)
-        return (cs[end] - cs[start]) / denom
+    def _update_stats(self):
+        if self._nstats == self.n:
+            return
+        self._data[1:, :self.n] = compute_running_means(self._data[0, :self.n],
+                                                         self.int1, self.int2)
+        self._nstats  = self.n
+        self._running = None
 
-    intavg1 = _running_mean(int1)
-    intavg2 = _running_mean(int2)
+    def _field(self, k):
+        if k > 0:
+            self._update_stats()
+        return self._data[k, :self.n]
 
-    def _slope(intavg, window):
-        # i < window: (intavg[i] - intavg[0]) / (window/12)
-        # i >= window: (intavg[i] - intavg[i-window]) / (window/12)
-        ref = np.where(idx < window, 0, idx - window)
-        return (intavg - intavg[ref]) / (window / 12.0)
+    def window_stats(self, window):
+        """running_stats of every column over a `window`-month window."""
+        return running_stats(self._data[0, :self.n], window)
 
-    slope1 = _slope(intavg1, int1)
-    slope2 = _slope(intavg2, int2)
+    @property
+    def time(self):
+        """Month numbers 1..n."""
+        return np.arange(1, self.n + 1, dtype=float)
 
-    return intavg1, intavg2, slope1, slope2
+    vavg    = property(lambda self: self._field(0), doc="(n, ncols) monthly global means")
+    intavg1 = property(lambda self: self._field(1), doc="(n, ncols) int1 running means")
+    intavg2 = property(lambda self: self._field(2), doc="(n, ncols) int2 running means")
+    slope1  = property(lambda self: self._field(3), doc="(n, ncols) int1 slopes, per year")
+    slope2  = property(lambda self: self._field(4), doc="(n, ncols) int2 slopes, per year")
@@ -0,0 +1,253 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# trend_dask.py
+#
+#  Author: Wolf, E.T.
+#
+#  Optional out-of-core engine for the monthly reads (--engine
+#  dask). The monthly files found by the scan become one lazy
+#  dask array per component, shaped (time, var, lat, lon) with one
+#  file per chunk, and the area-weighted global means of every
+#  component are computed by a single dask graph: each chunk is
+#  loaded by the file readers of trend_core (so every I/O backend
+#  and fill-value rule applies) and reduced with the same weighted
+#  means as the streaming reader, so the (n_months, n_vars) result
+#  is identical to read_monthly_files. The levels of 3D NAME:SPEC
+#  columns are reduced while the chunk is loaded, one level block
+#  at a time as the streaming reader does, and their means are
+#  carried next to the fields; the 2D fields and column means are
+#  batched in the order the streaming reader batches them.
+#
+#  Schedulers:
+#    threads      dask's local threaded scheduler (default). Files
+#                 read through the netCDF/HDF5 libraries, which are
+#                 not thread-safe, are read under trend_core's netCDF
+#                 lock; memory-mapped netCDF3 reads (nc3mmap) and the
+#                 reductions run in parallel.
+#    distributed  a local dask.distributed cluster of worker
+#                 processes, which also read in parallel.
+#    ADDRESS      an existing dask.distributed scheduler, e.g.
+#                 tcp://10.0.0.1:8786.
+#
+#  A memory limit caps the number of chunks in flight for the
+#  threaded scheduler, and is split evenly between the workers of
+#  a local cluster.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+import numpy as np
+import trend_core as core
+import trend_io
+
+# optional engine
+try:
+    import dask
+    import dask.array as da
+    from dask.utils import format_bytes, parse_bytes
+except ImportError:
+    dask = None
+try:
+    from dask.distributed import Client, LocalCluster
+except ImportError:
+    Client = LocalCluster = None
+
+SCHEDULERS = ('threads', 'distributed')
+
+# copies of a chunk held while it is loaded and reduced: the fields as
+# read and the float64 block handed to the reduction
+CHUNK_COPIES = 2
+
+
+def available():
+    """True if dask is installed."""
+    return dask is not None
+
+
+def parse_memory(value):
+    """
+    Memory limit in bytes from an int or a string such as '4GB' or
+    '512MiB'; None stays None. Raises ValueError for anything else.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(parse_bytes(value))
+    except (ValueError, TypeError):
+        raise ValueError(f"could not read memory limit '{value}' (e.g. 4GB, 512MiB)")
+
+
+def make_client(scheduler, workers=None, memory_limit=None):
+    """
+    dask.distributed Client for scheduler 'distributed' (a local cluster
+    of `workers` processes sharing memory_limit bytes) or a scheduler
+    address; None for the threaded scheduler. Raises ValueError if
+    dask.distributed is needed but not installed.
+    """
+    if scheduler == 'threads':
+        return None
+    if Client is None:
+        raise ValueError(f"dask scheduler '{scheduler}' needs the dask.distributed package")
+    if scheduler != 'distributed':
+        return Client(scheduler)
+    workers = workers or os.cpu_count() or 1
+    cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True,
+                           memory_limit=memory_limit // workers if memory_limit else 'auto')
+    return Client(cluster)
+
+
+def _load_chunk(filepath, varnames, weights, io_state):
+    """
+    One file as a (1, nvars, lat, lon) float64 block with NaN in invalid
+    cells and in the variables not read, and a (1, nvars, 1, 1) block
+    holding the global means of the 3D level columns (NaN elsewhere),
+    which _load_file reduces level block by level block while it reads
+    them, as for the streaming reader. Files read through the netCDF
+    libraries are read under trend_core's netCDF lock, memory-mapped
+    netCDF3 files without it. Never raises.
+    Returns (block, levels, missing, error) as _load_file does.
+    """
+    shape  = np.shape(weights)
+    block  = np.full((1, len(varnames)) + shape, np.nan)
+    levels = np.full((1, len(varnames), 1, 1), np.nan)
+    names  = list(dict.fromkeys(core.split_level(name)[0] for name in varnames))
+    with core._netcdf_lock:
+        # a worker process adopts the backend selection with its first chunk
+        if trend_io.get_state() != io_state:
+            trend_io.set_state(io_state)
+        locked = trend_io.needs_lock(filepath, names)
+        if locked:
+            fields, missing, error, _ = core._load_file(filepath, varnames, weights)
+    if not locked:
+        fields, missing, error, _ = core._load_file(filepath, varnames, weights)
+    if error is not None:
+        return block, levels, missing, error
+    for j, data, invalid in fields:
+        if np.ndim(data) == 0:
+            levels[0, j] = data
+            continue
+        if data.shape != shape:
+            return (np.full_like(block, np.nan), np.full_like(levels, np.nan), missing,
+                    f"ValueError: {varnames[j]} has shape {data.shape}, the weights {shape}")
+        block[0, j] = data
+        if invalid is not None:
+            block[0, j][invalid] = np.nan
+    return block, levels, missing, None
+
+
+def _field_order(varnames):
+    """
+    Columns of the fields _load_file returns, in its order: the 2D
+    variables, then the column means (NAME:col) of each 3D variable in
+    the order the 3D variables first appear. The level columns are
+    reduced by _load_file itself.
+    """
+    plain = []
+    by_var = {}
+    for j, name in enumerate(varnames):
+        vname, spec = core.split_level(name)
+        if spec is None:
+            plain.append(j)
+        else:
+            by_var.setdefault(vname, [])
+            if spec[0] == 'col':
+                by_var[vname].append(j)
+    return plain + [j for cols in by_var.values() for j in cols]
+
+
+def _chunk_means(block, levels, varnames, weights):
+    """
+    (t, nvars) global means of a (t, nvars, lat, lon) block and the
+    (t, nvars, 1, 1) level means loaded with it: the NaN cells are the
+    invalid ones, and the fields of each row are reduced by trend_core's
+    _reduce_fields in the order and batches of the streaming reader, so
+    the means are identical to it.
+    """
+    out   = levels[:, :, 0, 0].copy()
+    order = _field_order(varnames)
+    for t in range(block.shape[0]):
+        stats  = {'vars': {vname: {} for vname in varnames}}
+        fields = []
+        for j in order:
+            data    = block[t, j]
+            invalid = np.isnan(data)
+            if invalid.all():
+                continue
+            fields.append((j, data, invalid if invalid.any() else None))
+        if not fields:
+            continue
+        row  = core._reduce_fields(fields, varnames, weights, stats)
+        cols = [j for j, _, _ in fields]
+        out[t, cols] = row[cols]
+    return out
+
+
+def monthly_means(streams, workers=None, memory_limit=None, client=None):
+    """
+    Global means of several lists of monthly files as one dask graph.
+
+    streams is a list of (files, prefix, varnames, weights), one per
+    component. Each becomes a lazy (time, var, lat, lon) array with one
+    file per chunk, reduced chunk by chunk to (time, var) global means.
+    The graph runs on client if given (see make_client), else on the
+    threaded scheduler with `workers` threads, fewer if memory_limit
+    bytes would not hold that many chunks.
+
+    Unreadable files are reported by name and stored as NaN, missing
+    variables are warned about once, as in iter_monthly_means.
+
+    Returns a list of (out, failed) per stream: the (len(files),
+    len(varnames)) array of global means and the [(filepath, error)]
+    of the files that could not be read.
+    """
+    io_state = trend_io.get_state()
+    arrays = []
+    infos  = []
+    chunk_bytes = 1
+    for files, prefix, varnames, weights in streams:
+        shape = np.shape(weights)
+        if not files:
+            arrays.append(None)
+            infos.append([])
+            continue
+        # one graph key for the weights, shared by every load
+        shared = dask.delayed(weights)
+        loads  = [dask.delayed(_load_chunk, pure=False, nout=4)(f, varnames, shared, io_state)
+                  for f in files]
+        lazy   = da.concatenate([da.from_delayed(block, (1, len(varnames)) + shape, dtype=float)
+                                 for block, _, _, _ in loads], axis=0)
+        level_means = da.concatenate([da.from_delayed(levels, (1, len(varnames), 1, 1), dtype=float)
+                                      for _, levels, _, _ in loads], axis=0)
+        arrays.append(da.map_blocks(_chunk_means, lazy, level_means, varnames=list(varnames),
+                                    weights=weights, drop_axis=[2, 3], dtype=float))
+        infos.append([(missing, error) for _, _, missing, error in loads])
+        chunk_bytes = max(chunk_bytes, CHUNK_COPIES * 8 * len(varnames) * int(np.prod(shape)))
+
+    todo = [a for a in arrays if a is not None]
+    if client is not None:
+        means, status = dask.compute(todo, infos, scheduler=client)
+        print(f"  dask: {sum(len(f) for f, _, _, _ in streams)} files on "
+              f"{len(client.scheduler_info().get('workers', {}))} workers")
+    else:
+        nthreads = workers or os.cpu_count() or 1
+        if memory_limit:
+            nthreads = max(1, min(nthreads, memory_limit // chunk_bytes))
+        print(f"  dask: {sum(len(f) for f, _, _, _ in streams)} files, {nthreads} threads"
+              + (f", {format_bytes(chunk_bytes)} per chunk in flight" if memory_limit else ""))
+        means, status = dask.compute(todo, infos, scheduler='threads', num_workers=nthreads)
+
+    results = []
+    means = iter(means)
+    for (files, prefix, varnames, weights), arr, info in zip(streams, arrays, status):
+        out = next(means) if arr is not None else np.full((0, len(varnames)), np.nan)
+        failed = []
+        for filepath, (missing, error) in zip(files, info):
+            if error is not None:
+                failed.append((filepath, error))
+                print(f"  ERROR: could not read {os.path.basename(filepath)} ({error}), storing NaN")
+            for vname in missing:
+                key = (prefix, vname)
+                if key not in core._warned_missing:
+                    print(core._missing_warning(filepath, vname))
+                    core._warned_missing.add(key)
+        results.append((out, failed))
+    return results
@@ -0,0 +1,495 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# trend_io.py
+#
+#  Author: Wolf, E.T.
+#
+#  I/O backends for the history and timeseries readers in
+#  trend_core. A backend opens one file and returns an object with
+#
+#    variables             name -> variable (dimensions, shape, ndim,
+#                          dtype, ncattrs(), getncattr())
+#    field(vname, rec)     one (y, x) record as (data, invalid)
+#    block(vname, t0, t1)  records t0..t1-1 as (data, invalid)
+#    levels(vname, k0, k1, rec)
+#                          levels k0..k1-1 of one record of a
+#                          (time, lev, y, x) variable as (data, invalid)
+#    array(vname)          a small variable (coordinates, hybrid
+#                          coefficients) read whole, unmasked
+#    close()
+#
+#  where invalid is a boolean mask of the missing cells, or None
+#  when a field has none. A backend's thread_safe flag is True if it
+#  does not go through the netCDF-C/HDF5 libraries, so several
+#  threads may read with it at once. Backends:
+#
+#    netcdf4   netCDF4.Dataset; reads every file and field, and
+#              handles packed data (always available)
+#    nc3mmap   memory-mapped netCDF3 files (trend_nc3)
+#    h5netcdf  HDF5-based netCDF4 files through h5py (optional)
+#    xarray    lazy xarray dataset, chunked with dask when it is
+#              installed, for large timeseries blocks (optional)
+#
+#  The backend is chosen per file format with set_backend(). In
+#  'auto' mode (the default) the first file of each format is
+#  probed: every available backend for that format reads the
+#  requested fields a few times, and the fastest one whose values
+#  match netcdf4 is used for the rest of the run. Files or fields a
+#  backend cannot take (packed data, other shapes, unreadable files)
+#  are opened with netcdf4, which reports any error.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import time
+from collections.abc import Mapping
+import numpy   as np
+import netCDF4 as nc
+import trend_nc3
+
+# optional backends
+try:
+    import h5netcdf
+except ImportError:
+    h5netcdf = None
+try:
+    import xarray as xr
+except ImportError:
+    xr = None
+try:
+    import dask
+except ImportError:
+    dask = None
+
+# backend selection: 'auto' or a backend name, and the probe's choice
+# per file format in auto mode
+_selected = 'auto'
+_chosen   = {}
+_warned   = set()
+
+# fields read per backend by the probe, and probe repetitions
+PROBE_FIELDS = 4
+PROBE_REPEAT = 3
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Missing cells
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def fill_values(var):
+    """
+    Values marking missing cells of a netCDF variable: its _FillValue
+    (or the netCDF default fill for its type) and missing_value, plus
+    the -999.0 sentinel used by some post-processed output.
+    """
+    attrs = var.ncattrs()
+    fills = [-999.0]
+    if '_FillValue' in attrs:
+        fills.extend(np.atleast_1d(var.getncattr('_FillValue')))
+    elif var.dtype.str[1:] in nc.default_fillvals:
+        fills.append(nc.default_fillvals[var.dtype.str[1:]])
+    if 'missing_value' in attrs:
+        fills.extend(np.atleast_1d(var.getncattr('missing_value')))
+    return list({float(f) for f in fills})
+
+
+def invalid_cells(data, fills):
+    """Boolean mask of cells equal to any fill value, or None if there are none."""
+    invalid = None
+    for f in fills:
+        hit = np.isnan(data) if np.isnan(f) else (data == f)
+        invalid = hit if invalid is None else (invalid | hit)
+    if invalid is None or not invalid.any():
+        return None
+    return invalid
+
+
+def _packed(var):
+    attrs = var.ncattrs()
+    return 'scale_factor' in attrs or 'add_offset' in attrs
+
+
+def _plain(var):
+    """True for an unpacked numeric (time, y, x) or (time, lev, y, x) variable with at least one record."""
+    return var.ndim in (3, 4) and var.shape[0] >= 1 and var.dtype.kind in 'iuf' and not _packed(var)
+
+
+def file_format(filepath):
+    """'nc3' for netCDF3 files, 'hdf5' for HDF5-based netCDF4 files, else None."""
+    try:
+        with open(filepath, 'rb') as f:
+            magic = f.read(8)
+    except OSError:
+        return None
+    if magic[:3] == b'CDF' and magic[3:4] in (bytes([v]) for v in trend_nc3.VERSIONS):
+        return 'nc3'
+    if magic == b'\x89HDF\r\n\x1a\n':
+        return 'hdf5'
+    return None
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Backends
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class _Variable:
+    """netCDF4.Variable-like description of a variable of another library."""
+
+    def __init__(self, dimensions, shape, dtype, attrs):
+        self.dimensions = tuple(dimensions)
+        self.shape      = tuple(shape)
+        self.ndim       = len(self.shape)
+        self.dtype      = np.dtype(dtype)
+        self.attrs      = attrs
+
+    def ncattrs(self):
+        return list(self.attrs)
+
+    def getncattr(self, name):
+        return self.attrs[name]
+
+
+class _Variables(Mapping):
+    """name -> _Variable over a library's own variables, wrapped when looked up."""
+
+    def __init__(self, source, wrap):
+        self._source = source
+        self._wrap   = wrap
+
+    def __getitem__(self, name):
+        return self._wrap(self._source[name])
+
+    def __contains__(self, name):
+        return name in self._source
+
+    def __iter__(self):
+        return iter(self._source)
+
+    def __len__(self):
+        return len(self._source)
+
+
+class NetCDF4File:
+    """netcdf4 backend: netCDF4.Dataset with auto-masking off."""
+
+    name    = 'netcdf4'
+    formats = ('nc3', 'hdf5')
+    package = 'netCDF4'
+    thread_safe = False
+
+    @staticmethod
+    def available():
+        return True
+
+    def __init__(self, filepath):
+        self._ncid = nc.Dataset(filepath, 'r')
+        self._ncid.set_auto_mask(False)
+        self.variables = self._ncid.variables
+
+    def field(self, vname, rec=0):
+        var = self.variables[vname]
+        if _packed(var):
+            # packed data: let netCDF4 mask before unpacking
+            var.set_auto_mask(True)
+            raw  = var[rec, :, :]
+            data = np.asarray(np.ma.getdata(raw), dtype=float)
+            invalid = np.ma.getmaskarray(raw) | (data == -999.0)
+            return data, (invalid if invalid.any() else None)
+        data = np.asarray(var[rec, :, :], dtype=float)
+        return data, invalid_cells(data, fill_values(var))
+
+    def block(self, vname, t0, t1):
+        var = self.variables[vname]
+        var.set_auto_mask(True)
+        raw  = var[t0:t1, :, :]
+        data = np.ma.getdata(raw)
+        return data, np.ma.getmaskarray(raw) | (data == -999.0)
+
+    def levels(self, vname, k0, k1, rec=0):
+        var = self.variables[vname]
+        if _packed(var):
+            var.set_auto_mask(True)
+            raw  = var[rec, k0:k1, :, :]
+            data = np.asarray(np.ma.getdata(raw), dtype=float)
+            invalid = np.ma.getmaskarray(raw) | (data == -999.0)
+            return data, (invalid if invalid.any() else None)
+        data = var[rec, k0:k1, :, :]
+        return data, invalid_cells(data, fill_values(var))
+
+    def array(self, vname):
+        return np.asarray(self.variables[vname][...])
+
+    def close(self):
+        self._ncid.close()
+
+
+class NC3MmapFile:
+    """nc3mmap backend: fields are views of the memory-mapped file (trend_nc3)."""
+
+    name    = 'nc3mmap'
+    formats = ('nc3',)
+    package = None
+    thread_safe = True
+
+    @staticmethod
+    def available():
+        return True
+
+    def __init__(self, filepath):
+        self._ncf = trend_nc3.NC3File(filepath)
+        self.variables = self._ncf.variables
+
+    def field(self, vname, rec=0):
+        # the fill-value scan touches every cell, so the pages are read here
+        data = self._ncf.record(vname, rec)
+        return data, invalid_cells(data, fill_values(self.variables[vname]))
+
+    def block(self, vname, t0, t1):
+        data = self._ncf.records(vname, t0, t1)
+        invalid = invalid_cells(data, fill_values(self.variables[vname]))
+        return data, invalid
+
+    def levels(self, vname, k0, k1, rec=0):
+        data = self._ncf.record(vname, rec, k0, k1)
+        return data, invalid_cells(data, fill_values(self.variables[vname]))
+
+    def array(self, vname):
+        return self._ncf.array(vname)
+
+    def close(self):
+        # the mapping is released with the last view of it
+        pass
+
+
+class H5NetCDFFile:
+    """h5netcdf backend: HDF5-based netCDF4 files read through h5py."""
+
+    name    = 'h5netcdf'
+    formats = ('hdf5',)
+    package = 'h5netcdf'
+    thread_safe = False
+
+    @staticmethod
+    def available():
+        return h5netcdf is not None
+
+    def __init__(self, filepath):
+        self._f = h5netcdf.File(filepath, 'r')
+        self.variables = _Variables(self._f.variables,
+                                    lambda v: _Variable(v.dimensions, v.shape, v.dtype, dict(v.attrs)))
+
+    def field(self, vname, rec=0):
+        var  = self.variables[vname]
+        data = np.asarray(self._f.variables[vname][rec, :, :])
+        return data, invalid_cells(data, fill_values(var))
+
+    def block(self, vname, t0, t1):
+        var  = self.variables[vname]
+        data = np.asarray(self._f.variables[vname][t0:t1, :, :])
+        return data, invalid_cells(data, fill_values(var))
+
+    def levels(self, vname, k0, k1, rec=0):
+        var  = self.variables[vname]
+        data = np.asarray(self._f.variables[vname][rec, k0:k1, :, :])
+        return data, invalid_cells(data, fill_values(var))
+
+    def array(self, vname):
+        return np.asarray(self._f.variables[vname][...])
+
+    def close(self):
+        self._f.close()
+
+
+class XarrayFile:
+    """
+    xarray backend: the file is opened lazily without CF decoding and
+    only the requested records are loaded. With dask installed the
+    variables are chunked, so a timeseries block is decompressed by
+    dask's threads in parallel.
+    """
+
+    name    = 'xarray'
+    formats = ('nc3', 'hdf5')
+    package = 'xarray'
+    thread_safe = False
+
+    @staticmethod
+    def available():
+        return xr is not None
+
+    def __init__(self, filepath):
+        self._ds = xr.open_dataset(filepath, decode_cf=False, cache=False,
+                                   chunks={} if dask is not None else None)
+        self.variables = _Variables(self._ds.variables,
+                                    lambda v: _Variable(v.dims, v.shape, v.dtype, dict(v.attrs)))
+
+    def field(self, vname, rec=0):
+        data = self._ds.variables[vname][rec].values
+        return data, invalid_cells(data, fill_values(self.variables[vname]))
+
+    def block(self, vname, t0, t1):
+        data = self._ds.variables[vname][t0:t1].values
+        return data, invalid_cells(data, fill_values(self.variables[vname]))
+
+    def levels(self, vname, k0, k1, rec=0):
+        data = self._ds.variables[vname][rec, k0:k1].values
+        return data, invalid_cells(data, fill_values(self.variables[vname]))
+
+    def array(self, vname):
+        return np.asarray(self._ds.variables[vname].values)
+
+    def close(self):
+        self._ds.close()
+
+
+BACKENDS = {cls.name: cls for cls in (NetCDF4File, NC3MmapFile, H5NetCDFFile, XarrayFile)}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Selection
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def available_backends():
+    """Names of the backends whose libraries are installed."""
+    return [name for name, cls in BACKENDS.items() if cls.available()]
+
+
+def set_backend(name):
+    """
+    Select the backend: 'auto' or one of BACKENDS. Raises ValueError for
+    an unknown backend or one whose library is not installed.
+    """
+    global _selected
+    if name != 'auto' and name not in BACKENDS:
+        raise ValueError(f"unknown I/O backend '{name}'; choose auto, {', '.join(BACKENDS)}")
+    if name != 'auto' and not BACKENDS[name].available():
+        raise ValueError(f"I/O backend '{name}' needs the {BACKENDS[name].package} package")
+    _selected = name
+    _chosen.clear()
+
+
+def get_state():
+    """Backend selection of this process, to pass to worker processes."""
+    return (_selected, dict(_chosen))
+
+
+def set_state(state):
+    """Adopt the backend selection of another process (see get_state)."""
+    global _selected
+    _selected = state[0]
+    _chosen.clear()
+    _chosen.update(state[1])
+
+
+def _try_open(name, filepath, varnames):
+    """Open with backend name, or None if it cannot take the file or a requested field."""
+    try:
+        f = BACKENDS[name](filepath)
+    except Exception:
+        return None
+    try:
+        if all(_plain(f.variables[v]) for v in varnames if v in f.variables):
+            return f
+    except Exception:
+        pass
+    f.close()
+    return None
+
+
+def probe(filepath, varnames, repeat=PROBE_REPEAT):
+    """
+    Time the available backends for the format of filepath on up to
+    PROBE_FIELDS of varnames. Returns {backend: seconds per file}, with
+    None for backends that could not read the file or whose values
+    differ from netcdf4's.
+    """
+    fmt = file_format(filepath)
+    names = [name for name in available_backends() if fmt in BACKENDS[name].formats]
+
+    def _read(f):
+        fields = [v for v in varnames if v in f.variables][:PROBE_FIELDS]
+        return [np.asarray(f.field(v)[0], dtype=float) for v in fields]
+
+    reference = None
+    times = {}
+    for name in names:
+        best = None
+        try:
+            for k in range(repeat + 1):
+                t0 = time.perf_counter()
+                f  = _try_open(name, filepath, varnames) if name != 'netcdf4' else NetCDF4File(filepath)
+                if f is None:
+                    break
+                values = _read(f)
+                f.close()
+                # the first pass only warms the page cache
+                if k > 0:
+                    elapsed = time.perf_counter() - t0
+                    best = elapsed if best is None else min(best, elapsed)
+            if best is not None and name == 'netcdf4':
+                reference = values
+            elif best is not None and reference is not None:
+                if not all(np.array_equal(a, b, equal_nan=True) for a, b in zip(values, reference)):
+                    best = None
+        except Exception:
+            best = None
+        times[name] = best
+    return times
+
+
+def prepare(filepath, varnames, quiet=False):
+    """
+    In auto mode, choose the backend for the format of filepath by
+    probing it, once per format and process; prints the choice unless
+    quiet. Returns the backend name used for this file's format.
+    """
+    fmt = file_format(filepath)
+    if fmt is None:
+        return 'netcdf4'
+    if _selected != 'auto':
+        if fmt in BACKENDS[_selected].formats:
+            return _selected
+        if (_selected, fmt) not in _warned and not quiet:
+            print(f"  WARNING: I/O backend {_selected} cannot read {fmt} files, using netcdf4")
+        _warned.add((_selected, fmt))
+        return 'netcdf4'
+    if fmt not in _chosen:
+        names = [name for name in available_backends() if fmt in BACKENDS[name].formats]
+        if len(names) == 1:
+            # nothing to compare against
+            _chosen[fmt] = names[0]
+            return _chosen[fmt]
+        times = probe(filepath, varnames)
+        ok = {name: t for name, t in times.items() if t is not None}
+        _chosen[fmt] = min(ok, key=ok.get) if ok else 'netcdf4'
+        if not quiet:
+            report = ', '.join(f"{name} {t * 1e3:.1f} ms" if t is not None else f"{name} n/a"
+                               for name, t in times.items())
+            print(f"  I/O backend for {fmt} files: {_chosen[fmt]} ({report} per file)")
+    return _chosen[fmt]
+
+
+def needs_lock(filepath, varnames):
+    """
+    True unless open_file would read filepath with a thread-safe
+    backend (nc3mmap), i.e. whether a thread reading it must hold
+    trend_core's netCDF lock. Call it under that lock: it may probe.
+    """
+    name = prepare(filepath, varnames, quiet=True)
+    if not BACKENDS[name].thread_safe:
+        return True
+    f = _try_open(name, filepath, varnames)
+    if f is None:
+        return True
+    f.close()
+    return False
+
+
+def open_file(filepath, varnames):
+    """
+    Open filepath with the backend selected for its format (see
+    prepare), falling back to netcdf4 when that backend cannot take the
+    file or one of varnames. Raises what netCDF4.Dataset raises for
+    files that cannot be opened at all.
+    """
+    name = prepare(filepath, varnames, quiet=True)
+    if name != 'netcdf4':
+        f = _try_open(name, filepath, varnames)
+        if f is not None:
+            return f
+    return NetCDF4File(filepath)
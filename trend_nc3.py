@@ -0,0 +1,253 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# trend_nc3.py
+#
+#  Author: Wolf, E.T.
+#
+#  Memory-mapped reader for netCDF3 files (classic, 64-bit offset
+#  and CDF-5), the nc3mmap backend of trend_io.
+#  The header of a netCDF3 file fixes where every variable lives,
+#  so once it is parsed a field is just an offset into the file:
+#  the file is mapped read-only and each requested record is
+#  handed to the reduction as a (lat, lon) numpy view of the
+#  mapped pages, without going through the netCDF library or
+#  copying into intermediate buffers.
+#
+#  Parsed headers are kept per process, keyed by the header bytes,
+#  so the monthly files of one run (which share a layout) are
+#  parsed once. Anything else (netCDF4/HDF5 files, packed fields,
+#  variables that are not (time, y, x)) is left to other backends.
+#
+#  Format reference: the NetCDF Classic and 64-bit Offset Format
+#  specification (Unidata, NetCDF User's Guide, appendix).
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import mmap
+import struct
+import numpy as np
+
+# version byte after b'CDF': 1 classic, 2 64-bit offset, 5 64-bit data (CDF-5)
+VERSIONS = (1, 2, 5)
+
+# netCDF3 external types (all big-endian)
+_TYPES = {1: 'i1', 2: 'S1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8',
+          7: 'u1', 8: '>u2', 9: '>u4', 10: '>i8', 11: '>u8'}
+
+_NC_DIMENSION = 10
+_NC_VARIABLE  = 11
+_NC_ATTRIBUTE = 12
+
+# parsed headers: header length -> {header bytes: NC3Layout}
+_layouts = {}
+_MAX_LAYOUTS = 64
+
+
+class NC3Variable:
+    """
+    One variable of a netCDF3 header. Mirrors the parts of the
+    netCDF4.Variable interface the readers use: name, dimensions,
+    shape, ndim, dtype, ncattrs() and getncattr().
+    """
+
+    def __init__(self, name, dimensions, shape, dtype, attrs, begin, is_record):
+        self.name       = name
+        self.dimensions = dimensions
+        self.shape      = shape
+        self.ndim       = len(shape)
+        self.dtype      = dtype
+        self.attrs      = attrs
+        self.begin      = begin
+        self.is_record  = is_record
+
+    def ncattrs(self):
+        return list(self.attrs)
+
+    def getncattr(self, name):
+        return self.attrs[name]
+
+
+class NC3Layout:
+    """
+    Parsed header of a netCDF3 file: dimensions, global attributes,
+    variables (name -> NC3Variable), the number of records, the size
+    of one record across all record variables, and the header length.
+    """
+
+    def __init__(self, version, numrecs, dims, attrs, variables, recsize, header_len):
+        self.version    = version
+        self.numrecs    = numrecs
+        self.dims       = dims
+        self.attrs      = attrs
+        self.variables  = variables
+        self.recsize    = recsize
+        self.header_len = header_len
+
+
+class _Cursor:
+    """Big-endian reader over the header bytes."""
+
+    def __init__(self, buf, version):
+        self.buf = buf
+        self.pos = 4
+        self.version = version
+
+    def take(self, fmt):
+        value = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def int32(self):
+        return self.take('>i')
+
+    def size(self):
+        """NON_NEG: 4 bytes, 8 in CDF-5."""
+        return self.take('>q') if self.version == 5 else self.take('>I')
+
+    def offset(self):
+        """Variable begin: 4 bytes in classic files, 8 otherwise."""
+        return self.take('>I') if self.version == 1 else self.take('>q')
+
+    def name(self):
+        n = self.size()
+        raw = bytes(self.buf[self.pos:self.pos + n])
+        self.pos += -(-n // 4) * 4
+        return raw.decode('utf-8')
+
+    def values(self, nc_type, n):
+        dtype = np.dtype(_TYPES[nc_type])
+        nbytes = n * dtype.itemsize
+        raw = bytes(self.buf[self.pos:self.pos + nbytes])
+        self.pos += -(-nbytes // 4) * 4
+        if nc_type == 2:
+            return raw.rstrip(b'\x00').decode('utf-8', 'replace')
+        data = np.frombuffer(raw, dtype=dtype).astype(dtype.newbyteorder('='))
+        return data[0] if n == 1 else data
+
+    def attributes(self):
+        tag, n = self.int32(), self.size()
+        if tag not in (_NC_ATTRIBUTE, 0):
+            raise ValueError(f"bad attribute list tag {tag}")
+        attrs = {}
+        for _ in range(n):
+            name = self.name()
+            nc_type = self.int32()
+            attrs[name] = self.values(nc_type, self.size())
+        return attrs
+
+
+def parse_header(buf):
+    """
+    NC3Layout of the netCDF3 file whose bytes (or leading bytes, as long
+    as they hold the whole header) are buf. Raises ValueError if buf is
+    not a netCDF3 header.
+    """
+    if bytes(buf[:3]) != b'CDF' or buf[3] not in VERSIONS:
+        raise ValueError("not a netCDF3 file")
+    cur = _Cursor(buf, buf[3])
+    numrecs = cur.size()
+
+    tag, n = cur.int32(), cur.size()
+    if tag not in (_NC_DIMENSION, 0):
+        raise ValueError(f"bad dimension list tag {tag}")
+    dims = []
+    for _ in range(n):
+        name = cur.name()
+        dims.append((name, cur.size()))
+
+    attrs = cur.attributes()
+
+    tag, n = cur.int32(), cur.size()
+    if tag not in (_NC_VARIABLE, 0):
+        raise ValueError(f"bad variable list tag {tag}")
+    variables = {}
+    record_sizes = []
+    for _ in range(n):
+        name   = cur.name()
+        dimids = [cur.size() for _ in range(cur.size())]
+        vattrs = cur.attributes()
+        dtype  = np.dtype(_TYPES[cur.int32()])
+        cur.size()                      # vsize: recomputed below, it saturates for large variables
+        begin  = cur.offset()
+        is_record = bool(dimids) and dims[dimids[0]][1] == 0
+        shape = tuple(numrecs if (k == 0 and is_record) else dims[d][1] for k, d in enumerate(dimids))
+        if is_record:
+            record_sizes.append(int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+        variables[name] = NC3Variable(name, tuple(dims[d][0] for d in dimids), shape,
+                                      dtype, vattrs, begin, is_record)
+
+    # a record holds every record variable, each padded to 4 bytes,
+    # except when there is only one record variable
+    if len(record_sizes) == 1:
+        recsize = record_sizes[0]
+    else:
+        recsize = sum(-(-s // 4) * 4 for s in record_sizes)
+    return NC3Layout(cur.version, numrecs, dims, attrs, variables, recsize, cur.pos)
+
+
+def _layout(mm):
+    """NC3Layout of a mapped file, parsed once per distinct header."""
+    for length, known in _layouts.items():
+        layout = known.get(mm[:length])
+        if layout is not None:
+            return layout
+    layout = parse_header(mm)
+    if sum(len(known) for known in _layouts.values()) >= _MAX_LAYOUTS:
+        _layouts.clear()
+    _layouts.setdefault(layout.header_len, {})[mm[:layout.header_len]] = layout
+    return layout
+
+
+class NC3File:
+    """
+    A netCDF3 file mapped read-only. variables maps names to
+    NC3Variable; record(vname) returns a view of one record. The
+    mapping stays valid as long as a view of it is alive, so the
+    file itself is closed as soon as it has been mapped.
+    """
+
+    def __init__(self, filepath):
+        with open(filepath, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.layout    = _layout(self._mm)
+        self.variables = self.layout.variables
+
+    def record(self, vname, rec=0, k0=None, k1=None):
+        """
+        Record rec of a (time, y, x) variable as a (y, x) view of the mapped
+        file; for a (time, lev, y, x) variable, levels k0..k1-1 of it
+        (default: all) as a (lev, y, x) view.
+        """
+        var = self.variables[vname]
+        shape = var.shape[1:]
+        nbytes = int(np.prod(shape, dtype=np.int64)) * var.dtype.itemsize
+        step   = self.layout.recsize if var.is_record else nbytes
+        offset = var.begin + rec * step
+        if len(shape) == 3 and (k0, k1) != (None, None):
+            k0 = 0 if k0 is None else k0
+            k1 = shape[0] if k1 is None else k1
+            plane  = nbytes // shape[0]
+            offset += k0 * plane
+            shape  = (k1 - k0,) + shape[1:]
+            nbytes = (k1 - k0) * plane
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            # start reading the pages now; they are touched by the caller next
+            start = offset - offset % mmap.PAGESIZE
+            self._mm.madvise(mmap.MADV_WILLNEED, start, min(offset + nbytes, len(self._mm)) - start)
+        return np.ndarray(shape, dtype=var.dtype, buffer=self._mm, offset=offset)
+
+    def array(self, vname):
+        """A fixed-size variable (coordinates, hybrid coefficients), copied whole in native byte order."""
+        var = self.variables[vname]
+        if var.is_record:
+            raise ValueError(f"{vname} is a record variable")
+        data = np.ndarray(var.shape, dtype=var.dtype, buffer=self._mm, offset=var.begin)
+        return data.astype(var.dtype.newbyteorder('='))
+
+    def records(self, vname, t0, t1):
+        """Records t0..t1-1 of a (time, y, x) variable as a (t, y, x) view of the mapped file."""
+        var = self.variables[vname]
+        nbytes = int(np.prod(var.shape[1:], dtype=np.int64)) * var.dtype.itemsize
+        step   = self.layout.recsize if var.is_record else nbytes
+        inner  = np.ndarray(var.shape[1:], dtype=var.dtype, buffer=self._mm, offset=var.begin)
+        return np.ndarray((t1 - t0,) + var.shape[1:], dtype=var.dtype, buffer=self._mm,
+                          offset=var.begin + t0 * step, strides=(step,) + inner.strides)
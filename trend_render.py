@@ -0,0 +1,143 @@
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# trend_render.py
+#
+#  Author: Wolf, E.T.
+#
+#  Figure rendering engine shared by trend_utils.timeSeriesPlots
+#  and plot_trends.py. Callers describe each figure as a spec (a
+#  plain dict of line data, styles, limits and labels, see
+#  figure_spec) and hand the list to render_figures, which draws
+#  them serially or in a process pool.
+#
+#  Each process keeps the figures it has drawn, keyed by their line
+#  layout (figure size, number and style of lines). A later spec
+#  with the same layout reuses that figure: the line data, limits,
+#  labels and legend are updated in place instead of building a new
+#  figure, axes and artists for every variable.
+#
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# per-process figures: layout key -> (fig, ax, lines)
+_figures = {}
+
+
+def figure_spec(outfile, lines, title='', xlim=None, ylim=None, xlabel=None, ylabel=None,
+                figsize=None, dpi=100, fontsize=None, title_size=None,
+                legend=None, grid=None, tight=False):
+    """
+    Description of one figure for render_figures.
+
+    lines is a list of (x, y, style) with style the keyword arguments of
+    Axes.plot (color, linestyle, linewidth, label). xlim/ylim of None
+    autoscale to the data. legend is a dict of Axes.legend keyword
+    arguments (None for no legend), grid a dict of Axes.grid keyword
+    arguments (None for no grid). fontsize applies to the axis labels.
+    """
+    return {
+        'outfile': outfile, 'title': title, 'xlim': xlim, 'ylim': ylim,
+        'xlabel': xlabel, 'ylabel': ylabel, 'figsize': figsize, 'dpi': dpi,
+        'fontsize': fontsize, 'title_size': title_size,
+        'legend': legend, 'grid': grid, 'tight': tight,
+        'lines': [(np.asarray(x), np.asarray(y), dict(style)) for x, y, style in lines],
+    }
+
+
+def _layout(spec):
+    """Key of the figure a spec can be drawn on."""
+    styles = tuple(tuple(sorted(style.items())) for _, _, style in spec['lines'])
+    grid   = None if spec['grid'] is None else tuple(sorted(spec['grid'].items()))
+    return (tuple(spec['figsize']) if spec['figsize'] else None, styles, grid)
+
+
+def _new_figure(spec, fig=None):
+    if fig is None:
+        fig = Figure(figsize=spec['figsize'])
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    lines = [ax.plot([], [], **style)[0] for _, _, style in spec['lines']]
+    if spec['grid'] is not None:
+        ax.grid(True, **spec['grid'])
+    return fig, ax, lines
+
+
+def _draw(fig, ax, lines, spec):
+    """Put a spec's data, limits and labels on an existing figure."""
+    for line, (x, y, _) in zip(lines, spec['lines']):
+        line.set_data(x, y)
+
+    if spec['xlim'] is None or spec['ylim'] is None:
+        ax.relim()
+    if spec['xlim'] is None:
+        ax.set_autoscalex_on(True)
+    else:
+        ax.set_xlim(spec['xlim'])
+    if spec['ylim'] is None:
+        ax.set_autoscaley_on(True)
+    else:
+        ax.set_ylim(spec['ylim'])
+    ax.autoscale_view()
+
+    # only pass sizes that were given, so the rcParams defaults still apply
+    title_kw = {} if spec['title_size'] is None else {'fontsize': spec['title_size']}
+    label_kw = {} if spec['fontsize'] is None else {'fontsize': spec['fontsize']}
+    ax.set_title(spec['title'], **title_kw)
+    ax.set_xlabel(spec['xlabel'] or '', **label_kw)
+    ax.set_ylabel(spec['ylabel'] or '', **label_kw)
+    if spec['legend'] is not None:
+        ax.legend(**spec['legend'])
+    if spec['tight']:
+        fig.tight_layout()
+
+
+def render_figure(spec):
+    """Draw and save one spec in this process; returns the output file."""
+    key = _layout(spec)
+    if key not in _figures:
+        _figures[key] = _new_figure(spec)
+    fig, ax, lines = _figures[key]
+    _draw(fig, ax, lines, spec)
+    fig.savefig(spec['outfile'], dpi=spec['dpi'])
+    return spec['outfile']
+
+
+def _show_figure(spec):
+    """Draw, save and display one spec on a new pyplot figure (blocks)."""
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=spec['figsize'])
+    fig, ax, lines = _new_figure(spec, fig)
+    _draw(fig, ax, lines, spec)
+    fig.savefig(spec['outfile'], dpi=spec['dpi'])
+    plt.show()
+    plt.close(fig)
+    return spec['outfile']
+
+
+def render_figures(specs, jobs=1, show=False):
+    """
+    Render a list of figure specs; returns the output files in spec order.
+
+    With jobs > 1 the specs are split into contiguous blocks over a
+    process pool, so each worker reuses its figures across its block.
+    With show=True the figures are drawn one at a time in this process
+    and displayed interactively.
+    """
+    for spec in specs:
+        outdir = os.path.dirname(spec['outfile'])
+        if outdir:
+            os.makedirs(outdir, exist_ok=True)
+
+    if show:
+        return [_show_figure(spec) for spec in specs]
+    if jobs is None or jobs <= 1 or len(specs) < 2:
+        return [render_figure(spec) for spec in specs]
+
+    nworkers  = min(jobs, len(specs))
+    chunksize = -(-len(specs) // nworkers)
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        return list(pool.map(render_figure, specs, chunksize=chunksize))
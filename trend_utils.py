@@ -8,14 +8,19 @@
 #
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+import glob
+import json
+import os
 import sys
-import matplotlib.pyplot as plt
 import numpy as np
+import trend_core as core
+import trend_render
 
 # global variable settings
-# offset for variable read in. value of 4 for lon, lat, lev, time
-atm_vars_offset = 4 
-ice_vars_offset = 1
+# time series are passed as trend_core.ComponentSeries objects (None for a
+# component that is turned off); a variable's column is its position in the
+# series columns; derived fields (vars.in fourth block, and energy_top/
+# energy_bot for the atm "energy" token) follow the variables read
 auto_t_bound = True    # automatically set the temperature plot y-axis
 auto_e_bound = True    # automatically set the energy balance y-axis
 
@@ -56,10 +61,57 @@ def read_request_var():
         lndPLstr  = f.readline()
         lndPLvars = lndPLstr.split()
 
+        # optional fourth block: derived fields, one "name = expression"
+        # per line, up to the '#' help text at the end of the file
+        derived_lines = []
+        for line in f:
+            if line.lstrip().startswith('#'):
+                break
+            if '//' in line or not line.strip():
+                continue
+            derived_lines.append(line.strip())
+
+    # 3D variables are read as NAME:SPEC (NAME:12, NAME:500hPa, NAME:col,
+    # NAME:0-25 for one column per level) and become columns NAME_SPEC
+    try:
+        atmRvars = core.expand_level_tokens(atmRvars)
+        iceRvars = core.expand_level_tokens(iceRvars)
+        lndRvars = core.expand_level_tokens(lndRvars)
+    except ValueError as e:
+        print("ERROR: ", e)
+        sys.exit()
+
+    # each derived field belongs to the first component whose read
+    # variables (and earlier derived fields) cover its expression
+    derived = {'atm': [], 'ice': [], 'lnd': []}
+    avail   = {'atm': [core.column_name(v) for v in atmRvars],
+               'ice': [core.column_name(v) for v in iceRvars],
+               'lnd': [core.column_name(v) for v in lndRvars]}
+    for line in derived_lines:
+        name, _, expr = line.partition('=')
+        name, expr = name.strip(), expr.strip()
+        if not name.isidentifier() or not expr:
+            print("ERROR: derived field must be written as name = expression: ", line)
+            sys.exit()
+        try:
+            names = core.expression_names(expr)
+        except ValueError as e:
+            print("ERROR: ", name, ": ", e)
+            sys.exit()
+        comp = next((c for c in ('atm', 'ice', 'lnd') if all(v in avail[c] for v in names)), None)
+        if comp is None:
+            print("ERROR: derived field ", name, " uses variables not read by any one component")
+            sys.exit()
+        if name in avail[comp]:
+            print("ERROR: derived field ", name, " is already a variable")
+            sys.exit()
+        derived[comp].append((name, expr))
+        avail[comp].append(name)
+
     # atm error checking
     for var in atmPvars:
         if (var != 'energy'):
-            indexr = np.where(np.array(atmRvars) == var)[0]
+            indexr = np.where(np.array(avail['atm']) == var)[0]
             if (indexr >= 0):
                 pass
             else:
@@ -68,7 +120,7 @@ def read_request_var():
 
     for var in atmPLvars:
         if (var != 'energy'):
-            indexr = np.where(np.array(atmRvars) == var)[0]
+            indexr = np.where(np.array(avail['atm']) == var)[0]
             if (indexr >= 0):
                 pass
             else:
@@ -78,7 +130,7 @@ def read_request_var():
     # ice error checking
     for var in icePvars:
         if (var != 'energy'):
-            indexr = np.where(np.array(iceRvars) == var)[0]
+            indexr = np.where(np.array(avail['ice']) == var)[0]
             if (indexr >= 0):
                 pass
             else:
@@ -87,7 +139,7 @@ def read_request_var():
 
     for var in icePLvars:
         if (var != 'energy'):
-            indexr = np.where(np.array(iceRvars) == var)[0]
+            indexr = np.where(np.array(avail['ice']) == var)[0]
             if (indexr >= 0):
                 pass
             else:
@@ -97,7 +149,7 @@ def read_request_var():
     # lnd error checking
     for var in lndPvars:
         if (var != 'energy'):
-            indexr = np.where(np.array(lndRvars) == var)[0]
+            indexr = np.where(np.array(avail['lnd']) == var)[0]
             if (indexr >= 0):
                 pass
             else:
@@ -106,14 +158,14 @@ def read_request_var():
 
     for var in lndPLvars:
         if (var != 'energy'):
-            indexr = np.where(np.array(lndRvars) == var)[0]
+            indexr = np.where(np.array(avail['lnd']) == var)[0]
             if (indexr >= 0):
                 pass
             else:
                 print("ERROR: ",var, " requested to plot, not on variable list")
                 sys.exit()
          
-    return atmRvars, iceRvars, lndRvars, atmPvars, icePvars, lndPvars, atmPLvars, icePLvars, lndPLvars
+    return atmRvars, iceRvars, lndRvars, atmPvars, icePvars, lndPvars, atmPLvars, icePLvars, lndPLvars, derived
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -121,135 +173,39 @@ def read_request_var():
 # prints text to screen for running output
 # not saved
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def print2screen(atmvars_in, icevars_in, lndvars_in, atmprint_in, iceprint_in, lndprint_in, firstCall, avgfreq, \
-                 do_atm, time_vecA, vavg_vecA, intavg1_vecA, intavg2_vecA, slope_intavg1_vecA, slope_intavg2_vecA, \
-                 do_ice, time_vecI, vavg_vecI, intavg1_vecI, intavg2_vecI, slope_intavg1_vecI, slope_intavg2_vecI, \
-                 do_lnd, time_vecL, vavg_vecL, intavg1_vecL, intavg2_vecL, slope_intavg1_vecL, slope_intavg2_vecL, \
-                 i):
-  
-    print_offset = 1
-    if (avgfreq == 0): print_offset = 2
-    if (avgfreq == 1): print_offset = 1
-    if (avgfreq == 2): print_offset = 0
-
-    i=i+1
-    if (i <  10): istr = '    '
-    if (i >= 10):  istr = '   '
-    if (i >= 100):  istr = '  '
-    if (i >= 1000):  istr = ' '
-    if (i >= 10000):  istr = ''
-
-    # contains all data read in
-    atmout       = np.zeros(1, dtype=int)  
-    iceout       = np.zeros(1, dtype=int)  
-    lndout       = np.zeros(1, dtype=int)  
-    # contains only the data to print to screen
-    atmprint_out = np.zeros(1, dtype=int)  
-    iceprint_out = np.zeros(1, dtype=int)  
-    lndprint_out = np.zeros(1, dtype=int)  
-
-    if (do_atm == True): 
-
-        # include everything else in a general loop
-        for var in atmprint_in:
-            if (var != 'energy'): 
-                indexr = np.where(np.array(atmvars_in) == var)[0]
-                if (indexr >= 0):
-                    xi = indexr + atm_vars_offset
-                    temp = np.array([vavg_vecA[xi], intavg1_vecA[xi], intavg2_vecA[xi]])
-                    temp = np.squeeze(temp)
-                    atmout[0] = i
-                    atmout = np.hstack((atmout, temp)).flatten()
-                    atmout = np.squeeze(atmout)
-
+def print2screen(atmprint_in, iceprint_in, lndprint_in, firstCall, avgfreq, \
+                 seriesA, seriesI, seriesL, i):
+
+    # value shown for each variable: 0 monthly, 1 int1 average, 2 int2 average
+    field = 'intavg1'
+    if (avgfreq == 0): field = 'vavg'
+    if (avgfreq == 1): field = 'intavg1'
+    if (avgfreq == 2): field = 'intavg2'
+
+    for series, print_in in ((seriesA, atmprint_in), (seriesI, iceprint_in), (seriesL, lndprint_in)):
+        if series is None:
+            continue
+
+        values = getattr(series, field)[i]
+        names = [var for var in print_in if var != 'energy' and var in series]
+        cols  = [series.index(var) for var in names]
         # energy goes at the end
-        value_to_find = 'energy'
-        indexr = np.where(np.array(atmprint_in) == value_to_find)[0]
-        if (indexr > 0):
-            N = len(vavg_vecA)
-            xi = N-1
-            temp = np.array([vavg_vecA[xi], intavg1_vecA[xi], intavg2_vecA[xi]])
-            temp = np.squeeze(temp)
-            atmout = np.hstack((atmout, temp)).flatten()
-            atmout = np.squeeze(atmout)
-            xi = N-2
-            temp = np.array([vavg_vecA[xi], intavg1_vecA[xi], intavg2_vecA[xi]])
-            temp = np.squeeze(temp)
-            atmout = np.hstack((atmout, temp)).flatten()
-            atmout = np.squeeze(atmout)       
-
-        if (firstCall == True):                  
-            format_string = "{%s}"
-            print("i  ", end=' ',flush=True)
-            for x in atmprint_in:
-                print(x, end=' ',flush=True)
-            print()        
-         
-        # Define the desired formatting
-        format_string = "{:.3f}"
-        
-        print(int(atmout[0]), end='  ',flush=True)
-        N=len(atmout)
-        for x in range(int((N-1)/3)):
-            y=int(3*(x+1)-print_offset)
-            print(format_string.format(atmout[y]), end='  ',flush=True)
-        print()
-
-
-    if (do_ice == True):       
-
-        # include everything else in a general loop
-        for var in iceprint_in:
-            if (var != 'energy'): 
-                indexr = np.where(np.array(icevars_in) == var)[0]
-                if (indexr >= 0):
-                    xi = indexr + ice_vars_offset
-                    temp = np.array([vavg_vecI[xi], intavg1_vecI[xi], intavg2_vecI[xi]])
-                    temp = np.squeeze(temp)
-                    iceout[0] = i
-                    iceout = np.hstack((iceout, temp)).flatten()
-                    iceout = np.squeeze(iceout)
+        if 'energy' in print_in and 'energy_top' in series:
+            names.append('energy')
+            cols += [series.index('energy_bot'), series.index('energy_top')]
 
         if (firstCall == True):
-            format_string = "{%s}"
             print("i  ", end=' ',flush=True)
-            for x in iceprint_in:
+            for x in names:
                 print(x, end=' ',flush=True)
             print()
 
-
         # Define the desired formatting
         format_string = "{:.3f}"
-        
-        print(int(iceout[0]), end='  ',flush=True)
-        N=len(iceout)
-        for x in range(int((N-1)/3)):
-            y=int(3*(x+1)-print_offset)
-            print(format_string.format(iceout[y]), end='  ',flush=True)
-        print()
 
-
-    if (do_lnd == True): 
-        # include everything else in a general loop
-        for var in lndprint_in:
-            if (var != 'energy'): 
-                indexr = np.where(np.array(lndvars_in) == var)[0]
-                if (indexr >= 0):
-                    xi = indexr + lnd_vars_offset
-                    temp = np.array([vavg_vecL[xi], intavg1_vecL[xi], intavg2_vecL[xi]])
-                    temp = np.squeeze(temp)
-                    lndout[0] = i
-                    lndout = np.hstack((iceout, temp)).flatten()
-                    lndout = np.squeeze(iceout)
-
-        # Define the desired formatting
-        format_string = "{:.3f}"
-        
-        print(int(lndout[0]), end='  ',flush=True)
-        N=len(lndout)
-        for x in range(int((N-1)/3)):
-            y=int(3*(x+1)-print_offset)
-            print(format_string.format(lndout[y]), end='  ',flush=True)
+        print(i + 1, end='  ',flush=True)
+        for xi in cols:
+            print(format_string.format(values[xi]), end='  ',flush=True)
         print()
 
     return
@@ -261,216 +217,303 @@ def print2screen(atmvars_in, icevars_in, lndvars_in, atmprint_in, iceprint_in, l
 # text file outputs are verbose, i.e. instaneous, 1 year, and
 # 10 year average are plotted for each variable
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def print2text(atmvars_in, lndvars_in, icevars_in, atmprint_in, lndprint_in, iceprint_in, \
-               do_atm, vnamesA, time_vecA, vavg_vecA, intavg1_vecA, intavg2_vecA, slope_intavg1_vecA, slope_intavg2_vecA, \
-               do_ice, vnamesI, time_vecI, vavg_vecI, intavg1_vecI, intavg2_vecI, slope_intavg1_vecI, slope_intavg2_vecI, \
-               do_lnd, vnamesL, time_vecL, vavg_vecL, intavg1_vecL, intavg2_vecL, slope_intavg1_vecL, slope_intavg2_vecL, \
+def print2text(atmprint_in, lndprint_in, iceprint_in, \
+               seriesA, seriesL, seriesI, \
                firstDate, lastDate, case_id):
 
-    fmt = "{:.4f}"
-
-    def _write_component(outfile, time_vec, vavg_vec, intavg1_vec, intavg2_vec,
-                         vars_in, print_in, offset, nvtot):
-        a  = np.where(time_vec != 0)
-        a  = np.squeeze(a)
-        na = len(a) - 1
-
-        # build ordered list of (label, col_index) pairs matching print_in order
-        cols = []
-        for var in print_in:
-            if var == 'energy':
-                cols.append(('energy_top', nvtot - 2))
-                cols.append(('energy_bot', nvtot - 1))
-            else:
-                indexr = np.where(np.array(vars_in) == var)[0]
-                if len(indexr) > 0:
-                    cols.append((var, int(indexr[0]) + offset))
+    outfiles = {}
 
+    for name, suffix, series, print_in in (('atm', 'cam', seriesA, atmprint_in),
+                                           ('ice', 'cice', seriesI, iceprint_in),
+                                           ('lnd', 'clm', seriesL, lndprint_in)):
+        if series is None:
+            continue
+        outfile = "data/" + case_id + "_" + firstDate + "-" + lastDate + "_" + suffix + ".txt"
+        cols = _text_columns(series, print_in)
         with open(outfile, "w") as f:
-            # header
-            header = "month"
-            for label, _ in cols:
-                header += "  {}_native  {}_int1  {}_int2".format(label, label, label)
-            print(header, file=f)
+            print(_text_header(cols), file=f)
             # data rows
-            for i in time_vec[0:na]:
-                i = int(i)
-                row = str(i)
-                for label, xi in cols:
-                    row += "  {}  {}  {}".format(
-                        fmt.format(vavg_vec[i, xi]),
-                        fmt.format(intavg1_vec[i, xi]),
-                        fmt.format(intavg2_vec[i, xi]))
-                print(row, file=f)
-
-    if do_atm:
-        nvtotA = len(vavg_vecA[0])
-        outfile = "data/" + case_id + "_" + firstDate + "-" + lastDate + "_cam.txt"
-        _write_component(outfile, time_vecA, vavg_vecA, intavg1_vecA, intavg2_vecA,
-                         atmvars_in, atmprint_in, atm_vars_offset, nvtotA)
+            for i in range(1, len(series)):
+                print(_text_row(series, i, cols), file=f)
         print("  Data written to {}".format(outfile))
+        outfiles[name] = outfile
 
-    if do_ice:
-        nvtotI = len(vavg_vecI[0])
-        outfile = "data/" + case_id + "_" + firstDate + "-" + lastDate + "_cice.txt"
-        _write_component(outfile, time_vecI, vavg_vecI, intavg1_vecI, intavg2_vecI,
-                         icevars_in, iceprint_in, ice_vars_offset, nvtotI)
-        print("  Data written to {}".format(outfile))
+    return outfiles
 
-    if do_lnd:
-        nvtotL = len(vavg_vecL[0])
-        outfile = "data/" + case_id + "_" + firstDate + "-" + lastDate + "_clm.txt"
-        _write_component(outfile, time_vecL, vavg_vecL, intavg1_vecL, intavg2_vecL,
-                         lndvars_in, lndprint_in, ice_vars_offset, nvtotL)
-        print("  Data written to {}".format(outfile))
+
+def _text_columns(series, print_in):
+    """Ordered list of (label, col_index) pairs matching print_in order."""
+    cols = []
+    for var in print_in:
+        if var == 'energy':
+            if 'energy_top' in series:
+                cols.append(('energy_top', series.index('energy_top')))
+                cols.append(('energy_bot', series.index('energy_bot')))
+        elif var in series:
+            cols.append((var, series.index(var)))
+    return cols
+
+
+def _text_header(cols):
+    """Header line of a print2text file."""
+    header = "month"
+    for label, _ in cols:
+        header += "  {}_native  {}_int1  {}_int2".format(label, label, label)
+    return header
+
+
+def _text_row(series, i, cols):
+    """One data row of a print2text file for timestep index i."""
+    fmt = "{:.4f}"
+    vavg, intavg1, intavg2 = series.vavg[i], series.intavg1[i], series.intavg2[i]
+    row = str(i)
+    for label, xi in cols:
+        row += "  {}  {}  {}".format(
+            fmt.format(vavg[xi]),
+            fmt.format(intavg1[xi]),
+            fmt.format(intavg2[xi]))
+    return row
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# // timeSeriesPlots //
-# makes time-series plots at runtime
+# // header2text //
+# starts an empty print2text file (header only) for one
+# component, to be filled row by row with append2text
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def timeSeriesPlots(atmvars_in, lndvars_in, icevars_in, atmplot_in, lndplot_in, iceplot_in, \
-                    do_atm, time_vecA, vavg_vecA, intavg1_vecA, intavg2_vecA, slope_intavg1_vecA, slope_intavg2_vecA, \
-                    do_ice, time_vecI, vavg_vecI, intavg1_vecI, intavg2_vecI, slope_intavg1_vecI, slope_intavg2_vecI, \
-                    do_lnd, time_vecL, vavg_vecL, intavg1_vecL, intavg2_vecL, slope_intavg1_vecL, slope_intavg2_vecL, \
-                    firstDate, lastDate, case_id, show=False):
-#!! routine is incomplete !!
-#!! needs land and ice model plotting !!
+def header2text(outfile, series, print_in):
 
-    outdir = 'plots/snapshots'
+    with open(outfile, "w") as f:
+        print(_text_header(_text_columns(series, print_in)), file=f)
 
-    if (do_atm == True):
-        print("Entering atmosphere model plot sequence...")
-        a   = np.where(time_vecA != 0)
-        a   = np.squeeze(a)
-        na  = len(a)-1
 
-        # include everything else in a general loop
-        for var in atmplot_in:
-            print(var)
-            if (var != 'energy'):
-                indexr = np.where(np.array(atmvars_in) == var)[0]
-                if (indexr >= 0):
-                    xa = indexr + atm_vars_offset
-                    x    = time_vecA[a]
-                    var1 = vavg_vecA[a,xa]    ; var1 = np.squeeze(var1)
-                    var2 = intavg1_vecA[a,xa] ; var2 = np.squeeze(var2)
-                    var3 = intavg2_vecA[a,xa] ; var3 = np.squeeze(var3)
-
-                    if auto_t_bound == True:
-                        if intavg2_vecA[0, xa] > intavg2_vecA[na, xa]:
-                        # decreasing curve
-                            y1 = min(intavg2_vecA[0:na, xa]) * 0.98
-                            y2 = min(intavg2_vecA[0:na, xa]) * 1.05
-                        elif intavg2_vecA[0, xa] <= intavg2_vecA[na, xa]:
-                        # increasing curve
-                            y1 = max(intavg2_vecA[0:na, xa]) * 0.95
-                            y2 = max(intavg2_vecA[0:na, xa]) * 1.02
-                    else:
-                        # set your own limits, however these won't be correct for every variable
-                        y1=0
-                        y2=100
-                    plt.plot(x, var1, linestyle='-', color='b', label='monthly avg')
-                    plt.plot(x, var2, linestyle='-', color='g', label='1 year avg')
-                    plt.plot(x, var3, linestyle='-', color='r', label='10 year avg')
-                    plt.xlim([np.min(x), np.max(x)])
-                    plt.ylim([y1, y2])
-                    plt.title(var)
-                    plt.legend()
-                    outfile = '{}/{}_{}_{}.png'.format(outdir, case_id, var, firstDate)
-                    plt.savefig(outfile, dpi=100)
-                    if show: plt.show()
-                    plt.close()
-                    print('  saved {}'.format(outfile))
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // append2text //
+# appends timestep i of one component series to a file written
+# by print2text or header2text (used by trend.py while streaming
+# and in --follow mode)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def append2text(outfile, series, print_in, i):
+
+    with open(outfile, "a") as f:
+        print(_text_row(series, i, _text_columns(series, print_in)), file=f)
 
-            # energy balance is a special case
-            if (var == 'energy'):
-                x    = time_vecA[a]
-                N = len(vavg_vecA[0,:])
-                xa = N-1
-                var1 = vavg_vecA[a,xa]    ; var1 = np.squeeze(var1)
-                var2 = intavg1_vecA[a,xa] ; var2 = np.squeeze(var2)
-                var3 = intavg2_vecA[a,xa] ; var3 = np.squeeze(var3)
-                xa = N-2
-                var4 = vavg_vecA[a,xa]    ; var4 = np.squeeze(var4)
-                var5 = intavg1_vecA[a,xa] ; var5 = np.squeeze(var5)
-                var6 = intavg2_vecA[a,xa] ; var6 = np.squeeze(var6)
-
-                # found some cases where this isn't working properly
-                if auto_e_bound == True:
-                    bottom_arr = [var1, var2, var3, var4, var5, var6]
-                    top_arr = [var1, var2, var3, var4, var5, var6]
-                    y11 = np.minimum.reduce(bottom_arr)
-                    y22 = np.maximum.reduce(top_arr)
-                    y1  = np.minimum.reduce(y11)
-                    y2  = np.maximum.reduce(y22)
-                else:
-                    # set your own limits
-                    y1=ey1
-                    y2=ey2
-
-                plt.plot(x, var1, linestyle='-', color='b', label='monthly avg')
-                plt.plot(x, var2, linestyle='-', color='g', label='1 year avg')
-                plt.plot(x, var3, linestyle='-', color='r', label='10 year avg')
-
-                plt.plot(x, var4, linestyle='--', color='b', label='monthly avg')
-                plt.plot(x, var5, linestyle='--', color='g', label='1 year avg')
-                plt.plot(x, var6, linestyle='--', color='r', label='10 year avg')
-
-                plt.xlim([np.min(x), np.max(x)])
-                plt.ylim([y1, y2])
-                plt.title(var)
-                plt.legend()
-                outfile = '{}/{}_{}_{}.png'.format(outdir, case_id, var, firstDate)
-                plt.savefig(outfile, dpi=100)
-                plt.close()
-                print('  saved {}'.format(outfile))
-
-            
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# // atm_energy_calc //
-# calculate atmosphere model energy balance from primary vars
+# // print2binary //
+# writes each component series to a binary columnar file,
+# data/<case_id>_<firstDate>-<lastDate>_<model>.npy, plus a
+# .json file of the same name holding the metadata.
+# The .npy array has shape (5, ncols, n): one contiguous run of
+# n months per field and column, fields in BINARY_FIELDS order,
+# columns as listed in the metadata. It is read back memory-mapped
+# by plot_trends.py, which then touches only the columns it plots.
+# Unlike print2text, every column and month is written, at full
+# precision, including the slopes.
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def atm_energy_calc(atmvars, vavg_vecA):
+BINARY_FIELDS  = ('native', 'int1', 'int2', 'slope1', 'slope2')
+BINARY_VERSION = 1
+
+def print2binary(seriesA, seriesL, seriesI, firstDate, lastDate, case_id):
+
+    outfiles = {}
 
-    value_to_find = 'FSNT'
-    indexr = np.where(np.array(atmvars) == value_to_find)[0]
-    xfsnt = indexr + atm_vars_offset
-    if len(indexr) == 0: print("Error: FSNT required for energy calc")
+    for name, model, series in (('atm', 'cam', seriesA), ('ice', 'cice', seriesI), ('lnd', 'clm', seriesL)):
+        if series is None:
+            continue
+        stem = "data/" + case_id + "_" + firstDate + "-" + lastDate + "_" + model
+        block = np.stack([series.vavg.T, series.intavg1.T, series.intavg2.T,
+                          series.slope1.T, series.slope2.T])
+        np.save(stem + ".npy", np.ascontiguousarray(block))
+        meta = {'version': BINARY_VERSION, 'case_id': case_id, 'component': name, 'model': model,
+                'first_date': firstDate, 'last_date': lastDate, 'months': len(series),
+                'int1': series.int1, 'int2': series.int2,
+                'fields': list(BINARY_FIELDS), 'columns': list(series.columns)}
+        with open(stem + ".json", "w") as f:
+            json.dump(meta, f, indent=1)
+        print("  Data written to {}.npy".format(stem))
+        outfiles[name] = stem + ".npy"
+
+    return outfiles
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // print2shard //
+# writes the monthly global means of one shard of a case
+# (trend.py --shard i/N) to data/<case_id>_shard<i>of<N>_<model>.npy,
+# shape (n, nvars), plus a .json file of the same name holding the
+# month range and the end date of the whole run as scanned. Only the variables read are stored: the derived
+# fields and running means depend on the months before the shard,
+# so they are computed when the shards are joined (load_shards).
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+SHARD_VERSION = 2
 
-    value_to_find = 'FLNT'
-    indexr = np.where(np.array(atmvars) == value_to_find)[0]
-    xflnt = indexr + atm_vars_offset
-    if len(indexr) == 0: print("Error: FLNT required for energy calc")
+def print2shard(case_id, name, model, means, columns, shard, nshards,
+                start_year, month0, n_total, last_date, failed=()):
 
-    value_to_find = 'FSNS'
-    indexr = np.where(np.array(atmvars) == value_to_find)[0]
-    xfsns = indexr + atm_vars_offset
-    if len(indexr) == 0: print("Error: FSNS required for energy calc")
+    stem = "data/" + case_id + "_shard" + str(shard) + "of" + str(nshards) + "_" + model
+    means = np.asarray(means, dtype=float).reshape(-1, len(columns))
+    np.save(stem + ".npy", means)
+    meta = {'version': SHARD_VERSION, 'case_id': case_id, 'component': name, 'model': model,
+            'shard': shard, 'nshards': nshards, 'start_year': start_year,
+            'month0': month0, 'months': len(means), 'n_total': n_total, 'last_date': last_date,
+            'columns': list(columns), 'failed': [list(f) for f in failed]}
+    with open(stem + ".json", "w") as f:
+        json.dump(meta, f, indent=1)
+    print("  Shard written to {}.npy".format(stem))
+    return stem + ".npy"
 
-    value_to_find = 'FLNS'
-    indexr = np.where(np.array(atmvars) == value_to_find)[0]
-    xflns = indexr + atm_vars_offset
-    if len(indexr) == 0: print("Error: FLNS required for energy calc")
 
-    value_to_find = 'LHFLX'
-    indexr = np.where(np.array(atmvars) == value_to_find)[0]
-    xlhflx = indexr + atm_vars_offset
-    if len(indexr) == 0: print("Error: LHFLX required for energy calc")
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // load_shards //
+# reads back the print2shard files of one case and component and
+# joins them in date order into the (n_total, nvars) global means
+# of the whole run, with the run's end date as scanned (it depends
+# on whether the scan stopped at -n, so it is not recomputed). Raises ValueError if the shards do not tile the
+# run exactly: a shard missing, shards of different splits or runs
+# of different length, or columns that differ from vars.in.
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def load_shards(case_id, model, columns):
+
+    pattern = glob.escape("data/" + case_id + "_shard") + "*of*_" + model + ".json"
+    metas = []
+    for path in glob.glob(pattern):
+        with open(path) as f:
+            meta = json.load(f)
+        if meta.get('case_id') != case_id or meta.get('version') != SHARD_VERSION:
+            continue
+        meta['path'] = os.path.splitext(path)[0] + ".npy"
+        metas.append(meta)
+    if not metas:
+        raise ValueError("no {} shards of {} found in data/".format(model, case_id))
+
+    splits = sorted({m['nshards'] for m in metas})
+    if len(splits) > 1:
+        raise ValueError("{} shards of {} from different splits ({}); remove the stale files".format(
+            model, case_id, ", ".join("of {}".format(s) for s in splits)))
+    nshards = splits[0]
+    metas.sort(key=lambda m: m['shard'])
+    missing = sorted(set(range(1, nshards + 1)) - {m['shard'] for m in metas})
+    if missing:
+        raise ValueError("{} shards {} of {} missing for {}".format(
+            model, ", ".join(str(s) for s in missing), nshards, case_id))
+
+    month = 0
+    for m in metas:
+        if (m['n_total'], m['start_year'], m['last_date']) != \
+                (metas[0]['n_total'], metas[0]['start_year'], metas[0]['last_date']):
+            raise ValueError("{} shards of {} were cut from runs of different length; "
+                             "rerun them with the same -y and -n".format(model, case_id))
+        if m['month0'] != month:
+            raise ValueError("{} shard {} of {} starts at month {}, expected {}".format(
+                model, m['shard'], nshards, m['month0'] + 1, month + 1))
+        if m['columns'] != list(columns):
+            raise ValueError("{} shard {} of {} holds {}, but vars.in reads {}".format(
+                model, m['shard'], nshards, m['columns'], list(columns)))
+        month += m['months']
+    if month != metas[0]['n_total']:
+        raise ValueError("{} shards of {} cover {} of {} months".format(
+            model, case_id, month, metas[0]['n_total']))
+
+    means = np.concatenate([np.load(m['path']).reshape(-1, len(columns)) for m in metas])
+    failed = [tuple(f) for m in metas for f in m['failed']]
+    return means, metas[0]['start_year'], metas[0]['last_date'], nshards, failed
 
-    value_to_find = 'SHFLX'
-    indexr = np.where(np.array(atmvars) == value_to_find)[0]
-    xshflx = indexr + atm_vars_offset
-    if len(indexr) == 0: print("Error: SHFLX required for energy calc")
 
-    etop = np.array( [vavg_vecA[xfsnt]-vavg_vecA[xflnt] ])
-    etop = np.squeeze(etop)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // timeSeriesPlots //
+# makes time-series plots at runtime
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def timeSeriesPlots(atmplot_in, lndplot_in, iceplot_in, \
+                    seriesA, seriesL, seriesI, \
+                    firstDate, lastDate, case_id, show=False, jobs=1):
 
-    ebot = np.array( [vavg_vecA[xfsns]-vavg_vecA[xflns] - vavg_vecA[xlhflx] - vavg_vecA[xshflx] ])
-    ebot = np.squeeze(ebot)
+    outdir = 'plots/snapshots'
 
-    return etop, ebot
+    # one figure spec per plot variable, rendered together at the end
+    specs = []
+    for title, series, plot_in in (("atmosphere", seriesA, atmplot_in),
+                                   ("sea ice", seriesI, iceplot_in),
+                                   ("land", seriesL, lndplot_in)):
+        if series is None:
+            continue
+        print("Entering {} model plot sequence...".format(title))
+        for var in plot_in:
+            print(var)
+            outfile = '{}/{}_{}_{}.png'.format(outdir, case_id, var, firstDate)
+            if (var != 'energy'):
+                if (var in series):
+                    specs.append(_variable_spec(series, var, outfile))
+            # energy balance is a special case
+            elif ('energy_top' in series):
+                specs.append(_energy_spec(series, var, outfile))
+
+    for outfile in trend_render.render_figures(specs, jobs=jobs, show=show):
+        print('  saved {}'.format(outfile))
+
+
+def _variable_spec(series, var, outfile):
+    """Figure spec for one variable: monthly, int1 and int2 averages."""
+    x    = series.time
+    na   = len(x)-1
+    xa   = series.index(var)
+    var1 = series.vavg[:,xa]
+    var2 = series.intavg1[:,xa]
+    var3 = series.intavg2[:,xa]
+
+    if auto_t_bound == True:
+        if var3[0] > var3[na]:
+        # decreasing curve
+            y1 = min(var3[0:na]) * 0.98
+            y2 = min(var3[0:na]) * 1.05
+        elif var3[0] <= var3[na]:
+        # increasing curve
+            y1 = max(var3[0:na]) * 0.95
+            y2 = max(var3[0:na]) * 1.02
+    else:
+        # set your own limits, however these won't be correct for every variable
+        y1=0
+        y2=100
+
+    lines = [(x, var1, dict(linestyle='-', color='b', label='monthly avg')),
+             (x, var2, dict(linestyle='-', color='g', label='1 year avg')),
+             (x, var3, dict(linestyle='-', color='r', label='10 year avg'))]
+    return trend_render.figure_spec(outfile, lines, title=var, xlim=[np.min(x), np.max(x)],
+                                    ylim=[y1, y2], legend={})
+
+
+def _energy_spec(series, var, outfile):
+    """Figure spec for the energy balance: bottom (solid) and top (dashed)."""
+    x    = series.time
+    xa   = series.index('energy_bot')
+    var1 = series.vavg[:,xa]
+    var2 = series.intavg1[:,xa]
+    var3 = series.intavg2[:,xa]
+    xa   = series.index('energy_top')
+    var4 = series.vavg[:,xa]
+    var5 = series.intavg1[:,xa]
+    var6 = series.intavg2[:,xa]
+
+    # found some cases where this isn't working properly
+    if auto_e_bound == True:
+        bottom_arr = [var1, var2, var3, var4, var5, var6]
+        top_arr = [var1, var2, var3, var4, var5, var6]
+        y11 = np.minimum.reduce(bottom_arr)
+        y22 = np.maximum.reduce(top_arr)
+        y1  = np.minimum.reduce(y11)
+        y2  = np.maximum.reduce(y22)
+    else:
+        # set your own limits
+        y1=ey1
+        y2=ey2
+
+    lines = [(x, var1, dict(linestyle='-', color='b', label='monthly avg')),
+             (x, var2, dict(linestyle='-', color='g', label='1 year avg')),
+             (x, var3, dict(linestyle='-', color='r', label='10 year avg')),
+             (x, var4, dict(linestyle='--', color='b', label='monthly avg')),
+             (x, var5, dict(linestyle='--', color='g', label='1 year avg')),
+             (x, var6, dict(linestyle='--', color='r', label='10 year avg'))]
+    return trend_render.figure_spec(outfile, lines, title=var, xlim=[np.min(x), np.max(x)],
+                                    ylim=[y1, y2], legend={})
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -478,12 +521,8 @@ def atm_energy_calc(atmvars, vavg_vecA):
 # prints a clean summary of final-timestep values and decadal
 # averages for all active component models
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def print_final_summary(atmvars_in, icevars_in, lndvars_in,
-                        do_atm, do_ice, do_lnd,
-                        vavg_vecA, intavg1_vecA, intavg2_vecA,
-                        vavg_vecI, intavg1_vecI, intavg2_vecI,
-                        vavg_vecL, intavg1_vecL, intavg2_vecL,
-                        N_actual, case_id, firstDate, lastDate,
+def print_final_summary(seriesA, seriesI, seriesL,
+                        case_id, firstDate, lastDate,
                         int1_yr, int2_yr):
 
     def _fmt(val):
@@ -505,33 +544,142 @@ def print_final_summary(atmvars_in, icevars_in, lndvars_in,
     print(f"Case:   {case_id}")
     print(f"Period: {firstDate} to {lastDate}")
 
-    last = N_actual - 1
-
-    if do_atm == True:
-        print("\n--- Atmosphere ---")
-        _header()
-        for n, vname in enumerate(atmvars_in):
-            xi = atm_vars_offset + n
-            _row(vname, vavg_vecA[last, xi], intavg1_vecA[last, xi], intavg2_vecA[last, xi])
-        # energy balance columns are appended after all regular atm variables
-        nvtotA = len(vavg_vecA[0])
-        energy_present = nvtotA > atm_vars_offset + len(atmvars_in)
-        if energy_present:
-            _row('energy_top', vavg_vecA[last, nvtotA - 2], intavg1_vecA[last, nvtotA - 2], intavg2_vecA[last, nvtotA - 2])
-            _row('energy_bot', vavg_vecA[last, nvtotA - 1], intavg1_vecA[last, nvtotA - 1], intavg2_vecA[last, nvtotA - 1])
-
-    if do_ice == True:
-        print("\n--- Sea Ice ---")
+    for title, series in (("Atmosphere", seriesA), ("Sea Ice", seriesI), ("Land", seriesL)):
+        if series is None:
+            continue
+        print(f"\n--- {title} ---")
         _header()
-        for n, vname in enumerate(icevars_in):
-            xi = ice_vars_offset + n
-            _row(vname, vavg_vecI[last, xi], intavg1_vecI[last, xi], intavg2_vecI[last, xi])
+        # energy balance columns, if present, come after all regular variables
+        final, avg1, avg2 = series.vavg[-1], series.intavg1[-1], series.intavg2[-1]
+        for xi, vname in enumerate(series.columns):
+            _row(vname, final[xi], avg1[xi], avg2[xi])
 
-    if do_lnd == True:
-        print("\n--- Land ---")
-        _header()
-        for n, vname in enumerate(lndvars_in):
-            xi = ice_vars_offset + n
-            _row(vname, vavg_vecL[last, xi], intavg1_vecL[last, xi], intavg2_vecL[last, xi])
+    print()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // print_batch_summary //
+# prints one table per component model comparing the cases of a
+# trend_batch.py run: the int2 average of every print variable
+# at the last month, one row per case; optionally also written
+# to a text file
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def print_batch_summary(cases, print_in, int2_yr, outfile=None):
+    """
+    cases is a list of (case_id, firstDate, lastDate, series) with series
+    a dict of ComponentSeries keyed by 'atm', 'ice' and 'lnd'; print_in
+    is the matching dict of vars.in print lists.
+    """
 
+    def _fmt(val):
+        if np.isnan(val):
+            return 'missing'
+        return f"{val:.3f}"
+
+    lines = ["========================================",
+             "=========  batch summary          ======",
+             "========================================",
+             f"{len(cases)} cases, {int2_yr} yr averages at the last month"]
+    width = max([len(c[0]) for c in cases] + [4])
+    for name, title in (('atm', "Atmosphere"), ('ice', "Sea Ice"), ('lnd', "Land")):
+        rows = [(c, c[3][name]) for c in cases if c[3].get(name) is not None and len(c[3][name])]
+        if not rows:
+            continue
+        labels = [label for label, _ in _text_columns(rows[0][1], print_in[name])]
+        colw   = max([len(label) for label in labels] + [10]) + 2
+        hdr    = f"  {'Case':<{width}}  {'Period':<17}" + ''.join(f"{label:>{colw}}" for label in labels)
+        lines += ['', f"--- {title} ---", hdr, '  ' + '-' * (len(hdr) - 2)]
+        for (case_id, firstDate, lastDate, _), series in rows:
+            last = series.intavg2[-1]
+            vals = [last[series.index(label)] if label in series else np.nan for label in labels]
+            lines.append(f"  {case_id:<{width}}  {firstDate + '-' + lastDate:<17}"
+                         + ''.join(f"{_fmt(v):>{colw}}" for v in vals))
+
+    print('\n'.join(lines))
     print()
+    if outfile is not None:
+        with open(outfile, 'w') as f:
+            print('\n'.join(lines[3:]), file=f)
+        print("  Summary written to {}".format(outfile))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // print_drift_summary //
+# prints drift diagnostics over the last int2 months of every
+# column: mean, standard deviation, least-squares trend per
+# year, endpoint slope per year, and min/max (--drift)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def print_drift_summary(seriesA, seriesI, seriesL):
+
+    def _fmt(val):
+        if np.isnan(val):
+            return 'missing'
+        return f"{val:.4g}"
+
+    print("========================================")
+    print("=========  drift summary          ======")
+    print("========================================")
+    for title, series in (("Atmosphere", seriesA), ("Sea Ice", seriesI), ("Land", seriesL)):
+        if series is None or len(series) == 0:
+            continue
+        stats = series.window_stats(series.int2)
+        print(f"\n--- {title}, last {series.int2} month window ---")
+        hdr = (f"  {'Variable':<16}{'Mean':>12}{'Std':>12}{'Trend/yr':>12}"
+               f"{'Slope/yr':>12}{'Min':>12}{'Max':>12}")
+        print(hdr)
+        print('  ' + '-' * (len(hdr) - 2))
+        for xi, vname in enumerate(series.columns):
+            vals = [stats[k][-1, xi] for k in ('mean', 'std', 'trend', 'slope', 'min', 'max')]
+            print(f"  {vname:<16}" + ''.join(f"{_fmt(v):>12}" for v in vals))
+
+    print()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // print_profile //
+# prints the per-component, per-variable and slowest-file
+# breakdown from trend_core.summarize_profile (--timing)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def print_profile(summary):
+
+    if not summary['components']:
+        return
+
+    print("\n--- Read profile by component (worker seconds) ---")
+    print(f"  {'component':<12}{'files':>7}{'open':>9}{'read':>9}{'reduce':>9}{'MB':>10}{'files/s':>9}{'MB/s':>9}")
+    for comp, c in summary['components'].items():
+        print(f"  {comp:<12}{c['files']:>7}{c['open']:>9.2f}{c['read']:>9.2f}{c['reduce']:>9.2f}"
+              f"{c['bytes'] / 1.0e6:>10.1f}{c['files_per_s']:>9.1f}{c['mb_per_s']:>9.1f}")
+
+    print("\n--- Read profile by variable (worker seconds) ---")
+    print(f"  {'component':<12}{'variable':<14}{'read':>9}{'reduce':>9}{'MB':>10}")
+    for comp, variables in summary['variables'].items():
+        for vname, v in variables.items():
+            print(f"  {comp:<12}{vname:<14}{v['read']:>9.2f}{v['reduce']:>9.2f}{v['bytes'] / 1.0e6:>10.1f}")
+
+    print(f"\n--- Slowest {len(summary['slowest'])} files ---")
+    print(f"  {'open':>8}{'read':>8}{'reduce':>8}  file")
+    for r in summary['slowest']:
+        print(f"  {r['open']:>8.3f}{r['read']:>8.3f}{r['reduce']:>8.3f}  {r['file']}")
+    print()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# // print_prefetch //
+# prints the --prefetch stall report: per component, the seconds
+# spent reading (background thread) and reducing (main thread),
+# and how long each side waited on the other
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def print_prefetch(stalls):
+
+    stalls = {name: s for name, s in stalls.items() if s['files']}
+    if not stalls:
+        return
+
+    print("--- Prefetch (seconds) ---")
+    print(f"  {'component':<12}{'depth':>6}{'files':>7}{'read':>9}{'reduce':>9}{'reducer idle':>14}{'reader idle':>13}")
+    for name, s in stalls.items():
+        print(f"  {name:<12}{s['depth']:>6}{s['files']:>7}{s['read']:>9.2f}{s['reduce']:>9.2f}"
+              f"{s['reduce_wait']:>14.2f}{s['read_wait']:>13.2f}")
+    print("  reducer idle: waiting for a file to be read (I/O bound); "
+          "reader idle: waiting for room in the queue (reduction bound)")